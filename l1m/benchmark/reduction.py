@@ -0,0 +1,149 @@
+# coding: utf-8
+
+"""
+Benchmark suite for the steps of the tag-and-probe reduction and the trigger categorization.
+"""
+
+from __future__ import annotations
+
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable
+
+from columnflow.util import maybe_import
+
+from l1m.profiling import StepProfiler, null_profiler
+from l1m.reduction.cutflow import Cutflow
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+class TracingProfiler(StepProfiler):
+    """
+    Step profiler that additionally records the peak memory allocated within each step as
+    "peak_memory" in bytes. Allocations are traced with :py:mod:`tracemalloc`, which must be started
+    by the caller and slows down the execution, so times of this profiler should not be used.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._base = 0
+
+    def _reset_peak(self) -> None:
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+
+    def _record(self, *args, **kwargs):
+        peak_memory = tracemalloc.get_traced_memory()[1] - self._base
+        super()._record(*args, peak_memory=peak_memory, **kwargs)
+        self._reset_peak()
+
+    def laps(self) -> Callable:
+        self._reset_peak()
+        return super().laps()
+
+
+def run_reduction(
+    events: ak.Array,
+    selector_inst: Any,
+    category_producer_inst: Any = None,
+    profiler: StepProfiler = null_profiler,
+) -> ak.Array:
+    """
+    Applies the reduction *selector_inst*, e.g. :py:func:`l1m.reduction.muons.muon_reduction`, to
+    *events* and, when given, the trigger categorization *category_producer_inst* (see
+    :py:func:`l1m.production.trigger.trigger_category_ids`) to the resulting probes. Steps are
+    recorded as laps of the *profiler* by the selector itself and as "trigger_categorization" for
+    the categorization. Returns the probes.
+    """
+    probes, _ = selector_inst(events, defaultdict(float), cutflow=Cutflow(), profiler=profiler)
+
+    if category_producer_inst is not None:
+        lap = profiler.laps()
+        probes = category_producer_inst(probes)
+        lap("trigger_categorization", probes)
+
+    return probes
+
+
+def run_steps(
+    events: ak.Array,
+    func: Callable[[ak.Array, StepProfiler], Any],
+    n_repetitions: int = 3,
+    profile_memory: bool = True,
+) -> dict[str, dict]:
+    """
+    Calls *func* with *events* and a profiler, e.g. :py:func:`run_reduction`, *n_repetitions* times
+    and returns per recorded step the minimum wall time ("time") and CPU time ("cpu_time") in
+    seconds, and the numbers of rows before and after ("n_in", "n_out"), taken from the sizes of
+    the step results where recorded. Steps recorded several times within one call, e.g. per chunk
+    or variant, are summed over all occurrences, and their number is stored as "n_calls". With
+    *profile_memory*, one additional call traces the maximum peak memory allocated within each
+    step ("peak_memory", in bytes, see :py:class:`TracingProfiler`), which is kept separate since
+    tracing slows down the execution.
+    """
+    results = {}
+
+    for _ in range(max(n_repetitions, 1)):
+        profiler = StepProfiler()
+        func(events, profiler)
+
+        # sum all occurrences of steps within this call
+        totals = {}
+        n_rows = len(events)
+        for record in profiler.records:
+            total = totals.setdefault(record["name"], defaultdict(int))
+            total["time"] += record["dur"]
+            total["cpu_time"] += record["cpu"]
+            total["n_in"] += n_rows
+            n_rows = record.get("len", n_rows)
+            total["n_out"] += n_rows
+            total["n_calls"] += 1
+
+        for name, total in totals.items():
+            res = results.setdefault(name, {"time": np.inf, "cpu_time": np.inf})
+            res["time"] = min(res["time"], total["time"])
+            res["cpu_time"] = min(res["cpu_time"], total["cpu_time"])
+            res.update(n_in=total["n_in"], n_out=total["n_out"], n_calls=total["n_calls"])
+
+    if profile_memory:
+        profiler = TracingProfiler()
+        tracemalloc.start()
+        try:
+            func(events, profiler)
+        finally:
+            tracemalloc.stop()
+        for record in profiler.records:
+            res = results.setdefault(record["name"], {})
+            res["peak_memory"] = max(res.get("peak_memory", 0), record["peak_memory"])
+
+    return results
+
+
+def compare_to_baseline(
+    results: dict[str, dict],
+    baseline: dict[str, dict],
+    threshold: float = 0.2,
+    metrics: tuple[str] = ("time", "peak_memory"),
+) -> list[str]:
+    """
+    Compares the step *results* of :py:func:`run_steps` to those of a *baseline* and returns a
+    message for each metric in *metrics* that exceeds its baseline value by more than the relative
+    *threshold*. Steps and metrics missing in either of them are skipped.
+    """
+    regressions = []
+    for name, res in results.items():
+        for metric in metrics:
+            value = res.get(metric)
+            ref = baseline.get(name, {}).get(metric)
+            if value is None or not ref:
+                continue
+            if value > ref * (1 + threshold):
+                regressions.append(
+                    f"{name}: {metric} increased by {value / ref - 1:.1%} "
+                    f"({ref:.4g} -> {value:.4g}, threshold {threshold:.0%})",
+                )
+
+    return regressions
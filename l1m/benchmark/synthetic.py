@@ -0,0 +1,165 @@
+# coding: utf-8
+
+"""
+Deterministic generator of synthetic events with NanoAOD-like Muon and L1Mu collections.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+uproot = maybe_import("uproot")
+
+
+# z boson mass and width in GeV
+z_mass = 91.1876
+z_width = 2.4952
+
+# muon mass in GeV
+muon_mass = 0.10566
+
+# default probabilities of L1 muon qualities 0 to 15 for L1 muons matched to offline muons
+default_qual_probs = np.array([
+    0.01, 0.0, 0.0, 0.0, 0.01, 0.01, 0.01, 0.01,
+    0.03, 0.02, 0.02, 0.03, 0.25, 0.10, 0.10, 0.40,
+])
+
+
+def _fill_jagged(event_index: np.ndarray, n_events: int, fields: dict[str, np.ndarray]) -> ak.Array:
+    # sort flat objects by their event index (stable to keep the order within events) and nest them
+    order = np.argsort(event_index, kind="stable")
+    counts = np.bincount(event_index, minlength=n_events)
+    return ak.unflatten(ak.zip({name: values[order] for name, values in fields.items()}), counts)
+
+
+def generate_events(
+    n_events: int,
+    seed: int = 0,
+    z_fraction: float = 0.3,
+    n_muons: float = 0.8,
+    n_fake_l1: float = 0.3,
+    l1_efficiency: float = 0.93,
+    qual_probs: np.ndarray | None = None,
+    events_per_lumi: int = 10000,
+    run: int = 367100,
+    pileup: float = 30.0,
+) -> ak.Array:
+    """
+    Generates *n_events* synthetic events with NanoAOD-like *Muon* and *L1Mu* collections. The same
+    *seed* always yields the same events.
+
+    A fraction *z_fraction* of events contains an opposite-charge muon pair with an invariant mass
+    following the Z line shape. All events get additional muons with a Poisson-distributed number
+    with mean *n_muons* and a falling pt spectrum. Each offline muon is accompanied by an L1 muon
+    with probability *l1_efficiency*, with smeared kinematics, qualities drawn from *qual_probs*
+    (16 probabilities, defaulting to :py:data:`default_qual_probs`) and mostly in bunch crossing 0.
+    Additional unmatched L1 muons of low quality are added with a Poisson-distributed number with
+    mean *n_fake_l1*. Event numbers are consecutive, with luminosity blocks of *events_per_lumi*
+    events in a single *run*. The number of primary vertices *PV.npvs* is Poisson-distributed with
+    mean *pileup*. Collections are accompanied by their NanoAOD counters *nMuon* and *nL1Mu*.
+    """
+    rng = np.random.default_rng(seed)
+    if qual_probs is None:
+        qual_probs = default_qual_probs
+    qual_probs = np.asarray(qual_probs, dtype=np.float64)
+    qual_probs = qual_probs / qual_probs.sum()
+
+    # z decays: first muon with random direction, second one with a pt that yields the sampled mass
+    z_events = np.flatnonzero(rng.random(n_events) < z_fraction)
+    n_z = len(z_events)
+    mass = z_mass + 0.5 * z_width * rng.standard_cauchy(n_z)
+    mass = np.clip(mass, 60.0, 120.0)
+    pt1 = rng.normal(42.0, 10.0, n_z).clip(5.0, None)
+    eta1 = rng.uniform(-2.4, 2.4, n_z)
+    phi1 = rng.uniform(-np.pi, np.pi, n_z)
+    eta2 = rng.uniform(-2.4, 2.4, n_z)
+    dphi = np.pi + rng.normal(0.0, 0.5, n_z)
+    phi2 = (phi1 + dphi + np.pi) % (2 * np.pi) - np.pi
+    # massless approximation of m^2 = 2 * pt1 * pt2 * (cosh(deta) - cos(dphi))
+    pt2 = mass**2 / (2 * pt1 * (np.cosh(eta1 - eta2) - np.cos(dphi)))
+    charge1 = rng.choice(np.array([-1, 1], dtype=np.int32), n_z)
+
+    # additional muons
+    n_extra = rng.poisson(n_muons, n_events)
+    extra_events = np.repeat(np.arange(n_events), n_extra)
+    n_ext = len(extra_events)
+
+    muon_events = np.concatenate([z_events, z_events, extra_events])
+    n_mu = len(muon_events)
+    muon = {
+        "pt": np.concatenate([pt1, pt2, 3.0 + rng.exponential(8.0, n_ext)]).astype(np.float32),
+        "eta": np.concatenate([eta1, eta2, rng.uniform(-2.4, 2.4, n_ext)]).astype(np.float32),
+        "phi": np.concatenate([phi1, phi2, rng.uniform(-np.pi, np.pi, n_ext)]).astype(np.float32),
+        "mass": np.full(n_mu, muon_mass, dtype=np.float32),
+        "charge": np.concatenate([charge1, -charge1, rng.choice([-1, 1], n_ext)]).astype(np.int32),
+    }
+    muon["mediumId"] = rng.random(n_mu) < 0.92
+    muon["tightId"] = muon["mediumId"] & (rng.random(n_mu) < 0.9)
+
+    # l1 muons matched to offline muons
+    matched = np.flatnonzero(rng.random(n_mu) < l1_efficiency)
+    n_m = len(matched)
+    l1_phi = muon["phi"][matched] + rng.normal(0.0, 0.03, n_m)
+    l1_matched = {
+        "pt": muon["pt"][matched] * rng.normal(1.0, 0.15, n_m).clip(0.2, None),
+        "eta": muon["eta"][matched] + rng.normal(0.0, 0.02, n_m),
+        "phi": (l1_phi + np.pi) % (2 * np.pi) - np.pi,
+        "hwQual": rng.choice(16, n_m, p=qual_probs),
+        "bx": rng.choice(np.array([-1, 0, 1]), n_m, p=[0.01, 0.98, 0.01]),
+    }
+
+    # fake l1 muons
+    n_fake = rng.poisson(n_fake_l1, n_events)
+    fake_events = np.repeat(np.arange(n_events), n_fake)
+    n_f = len(fake_events)
+    l1_fake = {
+        "pt": 2.0 + rng.exponential(5.0, n_f),
+        "eta": rng.uniform(-2.4, 2.4, n_f),
+        "phi": rng.uniform(-np.pi, np.pi, n_f),
+        "hwQual": rng.choice(np.array([0, 4, 8]), n_f),
+        "bx": rng.choice(np.array([-2, -1, 0, 1, 2]), n_f),
+    }
+
+    l1_events = np.concatenate([muon_events[matched], fake_events])
+    l1mu = {
+        "pt": np.concatenate([l1_matched["pt"], l1_fake["pt"]]).astype(np.float32),
+        "eta": np.concatenate([l1_matched["eta"], l1_fake["eta"]]).astype(np.float32),
+        "phi": np.concatenate([l1_matched["phi"], l1_fake["phi"]]).astype(np.float32),
+        "mass": np.full(len(l1_events), muon_mass, dtype=np.float32),
+        "hwQual": np.concatenate([l1_matched["hwQual"], l1_fake["hwQual"]]).astype(np.int32),
+        "bx": np.concatenate([l1_matched["bx"], l1_fake["bx"]]).astype(np.int32),
+    }
+
+    return ak.zip({
+        "run": np.full(n_events, run, dtype=np.uint32),
+        "luminosityBlock": (1 + np.arange(n_events) // events_per_lumi).astype(np.uint32),
+        "event": np.arange(1, n_events + 1, dtype=np.uint64),
+        "PV": ak.zip({"npvs": rng.poisson(pileup, n_events).astype(np.int32)}),
+        "nMuon": np.bincount(muon_events, minlength=n_events).astype(np.int32),
+        "nL1Mu": np.bincount(l1_events, minlength=n_events).astype(np.int32),
+        "Muon": _fill_jagged(muon_events, n_events, muon),
+        "L1Mu": _fill_jagged(l1_events, n_events, l1mu),
+    }, depth_limit=1)
+
+
+def write_nano(events: ak.Array, path: str) -> None:
+    """
+    Writes synthetic *events* to a ROOT file at *path* with an "Events" tree in NanoAOD layout,
+    i.e., with counter branches such as "nMuon" and flat branches such as "Muon_pt". Counters are
+    written from the collections themselves.
+    """
+    arrays = {
+        field: events[field]
+        for field in events.fields
+        if not (field.startswith("n") and field[1:] in events.fields)
+    }
+    with uproot.recreate(path) as f:
+        tree = f.mktree(
+            "Events",
+            {field: array.type.content for field, array in arrays.items()},
+            counter_name=lambda counted: f"n{counted}",
+            field_name=lambda outer, inner: f"{outer}_{inner}",
+        )
+        tree.extend(arrays)
@@ -0,0 +1,1017 @@
+# coding: utf-8
+
+"""
+Helpers for columnar reading and processing of event chunks.
+"""
+
+from __future__ import annotations
+
+import gc
+import math
+import time
+import queue
+import threading
+import tracemalloc
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+import law
+import order as od
+
+from columnflow.columnar_util import ChunkedIOHandler, Route, set_ak_column, sort_ak_fields
+from columnflow.util import maybe_import
+
+from l1m.profiling import get_rss
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+uproot = maybe_import("uproot")
+pa = maybe_import("pyarrow")
+pc = maybe_import("pyarrow.compute")
+pq = maybe_import("pyarrow.parquet")
+
+
+class EntryRangeChunkedIOHandler(ChunkedIOHandler):
+    """
+    :py:class:`ChunkedIOHandler` that only iterates through the entries in the range
+    [*entry_start*, *entry_stop*) of its sources. Chunk positions refer to absolute entry numbers
+    while chunk indices start at zero for the first chunk of the range. When *entry_stop* is *None*,
+    the range extends to the last entry.
+    """
+
+    def __init__(self, *args, entry_start: int = 0, entry_stop: int | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.entry_start = entry_start
+        self.entry_stop = entry_stop
+
+    def open(self) -> None:
+        if not self.closed:
+            return
+
+        super().open()
+
+        # restrict the number of entries to the requested range
+        entry_stop = self.n_entries if self.entry_stop is None else min(self.entry_stop, self.n_entries)
+        self.entry_start = min(self.entry_start, entry_stop)
+        self.entry_stop = entry_stop
+        self.n_entries = entry_stop - self.entry_start
+
+    def create_chunk_position(
+        self,
+        n_entries: int,
+        chunk_size: int,
+        chunk_index: int,
+    ) -> ChunkedIOHandler.ChunkPosition:
+        pos = super().create_chunk_position(n_entries, chunk_size, chunk_index)
+
+        # shift the position by the start of the entry range
+        return pos._replace(
+            entry_start=pos.entry_start + self.entry_start,
+            entry_stop=pos.entry_stop + self.entry_start,
+        )
+
+
+class PipelinedChunkedIOHandler(EntryRangeChunkedIOHandler):
+    """
+    :py:class:`EntryRangeChunkedIOHandler` that overlaps reading (including decompression), the
+    processing in the main thread, and writing in three pipeline stages connected by bounded queues.
+
+    Chunks are read by :py:attr:`pool_size` threads, keeping up to *read_ahead* chunks read or
+    being read beyond the one currently processed. Callables added through :py:meth:`queue` while
+    a chunk is processed are executed in order in a separate writer thread. At most
+    *max_in_flight* chunks are held between the start of their reading and the end of their
+    writing, which caps the total memory independent of the speed of the stages.
+
+    The busy times of all stages are accumulated in :py:attr:`stage_times` and summarized by
+    :py:meth:`utilization`. Decompression within the reading of a chunk is parallelized by opening
+    ROOT sources with an uproot *decompression_executor*, e.g. a ``ThreadPoolExecutor``.
+    """
+
+    # marker put into the write queue after all callables of a chunk
+    _chunk_done = object()
+
+    def __init__(self, *args, read_ahead: int = 1, max_in_flight: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.read_ahead = max(read_ahead, 0)
+        self.max_in_flight = max(max_in_flight, 1)
+
+        self.stage_times = {}
+        self._write_queue = None
+        self._write_error = None
+        self._lock = threading.Lock()
+
+    def queue(self, func: Callable, args: tuple = (), kwargs: dict | None = None, **_) -> None:
+        """
+        Adds *func* to be called with *args* and *kwargs* in the writer thread. Must be called while
+        iterating.
+        """
+        if self._write_queue is None:
+            raise Exception(f"cannot queue callables outside of iterating {self.__class__.__name__}")
+        self._check_writer()
+        self._write_queue.put((func, args, kwargs or {}))
+
+    def _add_time(self, stage: str, duration: float) -> None:
+        with self._lock:
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + duration
+
+    def _check_writer(self) -> None:
+        if self._write_error is not None:
+            raise self._write_error
+
+    def _write_loop(self, slots: threading.BoundedSemaphore) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            if item is self._chunk_done:
+                slots.release()
+                continue
+
+            # skip remaining callables after the first error, but keep releasing slots
+            if self._write_error is not None:
+                continue
+            func, args, kwargs = item
+            t1 = time.perf_counter()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self._write_error = e
+            self._add_time("write", time.perf_counter() - t1)
+
+    def utilization(self) -> dict[str, float]:
+        """
+        Returns the fraction of the total iteration time each stage was busy, with the reading time
+        normalized to the number of reading threads. "wait" is the fraction the main thread waited
+        for chunks to be read.
+        """
+        total = self.stage_times.get("total", 0.0)
+        if not total:
+            return {}
+        return {
+            "read": self.stage_times.get("read", 0.0) / (total * self.pool_size),
+            "process": self.stage_times.get("process", 0.0) / total,
+            "write": self.stage_times.get("write", 0.0) / total,
+            "wait": self.stage_times.get("wait", 0.0) / total,
+        }
+
+    def _iter_impl(self):
+        if self.closed:
+            raise Exception(f"cannot iterate through closed {self.__class__.__name__}")
+
+        # read all sources of a chunk
+        def read(chunk_pos):
+            t1 = time.perf_counter()
+            chunks = [
+                source_handler.read(obj, chunk_pos, read_options=read_options, read_columns=read_columns)
+                for obj, source_handler, read_options, read_columns in zip(
+                    self.source_objects,
+                    self.source_handlers,
+                    self.read_options_list,
+                    self.read_columns_list,
+                )
+            ]
+            self._add_time("read", time.perf_counter() - t1)
+            return self.ReadResult((chunks if self.is_multi else chunks[0]), chunk_pos)
+
+        positions = deque(
+            self.create_chunk_position(self.n_entries, self.chunk_size, chunk_index)
+            for chunk_index in range(max(self.n_chunks, 1))
+        )
+
+        # start the writer thread
+        self.stage_times = {}
+        self._write_error = None
+        self._write_queue = queue.Queue(maxsize=self.max_in_flight)
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        writer = threading.Thread(target=self._write_loop, args=(slots,), daemon=True)
+        writer.start()
+
+        t_start = time.perf_counter()
+        futures = deque()
+        with ThreadPoolExecutor(self.pool_size) as pool:
+            try:
+                while positions or futures:
+                    # start reading further chunks up to the read-ahead depth while slots are free,
+                    # but block until a slot is free when there is nothing to process
+                    while positions and len(futures) <= self.read_ahead:
+                        if not slots.acquire(blocking=not futures):
+                            break
+                        futures.append(pool.submit(read, positions.popleft()))
+
+                    # wait for the next chunk
+                    t1 = time.perf_counter()
+                    result = futures.popleft().result()
+                    self._add_time("wait", time.perf_counter() - t1)
+                    self._check_writer()
+
+                    if self.iter_message:
+                        print(self.iter_message.format(pos=result.chunk_pos))
+
+                    t1 = time.perf_counter()
+                    try:
+                        yield (result.chunk, result.chunk_pos)
+                    finally:
+                        self._add_time("process", time.perf_counter() - t1)
+                        del result
+                        self._write_queue.put(self._chunk_done)
+                    gc.collect()
+
+            except:  # noqa
+                for future in futures:
+                    future.cancel()
+                self._write_error = self._write_error or Exception("iteration aborted")
+                raise
+
+            finally:
+                # finish all writes
+                self._write_queue.put(None)
+                writer.join()
+                self._write_queue = None
+                self._add_time("total", time.perf_counter() - t_start)
+
+        self._check_writer()
+
+
+class AdaptiveChunkSize(object):
+    """
+    Controls the sizes of event chunks so that the memory of this process stays within a *budget*
+    in bytes. The memory allocated by reading a chunk is measured per event, and the peak memory
+    allocated while processing it per cost unit. Cost units are weights of events passed to
+    :py:meth:`split` that model how the processing memory scales, e.g. with the number of object
+    pairs in cartesian products, and default to one per event. Estimates are the maxima of the
+    last *window* measurements, so that they follow changes of the input but stay conservative.
+
+    Allocations are traced with :py:mod:`tracemalloc` from :py:meth:`start` on, which covers all
+    numpy and awkward buffers regardless of memory retained by the allocator, on top of the resident
+    memory of the process at that time, e.g. of libraries and the selector setup. Only a *safety*
+    fraction of the budget is used. Sizes returned by :py:meth:`next_size` start at *initial_size*
+    until the first chunk was measured and are limited to [*min_size*, *max_size*].
+
+    .. code-block:: python
+
+        sizer = AdaptiveChunkSize(1.8 * 1024**3, initial_size=10000)
+        sizer.start()
+        with sizer.measure_read(n_events):
+            events = read(n_events)
+        weights = cost(events)
+        for start, stop in sizer.split(weights):
+            with sizer.measure(weights[start:stop].sum()):
+                process(events[start:stop])
+        n_events = sizer.next_size()
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        initial_size: int,
+        min_size: int = 1000,
+        max_size: int | None = None,
+        window: int = 8,
+        safety: float = 0.9,
+    ):
+        super().__init__()
+
+        self.budget = int(budget)
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size) if max_size else None
+        self.initial_size = self.clip(initial_size)
+        self.safety = safety
+
+        # recent measurements of read bytes per event, processing bytes per unit and units per event
+        self.read_bytes = deque(maxlen=window)
+        self.process_bytes = deque(maxlen=window)
+        self.units = deque(maxlen=window)
+
+        # resident memory when starting and number of split chunks
+        self.base_rss = None
+        self.n_split = 0
+
+    def clip(self, size: int) -> int:
+        size = max(int(size), self.min_size)
+        return size if self.max_size is None else min(size, self.max_size)
+
+    def start(self) -> None:
+        """
+        Starts tracing allocations, if not already done, and records the resident memory in use.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        self.base_rss = get_rss() - tracemalloc.get_traced_memory()[0]
+
+    def available(self) -> float:
+        """
+        Returns the number of bytes that can still be allocated within the budget.
+        """
+        if self.base_rss is None:
+            raise Exception(f"{self.__class__.__name__} must be started before measuring memory")
+        return self.safety * self.budget - self.base_rss - tracemalloc.get_traced_memory()[0]
+
+    @contextlib.contextmanager
+    def measure_read(self, n_events: int):
+        """
+        Context manager that measures the memory allocated by reading a chunk with *n_events* and
+        still held afterwards.
+        """
+        current = tracemalloc.get_traced_memory()[0]
+        yield
+        if n_events > 0:
+            self.read_bytes.append(max(tracemalloc.get_traced_memory()[0] - current, 0) / n_events)
+
+    @contextlib.contextmanager
+    def measure(self, n_units: float):
+        """
+        Context manager that measures the peak memory allocated while processing (a part of) a
+        chunk with *n_units* cost units.
+        """
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        yield
+        if n_units > 0:
+            self.process_bytes.append(max(tracemalloc.get_traced_memory()[1] - current, 0) / n_units)
+
+    def next_size(self) -> int:
+        """
+        Returns the number of events of the next chunk whose estimated memory of reading and
+        processing fits into the available budget.
+        """
+        if not self.read_bytes or not self.process_bytes:
+            return self.initial_size
+
+        units = max(self.units) if self.units else 1.0
+        per_event = max(self.read_bytes) + max(self.process_bytes) * units
+        return self.clip(self.available() / max(per_event, 1.0))
+
+    def split(self, weights: np.ndarray) -> list[tuple[int, int]]:
+        """
+        Returns the (start, stop) ranges of consecutive parts of a chunk with events of cost
+        *weights* that are processed one after another, so that the estimated memory of each part
+        fits into the available budget. Parts have at least :py:attr:`min_size` events, and chunks
+        are not split before the processing memory was measured once.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        total = float(weights.sum())
+        if n:
+            self.units.append(total / n)
+        if not self.process_bytes or n <= 1:
+            return [(0, n)]
+
+        max_units = self.available() / max(max(self.process_bytes), 1e-9)
+        if total <= max_units:
+            return [(0, n)]
+
+        # equal shares of the total cost, unless parts get smaller than the minimum size
+        n_parts = min(math.ceil(total / max(max_units, 1.0)), math.ceil(n / self.min_size))
+        if n_parts <= 1:
+            return [(0, n)]
+        self.n_split += 1
+
+        cum = np.cumsum(weights)
+        bounds = np.searchsorted(cum, total * np.arange(1, n_parts) / n_parts, side="right")
+        bounds = [0, *np.unique(np.clip(bounds, 1, n - 1)).tolist(), n]
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+class AdaptiveChunkedIOHandler(EntryRangeChunkedIOHandler):
+    """
+    :py:class:`EntryRangeChunkedIOHandler` whose chunk sizes are determined by an
+    :py:class:`AdaptiveChunkSize` *sizer* right before each chunk is read, based on the memory of
+    previous chunks. Chunks are read one after another in the iterating thread and callables added
+    through :py:meth:`queue` are executed immediately, so that only one chunk is held in memory at
+    a time. :py:attr:`n_chunks` is an estimate based on the nominal *chunk_size*.
+    """
+
+    def __init__(self, *args, sizer: AdaptiveChunkSize, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.sizer = sizer
+
+    def queue(self, func: Callable, args: tuple = (), kwargs: dict | None = None, **_) -> None:
+        func(*args, **(kwargs or {}))
+
+    def _iter_impl(self):
+        if self.closed:
+            raise Exception(f"cannot iterate through closed {self.__class__.__name__}")
+
+        index = 0
+        offset = 0
+        while index == 0 or offset < self.n_entries:
+            size = self.sizer.next_size()
+            stop = min(offset + size, self.n_entries)
+            chunk_pos = self.ChunkPosition(index, self.entry_start + offset, self.entry_start + stop, size)
+
+            with self.sizer.measure_read(stop - offset):
+                chunks = [
+                    source_handler.read(obj, chunk_pos, read_options=read_options, read_columns=read_columns)
+                    for obj, source_handler, read_options, read_columns in zip(
+                        self.source_objects,
+                        self.source_handlers,
+                        self.read_options_list,
+                        self.read_columns_list,
+                    )
+                ]
+
+            if self.iter_message:
+                print(self.iter_message.format(pos=chunk_pos))
+
+            yield ((chunks if self.is_multi else chunks[0]), chunk_pos)
+
+            del chunks
+            gc.collect()
+            index += 1
+            offset = stop
+
+
+def get_selected_entry_spans(
+    tree: uproot.TTree,
+    entry_start: int,
+    entry_stop: int,
+    mask: np.ndarray,
+) -> list[tuple[int, int]]:
+    """
+    Returns the (entry start, entry stop) spans within [*entry_start*, *entry_stop*) of the *tree*
+    that need to be read to obtain all entries selected by the boolean *mask*. Spans are aligned to
+    the clusters common to all branches so that clusters without any selected entry, and thus their
+    baskets, are skipped entirely. Adjacent spans are merged.
+    """
+    # cluster boundaries within the range
+    offsets = np.asarray(tree.common_entry_offsets(), dtype=np.int64)
+    offsets = np.union1d(np.clip(offsets, entry_start, entry_stop), [entry_start, entry_stop])
+
+    # clusters containing at least one selected entry
+    selected = entry_start + np.flatnonzero(mask)
+    clusters = np.unique(np.searchsorted(offsets, selected, side="right") - 1)
+
+    spans = []
+    for start, stop in zip(offsets[clusters], offsets[clusters + 1]):
+        if spans and spans[-1][1] == start:
+            spans[-1] = (spans[-1][0], int(stop))
+        else:
+            spans.append((int(start), int(stop)))
+
+    return spans
+
+
+def read_selected_coffea_root(
+    nano_file: uproot.ReadOnlyDirectory,
+    chunk_pos: ChunkedIOHandler.ChunkPosition,
+    mask: np.ndarray,
+    read_columns: set[Route],
+) -> ak.Array:
+    """
+    Reads the *read_columns* of all entries of the chunk at *chunk_pos* in the *nano_file* that are
+    selected by the boolean *mask*, with only those clusters being decompressed that contain at
+    least one selected entry (see :py:func:`get_selected_entry_spans`).
+    """
+    spans = get_selected_entry_spans(nano_file["Events"], chunk_pos.entry_start, chunk_pos.entry_stop, mask)
+
+    # read an empty chunk to preserve the structure when nothing is selected
+    if not spans:
+        spans = [(chunk_pos.entry_start, chunk_pos.entry_start)]
+
+    chunks = []
+    for start, stop in spans:
+        chunk = ChunkedIOHandler.read_coffea_root(
+            nano_file,
+            chunk_pos._replace(entry_start=start, entry_stop=stop),
+            read_columns=read_columns,
+        )
+        offset = start - chunk_pos.entry_start
+        chunks.append(chunk[mask[offset:offset + stop - start]])
+
+    return chunks[0] if len(chunks) == 1 else ak.concatenate(chunks, axis=0)
+
+
+def join_events(
+    probes: ak.Array,
+    event_table: ak.Array,
+    columns: Iterable[str] | None = None,
+) -> ak.Array:
+    """
+    Joins event-level *columns* (all by default) of the *event_table* to flat *probes* via their
+    "event_row" index, i.e., broadcasts them to all probes of the same event.
+    """
+    rows = ak.to_numpy(probes.event_row)
+    for column in (columns or event_table.fields):
+        probes = set_ak_column(probes, column, Route(column).apply(event_table)[rows])
+
+    return probes
+
+
+def sort_by_columns(
+    probes: ak.Array,
+    columns: Iterable[str],
+    event_table: ak.Array | None = None,
+) -> tuple[ak.Array, ak.Array | None]:
+    """
+    Sorts flat *probes* by the event-level *columns*, e.g. run and luminosity block, so that row
+    groups written from them cover narrow ranges of these columns. The sort is stable, keeping the
+    original order of events with equal values. When an *event_table* is given, it is sorted
+    instead, the "event_row" index of the *probes* is remapped and the *probes* are reordered to
+    follow their events. Returns the sorted *probes* and *event_table*. Inputs that are already
+    sorted are returned unchanged.
+    """
+    table = probes if event_table is None else event_table
+    keys = [ak.to_numpy(Route(column).apply(table)) for column in columns]
+    if not len(table) or not keys:
+        return probes, event_table
+
+    # skip the sort when the lexicographic order already holds
+    order = np.lexsort(keys[::-1])
+    if np.array_equal(order, np.arange(len(order))):
+        return probes, event_table
+
+    if event_table is None:
+        return probes[order], None
+
+    # new row of each event and stable order of probes following their events
+    rows = np.empty_like(order)
+    rows[order] = np.arange(len(order))
+    event_row = rows[ak.to_numpy(probes.event_row)]
+    probes = set_ak_column(probes, "event_row", event_row)
+    probes = probes[np.argsort(event_row, kind="stable")]
+
+    return probes, event_table[order]
+
+
+class StoragePolicy(object):
+    """
+    Storage policy for writing arrow tables to parquet, consisting of a compression *codec* and
+    *compression_level*, and per-column settings in *columns*. The latter maps patterns, matched
+    against dot-separated column names such as "ProbeMuon.L1ProbeMuon.hwQual" (i.e., without list
+    levels), to dictionaries with an optional target "type" and "encoding". The first matching
+    pattern is used per column.
+
+    Types can be any name understood by ``pyarrow.type_for_alias``, e.g. "int8" or "float32".
+    Encodings are "dictionary" (the default of all integer and float columns), "plain", "delta" and
+    "byte_stream_split".
+
+    .. code-block:: python
+
+        policy = StoragePolicy(
+            codec="zstd",
+            compression_level=3,
+            columns={
+                "*.hwQual": {"type": "int8"},
+                "*.pt": {"type": "float32", "encoding": "byte_stream_split"},
+                "event": {"encoding": "delta"},
+            },
+        )
+    """
+
+    encodings = {
+        "plain": "PLAIN",
+        "delta": "DELTA_BINARY_PACKED",
+        "byte_stream_split": "BYTE_STREAM_SPLIT",
+    }
+
+    def __init__(
+        self,
+        codec: str = "snappy",
+        compression_level: int | None = None,
+        columns: dict[str, dict] | None = None,
+    ):
+        super().__init__()
+
+        self.codec = codec
+        self.compression_level = compression_level
+        self.columns = dict(columns or {})
+
+        # check encodings
+        for pattern, settings in self.columns.items():
+            encoding = settings.get("encoding", "dictionary")
+            if encoding != "dictionary" and encoding not in self.encodings:
+                raise ValueError(f"unknown encoding '{encoding}' for column pattern '{pattern}'")
+
+    @classmethod
+    def from_config(cls, config_inst: od.Config, task_family: str) -> StoragePolicy | None:
+        """
+        Returns the policy defined in the auxiliary ``storage_policy`` entry of the *config_inst*
+        for the *task_family*, or *None* if not existing.
+        """
+        policy = config_inst.x("storage_policy", {}).get(task_family)
+        return cls(**policy) if policy else None
+
+    def get_settings(self, name: str) -> dict:
+        for pattern, settings in self.columns.items():
+            if law.util.multi_match(name, pattern):
+                return settings
+        return {}
+
+    def _map_field(self, f: pa.Field, name: str, path: str, leaves: dict[str, dict]) -> pa.Field:
+        # recursively replace leaf types and store the parquet column path and settings of leaves,
+        # with *name* being the column name without and *path* the parquet path with list levels
+        typ = f.type
+        if pa.types.is_struct(typ):
+            typ = pa.struct([
+                self._map_field(child, f"{name}.{child.name}", f"{path}.{child.name}", leaves)
+                for child in typ
+            ])
+        elif pa.types.is_list(typ) or pa.types.is_large_list(typ):
+            list_cls = pa.large_list if pa.types.is_large_list(typ) else pa.list_
+            typ = list_cls(self._map_field(typ.value_field, name, f"{path}.list.element", leaves))
+        else:
+            settings = self.get_settings(name)
+            leaves[path] = settings
+            if "type" in settings:
+                typ = pa.type_for_alias(settings["type"])
+
+        return pa.field(f.name, typ, f.nullable, f.metadata)
+
+    def get_schema(self, schema: pa.Schema) -> tuple[pa.Schema, dict[str, dict]]:
+        """
+        Returns the *schema* with types replaced according to the policy, and a dictionary mapping
+        parquet paths of all leaf columns to their settings.
+        """
+        leaves = {}
+        fields = [self._map_field(f, f.name, f.name, leaves) for f in schema]
+        return pa.schema(fields, metadata=schema.metadata), leaves
+
+    def apply(self, table: pa.Table) -> pa.Table:
+        """
+        Casts the *table* to the column types defined by the policy.
+        """
+        schema, _ = self.get_schema(table.schema)
+        return table if schema == table.schema else table.cast(schema)
+
+    def get_writer_opts(self, schema: pa.Schema) -> dict:
+        """
+        Returns keyword arguments for ``pyarrow.parquet.ParquetWriter`` for tables with *schema*.
+        """
+        _, leaves = self.get_schema(schema)
+
+        use_dictionary = []
+        column_encoding = {}
+        for path, settings in leaves.items():
+            encoding = settings.get("encoding", "dictionary")
+            if encoding == "dictionary":
+                use_dictionary.append(path)
+            else:
+                column_encoding[path] = self.encodings[encoding]
+
+        opts = {
+            "compression": self.codec,
+            "use_dictionary": use_dictionary,
+            "column_encoding": column_encoding or None,
+        }
+        if self.compression_level is not None:
+            opts["compression_level"] = self.compression_level
+
+        return opts
+
+
+class ParquetStreamWriter(object):
+    """
+    Writes tables of consecutive chunks as row groups into a single parquet file at *path* without
+    intermediate files. Chunks are identified by a sequence number starting at zero and can be
+    passed to :py:meth:`write` in any order and from multiple threads. They are buffered until all
+    preceding chunks are written, so that the row order in the file follows the sequence numbers.
+
+    The schema is defined by the first non-empty table, and tables of empty chunks are skipped.
+    Column types and writer options can be controlled through a storage *policy* (see
+    :py:class:`StoragePolicy`). When *offset_column* is set, the number of rows passed as
+    *n_offset_rows* with all preceding chunks is added to this integer column, e.g. to turn
+    per-chunk row indices into global ones. *writer_opts* are forwarded to
+    ``pyarrow.parquet.ParquetWriter``.
+
+    .. code-block:: python
+
+        with ParquetStreamWriter("events.parquet") as writer:
+            writer.write(1, events_1)
+            writer.write(0, events_0)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        offset_column: str | None = None,
+        policy: StoragePolicy | None = None,
+        writer_opts: dict | None = None,
+    ):
+        super().__init__()
+
+        self.path = path
+        self.offset_column = offset_column
+        self.policy = policy
+        self.writer_opts = writer_opts or {}
+
+        # state
+        self.writer = None
+        self.first_table = None
+        self.next_seq = 0
+        self.offset = 0
+        self.buffer = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> ParquetStreamWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # on errors, drop buffered chunks so that the original exception is not masked
+        if exc_type is not None:
+            self.buffer.clear()
+        self.close()
+
+    @classmethod
+    def to_table(cls, ak_array: ak.Array) -> pa.Table:
+        """
+        Converts an *ak_array* to an arrow table with recursively sorted fields, identical to the
+        layout written by ``cf.columnar_util.sorted_ak_to_parquet``.
+        """
+        return ak.to_arrow_table(sort_ak_fields(ak_array), extensionarray=False)
+
+    def write(self, seq: int, table: ak.Array | pa.Table, n_offset_rows: int = 0) -> None:
+        """
+        Adds the *table* of the chunk with sequence number *seq* and writes all buffered chunks that
+        are next in order.
+        """
+        if not isinstance(table, pa.Table):
+            table = self.to_table(table)
+        if self.policy:
+            table = self.policy.apply(table)
+
+        with self.lock:
+            self.buffer[seq] = (table, n_offset_rows)
+            while self.next_seq in self.buffer:
+                self._write_table(*self.buffer.pop(self.next_seq))
+                self.next_seq += 1
+
+    def _write_table(self, table: pa.Table, n_offset_rows: int) -> None:
+        if self.offset_column:
+            idx = table.schema.get_field_index(self.offset_column)
+            table = table.set_column(idx, self.offset_column, pc.add(table[self.offset_column], self.offset))
+            self.offset += n_offset_rows
+
+        if self.first_table is None:
+            self.first_table = table
+        if not table.num_rows:
+            return
+
+        if self.writer is None:
+            self.writer = self._open(table.schema)
+        elif table.schema != self.writer.schema:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def _open(self, schema: pa.Schema) -> pq.ParquetWriter:
+        writer_opts = self.policy.get_writer_opts(schema) if self.policy else {}
+        writer_opts.update(self.writer_opts)
+        return pq.ParquetWriter(self.path, schema, **writer_opts)
+
+    def close(self) -> None:
+        """
+        Closes the file. When only empty chunks were written, the first one is written to have a
+        readable file with a valid schema. An exception is raised when chunks are still buffered.
+        """
+        if self.buffer:
+            raise Exception(
+                f"{self.__class__.__name__} cannot be closed while chunks are buffered, missing "
+                f"chunk {self.next_seq} for writing chunks {sorted(self.buffer)} to {self.path}",
+            )
+
+        if self.writer is None and self.first_table is not None:
+            self.writer = self._open(self.first_table.schema)
+            self.writer.write_table(self.first_table)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.first_table = None
+
+
+def row_group_ranges(f: pq.ParquetFile, columns: list[str]) -> np.ndarray:
+    """
+    Returns the minimum and maximum values of the flat *columns* in all row groups of the parquet
+    file *f* with the shape ``(n_row_groups, n_columns, 2)``. Values are taken from the row group
+    statistics and only read from the row group when statistics are missing. Empty row groups get
+    ranges from the maximum to the minimum integer, matching no selection.
+    """
+    meta = f.metadata
+    paths = [meta.schema.column(i).path for i in range(meta.num_columns)]
+    missing = set(columns) - set(paths)
+    if missing:
+        raise ValueError(f"columns {', '.join(sorted(missing))} not found in parquet file")
+
+    info = np.iinfo(np.int64)
+    ranges = np.empty((meta.num_row_groups, len(columns), 2), dtype=np.int64)
+    ranges[..., 0], ranges[..., 1] = info.max, info.min
+    for g in range(meta.num_row_groups):
+        row_group = meta.row_group(g)
+        if not row_group.num_rows:
+            continue
+        for c, column in enumerate(columns):
+            stats = row_group.column(paths.index(column)).statistics
+            if stats is not None and stats.has_min_max:
+                ranges[g, c] = stats.min, stats.max
+            else:
+                values = f.read_row_group(g, columns=[column])[column]
+                ranges[g, c] = pc.min(values).as_py(), pc.max(values).as_py()
+
+    return ranges
+
+
+def merge_parquet_clustered(
+    src_paths: list[str],
+    dst_path: str,
+    columns: list[str],
+    target_row_group_size: int = 0,
+    policy: StoragePolicy | None = None,
+    writer_opts: dict | None = None,
+) -> None:
+    """
+    Merges the parquet files in *src_paths* into *dst_path*, reordering row groups by their minimum
+    values of the flat *columns* (see :py:func:`row_group_ranges`), e.g. run and luminosity block,
+    instead of keeping the file order. Row groups whose rows are sorted by *columns* thus yield a
+    file clustered by these columns without a full sort. With a positive *target_row_group_size*,
+    consecutive row groups are combined until the number of rows is reached. Empty row groups are
+    skipped. Writer options are taken from the storage *policy* (see :py:class:`StoragePolicy`),
+    updated by *writer_opts* and forwarded to ``pyarrow.parquet.ParquetWriter``.
+    """
+    # collect row groups of all files with their ranges
+    files = [pq.ParquetFile(path) for path in src_paths]
+    groups = [
+        (tuple(ranges[:, 0]) + tuple(ranges[:, 1]), i, g)
+        for i, f in enumerate(files)
+        for g, ranges in enumerate(row_group_ranges(f, columns))
+        if f.metadata.row_group(g).num_rows
+    ]
+    groups.sort()
+
+    # schema of the first non-empty file
+    schema = next((f.schema_arrow for f in files if f.metadata.num_rows), files[0].schema_arrow)
+
+    opts = policy.get_writer_opts(schema) if policy else {}
+    opts.update(writer_opts or {})
+
+    with pq.ParquetWriter(dst_path, schema, **opts) as writer:
+        tables, n_rows = [], 0
+        for _, i, g in groups:
+            table = files[i].read_row_group(g)
+            tables.append(table if table.schema == schema else table.cast(schema))
+            n_rows += table.num_rows
+            if n_rows >= target_row_group_size:
+                writer.write_table(pa.concat_tables(tables))
+                tables, n_rows = [], 0
+        if tables:
+            writer.write_table(pa.concat_tables(tables))
+        if not groups:
+            writer.write_table(schema.empty_table())
+
+    for f in files:
+        f.close()
+
+
+class RowGroupIndex(object):
+    """
+    Sidecar index of the ranges of flat integer *columns*, e.g. run and luminosity block, in all row
+    groups of a set of parquet files, so that readers can select files and row groups for ranges of
+    these columns without opening any file. Files are identified by *names*, e.g. their basenames,
+    which readers map to paths.
+
+    Indices are built from row group statistics with :py:meth:`add_file`, converted to and from
+    json-serializable dictionaries with :py:meth:`to_dict` and :py:meth:`from_dict`, and queried
+    with :py:meth:`select` or :py:meth:`read`, with ranges given per column as inclusive
+    ``(low, high)`` tuples.
+
+    .. code-block:: python
+
+        index = RowGroupIndex(["run", "luminosityBlock"])
+        for path in paths:
+            index.add_file(path, os.path.basename(path))
+        index.select(run=(367100, 367200))
+        # -> {"events_0.parquet": [3, 4], "events_2.parquet": [0]}
+        table = index.read({name: os.path.join(base, name) for name in index.names}, run=(367100, 367200))
+    """
+
+    def __init__(self, columns: list[str]):
+        super().__init__()
+
+        self.columns = list(columns)
+
+        # file names, number of rows per row group and [row group, column, (min, max)] ranges
+        self.names = []
+        self.file_indices = np.zeros(0, dtype=np.int32)
+        self.row_groups = np.zeros(0, dtype=np.int32)
+        self.num_rows = np.zeros(0, dtype=np.int64)
+        self.ranges = np.zeros((0, len(self.columns), 2), dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} columns={','.join(self.columns)} files={len(self.names)} "
+            f"row_groups={len(self.row_groups)} at {hex(id(self))}>"
+        )
+
+    def add_file(self, path: str, name: str | None = None) -> None:
+        """
+        Adds all row groups of the parquet file at *path* under *name*, defaulting to *path*.
+        """
+        with pq.ParquetFile(path) as f:
+            ranges = row_group_ranges(f, self.columns)
+            num_rows = [f.metadata.row_group(g).num_rows for g in range(f.metadata.num_row_groups)]
+
+        self.file_indices = np.append(self.file_indices, np.full(len(ranges), len(self.names), dtype=np.int32))
+        self.row_groups = np.append(self.row_groups, np.arange(len(ranges), dtype=np.int32))
+        self.num_rows = np.append(self.num_rows, np.asarray(num_rows, dtype=np.int64))
+        self.ranges = np.concatenate([self.ranges, ranges])
+        self.names.append(path if name is None else name)
+
+    def mask(self, **ranges: tuple[int, int]) -> np.ndarray:
+        """
+        Returns a mask of all row groups overlapping the inclusive *ranges* of all given columns.
+        """
+        unknown = set(ranges) - set(self.columns)
+        if unknown:
+            raise ValueError(f"columns {', '.join(sorted(unknown))} not in {self!r}")
+
+        mask = self.num_rows > 0
+        for column, (low, high) in ranges.items():
+            c = self.columns.index(column)
+            mask &= (self.ranges[:, c, 1] >= low) & (self.ranges[:, c, 0] <= high)
+        return mask
+
+    def select(self, **ranges: tuple[int, int]) -> dict[str, list[int]]:
+        """
+        Returns the indices of all row groups possibly containing rows in the *ranges*, mapped to
+        the names of their files. Files without such row groups are skipped.
+        """
+        selected = {}
+        mask = self.mask(**ranges)
+        for i, g in zip(self.file_indices[mask], self.row_groups[mask]):
+            selected.setdefault(self.names[i], []).append(int(g))
+        return selected
+
+    def read(
+        self,
+        paths: dict[str, str],
+        columns: list[str] | None = None,
+        **ranges: tuple[int, int],
+    ) -> pa.Table:
+        """
+        Reads the *columns* (all by default) of all rows in the *ranges* from the selected row
+        groups of the files with *paths*, mapped to their names. Rows of selected row groups outside
+        the *ranges* are filtered. Nested *columns* such as "ProbeMuon.pt" are returned within their
+        top-level columns.
+        """
+        read_columns = None if columns is None else list(dict.fromkeys([*columns, *ranges]))
+
+        tables = []
+        for name, row_groups in self.select(**ranges).items():
+            with pq.ParquetFile(paths[name]) as f:
+                table = f.read_row_groups(row_groups, columns=read_columns)
+            mask = None
+            for column, (low, high) in ranges.items():
+                column_mask = pc.and_(
+                    pc.greater_equal(table[column], low),
+                    pc.less_equal(table[column], high),
+                )
+                mask = column_mask if mask is None else pc.and_(mask, column_mask)
+            tables.append(table if mask is None else table.filter(mask))
+
+        if not tables:
+            return pa.table({})
+        table = pa.concat_tables(tables)
+        if columns is None:
+            return table
+        return table.select(list(dict.fromkeys(column.split(".", 1)[0] for column in columns)))
+
+    def to_dict(self) -> dict:
+        return {
+            "columns": self.columns,
+            "files": [
+                {
+                    "name": name,
+                    "row_groups": [
+                        {
+                            "num_rows": int(self.num_rows[j]),
+                            **{
+                                column: [int(v) for v in self.ranges[j, c]]
+                                for c, column in enumerate(self.columns)
+                            },
+                        }
+                        for j in np.flatnonzero(self.file_indices == i)
+                    ],
+                }
+                for i, name in enumerate(self.names)
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> RowGroupIndex:
+        index = cls(data["columns"])
+        for i, file_data in enumerate(data["files"]):
+            row_groups = file_data["row_groups"]
+            index.names.append(file_data["name"])
+            index.file_indices = np.append(index.file_indices, np.full(len(row_groups), i, dtype=np.int32))
+            index.row_groups = np.append(index.row_groups, np.arange(len(row_groups), dtype=np.int32))
+            index.num_rows = np.append(index.num_rows, [rg["num_rows"] for rg in row_groups]).astype(np.int64)
+            ranges = np.array(
+                [[rg[column] for column in index.columns] for rg in row_groups],
+                dtype=np.int64,
+            ).reshape(len(row_groups), len(index.columns), 2)
+            index.ranges = np.concatenate([index.ranges, ranges])
+        return index
@@ -1,10 +1,17 @@
 # coding: utf-8
 
 """
-Collection of patches of underlying columnflow tasks.
+Collection of patches of underlying columnflow tasks. They are applied with :py:func:`patch_all` by
+the task modules of this analysis that import the patched tasks, so that importing the analysis
+itself does not import columnflow.
 """
 
+from __future__ import annotations
+
 import os
+import math
+import functools
+from typing import Callable
 
 import law
 from columnflow.util import memoize
@@ -34,6 +41,75 @@ def patch_bundle_repo_exclude_files():
     logger.debug("patched exclude_files of cf.BundleRepo")
 
 
+def merge_reduced_events(task, inputs: list, output: dict) -> None:
+    """
+    Merge method of cf.MergeReducedEvents that orders row groups by the event-level columns in the
+    "reduced_sort_columns" config entry, e.g. run and luminosity block, instead of concatenating
+    files, keeping the storage policy of the reduction (see
+    :py:func:`l1m.columnar_util.merge_parquet_clustered`). Without sort columns, files are merged as
+    in columnflow.
+    """
+    from l1m.columnar_util import StoragePolicy, merge_parquet_clustered
+
+    inputs = [inp["events"] for inp in inputs]
+    sort_columns = list(task.config_inst.x("reduced_sort_columns", []))
+    if not sort_columns:
+        law.pyarrow.merge_parquet_task(task, inputs, output["events"])
+        return
+
+    with law.localize_file_targets(inputs, mode="r") as local_inputs:
+        with output["events"].localize("w") as local_output:
+            with task.publish_step(f"merging {len(inputs)} parquet files ...", runtime=True):
+                merge_parquet_clustered(
+                    [inp.abspath for inp in local_inputs],
+                    local_output.abspath,
+                    sort_columns,
+                    target_row_group_size=task.config_inst.x("reduced_row_group_size", 0),
+                    policy=StoragePolicy.from_config(task.config_inst, "l1m.CustomReduceEvents"),
+                )
+            size = law.util.human_bytes(local_output.stat().st_size, fmt=True)
+            task.publish_message(f"merged file size: {size}")
+
+
+def merge_reduction_stats_run(run: Callable) -> Callable:
+    """
+    Wraps the *run* method of cf.MergeReductionStats to correct the merge factor for reductions
+    whose branches are partitioned by event ranges (see the *partition_size* parameter of
+    :py:class:`l1m.tasks.reduction.CustomReduceEvents`). cf derives it from the sizes of reduced
+    branch outputs, but applies it to the number of input files, so it is recomputed in units of
+    input files (see :py:func:`l1m.tasks.external.partition_merge_factor`).
+    """
+    @functools.wraps(run)
+    def wrapper(task):
+        run(task)
+
+        reduce_task = task.reqs.ReduceEvents.req(task, _exclude={"branches"})
+        if not getattr(reduce_task, "partitioned", False):
+            return
+
+        from l1m.tasks.external import partition_merge_factor
+
+        output = task.output()["stats"]
+        stats = output.load(formatter="json")
+        n_files = task.dataset_info_inst.n_files
+        n_partitions = len(reduce_task.get_branch_map())
+        stats["merge_factor"] = partition_merge_factor(
+            stats["avg_size"],
+            stats["max_size_merged"],
+            n_files,
+            n_partitions,
+        )
+        output.dump(stats, indent=4, formatter="json")
+
+        n_merged = int(math.ceil(n_files / stats["merge_factor"]))
+        task.publish_message(
+            f"partitioned reduction: merging {n_partitions} partitions of {n_files} files into "
+            f"{n_merged} files (merge factor {stats['merge_factor']} in units of files)",
+        )
+
+    return wrapper
+
+
 @memoize
 def patch_reduce_events():
     """
@@ -51,6 +127,12 @@ def patch_reduce_events():
     MergeReductionStats.reqs.ReduceEvents = CustomReduceEvents
     MergeReducedEvents.reqs.ReduceEvents = CustomReduceEvents
 
+    # cluster merged files by run and luminosity block
+    MergeReducedEvents.merge = merge_reduced_events
+
+    # base the merging of partitioned reductions on the number of input files
+    MergeReductionStats.run = merge_reduction_stats_run(MergeReductionStats.run)
+
     from columnflow.tasks.selection import MergeSelectionStats
     MergeSelectionStats.reqs.SelectEvents = CustomReduceEvents
 
@@ -8,6 +8,7 @@ import order as od
 from columnflow.util import DotDict, maybe_import
 from columnflow.selection import selector, Selector
 
+np = maybe_import("numpy")
 ak = maybe_import("awkward")
 
 
@@ -21,7 +22,7 @@ def add_triggers(config: od.Config) -> None:
         "SingleMu7": [11, 12, 13, 14, 15],
         "DoubleMu": [8, 9, 10, 11, 12, 13, 14, 15],
         "MuOpen": [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15],
-        "TFMatch": [0],
+        "TFMatch": list(range(16)),
     }
     trig_pt = {  # Minimum L1T pT for probe muon
         "SingleMu": 22,
@@ -43,10 +44,24 @@ def add_triggers(config: od.Config) -> None:
         config.x.triggers[trig_key] = DotDict({
             "name": trig_key,
             "id": trig_id[trig_key],
+            "bit": trig_id[trig_key] - 1,  # position in the per-probe trigger bitmask
             "pt": trig_pt[trig_key],
             "qual": trig_qual[trig_key],
         })
 
+    # boundaries in |eta| between the barrel, overlap and endcap track finder regions
+    config.x.tf_region_edges = [0.83, 1.24]
+
+    # threshold scan mode of CustomReduceEvents: the highest matched L1 pt is stored per probe for
+    # each minimum L1 quality and histogrammed in bins centered on the hardware pt values (steps of
+    # 0.5 GeV) for all probe variables, from which efficiencies of arbitrary thresholds are derived
+    config.x.threshold_scan = DotDict({
+        "min_quals": list(range(16)),
+        "l1_pt_edges": (np.arange(513) * 0.5 - 0.25).tolist(),
+        "variables": ["probe_pt", "probe_eta"],
+        "denom_category": "valid_probe",
+    })
+
 
 def add_trigger_categories(config: od.Config) -> None:
     """
@@ -73,8 +88,8 @@ def add_trigger_categories(config: od.Config) -> None:
             name=f"trig_{trigger.name}",
             id=200 + trigger.id,
             selection=f"{trigger.name}_sel",
-            label=r"%s ($p_{T} > %.1f$, $qual \geq %i$)" % (trigger.name, trigger.pt, trigger.qual[0]),
-            # label=f"{trigger.name} ($p_{T} > {trigger.pt}$, $qual >= {trigger.qual[0]}$)",
+            label=r"%s ($p_{T} > %.1f$, $qual \geq %i$)" % (trigger.name, trigger.pt, min(trigger.qual)),
+            aux={"trigger": trigger.name},
         )
 
 
@@ -85,22 +100,11 @@ def valid_probe(self: Selector, events: ak.Array, **kwargs) -> ak.Array:
 
 for trigger_name in trigger_names:
     @selector(
-        uses={
-            "ProbeMuon.TagMuon", "ProbeMuon.L1ProbeMuon.dr",
-            "ProbeMuon.L1ProbeMuon.pt", "ProbeMuon.L1ProbeMuon.hwQual",
-        },
+        uses={"trigger_bits"},
         cls_name=f"{trigger_name}_sel",
     )
     def trigger_sel(self: Selector, events: ak.Array, **kwargs) -> ak.Array:
-        l1mu = events.ProbeMuon.L1ProbeMuon
+        # trigger bits are computed once per probe by the trigger_bits producer
         trigger = self.config_inst.x.triggers[self.cls_name.replace("_sel", "")]
 
-        l1mu_reqs = (
-            (l1mu.pt > trigger.pt) &
-            (l1mu.hwQual >= trigger.qual[0]) &
-            (l1mu.dr < 0.4)  # this is the dr to the ProbeMuon (should be required somewhere before)
-        )
-
-        mask = ak.num(l1mu[l1mu_reqs], axis=1) >= 1
-
-        return mask
+        return (events.trigger_bits & (1 << trigger.bit)) != 0
@@ -46,3 +46,30 @@ def add_probe_variables(config: od.Config) -> None:
         binning=(40, 0, 200),
         x_title="Probe Muon mass",
     )
+    config.add_variable(
+        name="probe_charge",
+        expression="ProbeMuon.charge",
+        binning=(3, -1.5, 1.5),
+        x_title="Probe Muon charge",
+        discrete_x=True,
+    )
+    config.add_variable(
+        name="probe_tf_region",
+        expression="tf_region",
+        binning=(3, -0.5, 2.5),
+        x_title="Probe Muon track finder region (BMTF, OMTF, EMTF)",
+        discrete_x=True,
+    )
+
+    # group of all probe variables (also filled by the online efficiency mode of CustomReduceEvents)
+    config.x.variable_groups["probe"] = [
+        variable_inst.name
+        for variable_inst in config.variables
+        if variable_inst.name.startswith("probe_")
+    ]
+
+    # multi-dimensional efficiency maps of probe variables, filled sparsely in one pass by the online
+    # efficiency mode of CustomReduceEvents and projected to any of their 1D or 2D views
+    config.x.efficiency_maps = {
+        "probe_map": ["probe_pt", "probe_eta", "probe_phi"],
+    }
@@ -0,0 +1,199 @@
+# coding: utf-8
+
+"""
+Vectorized computation of trigger efficiencies and their uncertainties from category histograms.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Iterable, Sequence
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+hist = maybe_import("hist")
+
+
+# names of axes that are summed over when not requested as variables
+bookkeeping_axes = ("category", "process", "shift")
+
+# maximum number of efficiency tables kept in the cache
+cache_size = 32
+
+_cache = OrderedDict()
+
+
+class EfficiencyTable(object):
+    """
+    Efficiencies of several numerator categories with respect to a common denominator category,
+    binned in the *axes* of one or more variables. *num* has the shape ``(n_categories, *bins)``
+    with one entry per id in *category_ids*, *denom* has the shape of the bins. Intervals are
+    Clopper-Pearson intervals with a *coverage* that defaults to one standard deviation.
+
+    Tables are shared through the cache of :py:func:`compute_efficiencies` and must not be
+    modified.
+    """
+
+    def __init__(
+        self,
+        category_ids: Sequence[int],
+        axes: Sequence[hist.axis.Axis],
+        num: np.ndarray,
+        denom: np.ndarray,
+        coverage: float | None = None,
+    ):
+        super().__init__()
+
+        from hist.intervals import clopper_pearson_interval
+
+        self.category_ids = list(category_ids)
+        self.axes = tuple(axes)
+        self.num = num
+        self.denom = denom
+        self.coverage = coverage
+
+        # all categories at once, broadcasting the denominator
+        denom = np.broadcast_to(denom, num.shape)
+        self.efficiency = np.divide(num, denom, out=np.zeros_like(num, dtype=np.float64), where=denom != 0)
+        self.interval = clopper_pearson_interval(num, denom, coverage)
+
+    @property
+    def variables(self) -> list[str]:
+        return [axis.name for axis in self.axes]
+
+    def index(self, category_id: int) -> int:
+        """
+        Returns the position of the category with *category_id* in the first dimension of all
+        arrays.
+        """
+        return self.category_ids.index(category_id)
+
+    def errors(self) -> np.ndarray:
+        """
+        Returns the distances of the lower and upper interval bounds to the efficiencies with the
+        shape ``(2, n_categories, *bins)``, set to zero for bins with an efficiency of zero.
+        """
+        return np.where(self.efficiency == 0, 0, np.abs(self.interval - self.efficiency))
+
+    def to_records(self) -> list[dict]:
+        """
+        Returns one flat dictionary per category and bin with the category id, the bin edges of all
+        variables, the numerator and denominator, the efficiency and the interval bounds, e.g. for
+        tabular exports.
+        """
+        edges = [np.asarray(axis.edges) for axis in self.axes]
+        records = []
+        for c, category_id in enumerate(self.category_ids):
+            for idx in np.ndindex(*self.denom.shape):
+                record = {"category": category_id}
+                for axis, axis_edges, i in zip(self.axes, edges, idx):
+                    record[f"{axis.name}_low"] = float(axis_edges[i])
+                    record[f"{axis.name}_high"] = float(axis_edges[i + 1])
+                record.update({
+                    "num": float(self.num[(c, *idx)]),
+                    "denom": float(self.denom[idx]),
+                    "eff": float(self.efficiency[(c, *idx)]),
+                    "eff_low": float(self.interval[(0, c, *idx)]),
+                    "eff_high": float(self.interval[(1, c, *idx)]),
+                })
+                records.append(record)
+
+        return records
+
+
+def sum_hists(hists: Iterable[hist.Hist]) -> hist.Hist:
+    """
+    Returns the sum of all *hists*, accumulated in-place into a single copy of the first one.
+    """
+    hists = iter(hists)
+    h_sum = next(hists).copy()
+    for h in hists:
+        h_sum += h
+
+    return h_sum
+
+
+def hist_hash(h: hist.Hist) -> str:
+    """
+    Returns a hash of the contents of *h*, including its axes and their bins.
+    """
+    md5 = hashlib.md5()
+    for axis in h.axes:
+        md5.update(axis.name.encode())
+        if isinstance(axis, (hist.axis.IntCategory, hist.axis.StrCategory)):
+            md5.update(repr(list(axis)).encode())
+        else:
+            md5.update(np.asarray(axis.edges, dtype=np.float64).tobytes())
+    md5.update(np.ascontiguousarray(h.view(flow=True)).tobytes())
+
+    return md5.hexdigest()
+
+
+def clear_cache() -> None:
+    """
+    Removes all tables from the cache of :py:func:`compute_efficiencies`.
+    """
+    _cache.clear()
+
+
+def compute_efficiencies(
+    h: hist.Hist,
+    denom_category: int,
+    categories: Sequence[int] | None = None,
+    variables: Sequence[str] | None = None,
+    coverage: float | None = None,
+    cache: bool = True,
+) -> EfficiencyTable:
+    """
+    Computes the efficiencies of all *categories* with respect to the *denom_category* from a
+    histogram *h* with a "category" axis in one vectorized step. *categories* default to all
+    categories of *h* but the denominator. *variables* are the names of the axes to bin in and
+    default to all axes but the category, process and shift axes, so that, e.g., a pt x eta
+    histogram yields 2D efficiency maps. All other axes are summed over.
+
+    *h* can also be a :py:class:`l1m.efficiency.sparse.SparseHist`, which is projected onto the
+    *variables* first.
+
+    With *cache*, tables are cached by a hash of the histogram contents and the arguments.
+    """
+    from l1m.efficiency.sparse import SparseHist
+
+    if isinstance(h, SparseHist):
+        h = h.project(*(h.variables if variables is None else variables))
+
+    if variables is None:
+        variables = [axis.name for axis in h.axes if axis.name not in bookkeeping_axes]
+    variables = list(variables)
+
+    key = None
+    if cache:
+        categories_key = None if categories is None else tuple(categories)
+        key = (hist_hash(h), denom_category, categories_key, tuple(variables), coverage)
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    # sum over all other axes
+    h = h.project("category", *variables)
+    category_axis = h.axes["category"]
+    if denom_category not in category_axis:
+        raise ValueError(f"denominator category {denom_category} not found in histogram")
+    if categories is None:
+        categories = [c for c in category_axis if c != denom_category]
+    missing = [c for c in categories if c not in category_axis]
+    if missing:
+        raise ValueError(f"categories {missing} not found in histogram")
+
+    values = h.values()
+    num = values[np.asarray(category_axis.index(list(categories)), dtype=np.intp)]
+    denom = values[category_axis.index(denom_category)]
+    table = EfficiencyTable(categories, [h.axes[v] for v in variables], num, denom, coverage=coverage)
+
+    if cache:
+        _cache[key] = table
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+
+    return table
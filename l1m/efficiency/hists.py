@@ -0,0 +1,69 @@
+# coding: utf-8
+
+"""
+Helpers to create and fill mergeable efficiency histograms directly from reduced probes.
+"""
+
+from __future__ import annotations
+
+import order as od
+
+from columnflow.columnar_util import Route
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+hist = maybe_import("hist")
+
+
+def create_hist(variable_insts: list[od.Variable]) -> hist.Hist:
+    """
+    Creates an empty, weighted histogram with growing category, process and shift axes followed by
+    one axis per variable in *variable_insts*, identical to those created in cf.CreateHistograms.
+    """
+    h = (
+        hist.Hist.new
+        .IntCat([], name="category", growth=True)
+        .IntCat([], name="process", growth=True)
+        .IntCat([], name="shift", growth=True)
+    )
+    for variable_inst in variable_insts:
+        h = h.Var(
+            variable_inst.bin_edges,
+            name=variable_inst.name,
+            label=variable_inst.get_full_x_title(),
+        )
+
+    return h.Weight()
+
+
+def fill_hist(
+    h: hist.Hist,
+    events: ak.Array,
+    variable_insts: list[od.Variable],
+    shift_id: int,
+    weight: np.ndarray | None = None,
+) -> None:
+    """
+    Fills the histogram *h* in-place with the flat probe *events* which must contain the jagged
+    *category_ids* and the *process_id* columns. Each probe is filled once per category it belongs
+    to. *weight* defaults to one per probe.
+    """
+    # repeat all per-probe values once per category
+    n_cats = ak.to_numpy(ak.num(events.category_ids, axis=1))
+    repeat = lambda arr: np.repeat(np.asarray(arr), n_cats)
+
+    if weight is None:
+        weight = np.ones(len(events), dtype=np.float32)
+
+    fill_kwargs = {
+        "category": ak.to_numpy(ak.flatten(events.category_ids, axis=1)),
+        "process": repeat(events.process_id),
+        "shift": np.full(n_cats.sum(), shift_id, dtype=np.int32),
+        "weight": repeat(weight),
+    }
+    for variable_inst in variable_insts:
+        values = Route(variable_inst.expression).apply(events, null_value=variable_inst.null_value)
+        fill_kwargs[variable_inst.name] = repeat(ak.to_numpy(values))
+
+    h.fill(**fill_kwargs)
@@ -0,0 +1,331 @@
+# coding: utf-8
+
+"""
+Mergeable accumulator of probe counts per category, grouped by run, luminosity block and number of
+primary vertices, for monitoring efficiencies versus time and pileup.
+"""
+
+from __future__ import annotations
+
+import copy
+from typing import BinaryIO, Iterable, Sequence
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+hist = maybe_import("hist")
+
+
+# bit layout of keys, run << 40 | lumi << 8 | npvs, with the number of vertices clipped to 255
+lumi_shift = np.uint64(8)
+run_shift = np.uint64(40)
+max_npvs = 255
+
+# fields of keys that can be selected and binned in
+key_fields = ("run", "lumi", "npvs")
+
+
+def encode_keys(run: np.ndarray, lumi: np.ndarray, npvs: np.ndarray) -> np.ndarray:
+    """
+    Returns the keys of entries with *run*, *lumi* and *npvs*. Keys are ordered by run, then
+    luminosity block, then number of vertices.
+    """
+    npvs = np.clip(np.asarray(npvs, dtype=np.int64), 0, max_npvs).astype(np.uint64)
+    return (
+        (np.asarray(run, dtype=np.uint64) << run_shift) |
+        (np.asarray(lumi, dtype=np.uint64) << lumi_shift) |
+        npvs
+    )
+
+
+class LumiEfficiency(object):
+    """
+    Accumulator of the number of probes per category, grouped by run, luminosity block and number of
+    primary vertices (clipped to :py:data:`max_npvs`). Only combinations containing probes are
+    stored as sorted keys (see :py:func:`encode_keys`) together with a ``[category, key]`` table of
+    counts, so that the size scales with the number of luminosity blocks rather than the range of
+    run numbers. Efficiencies follow as ratios of counts of trigger categories and of the
+    *denom_category*, both filled unweighted.
+
+    Instances can be added in-place, merged in bulk with :py:meth:`merge`, serialized to a
+    compressed numpy archive with :py:meth:`dump` and :py:meth:`load`, and queried for run ranges,
+    luminosity blocks and pileup bins with vectorized lookups on the sorted keys.
+
+    .. code-block:: python
+
+        acc = LumiEfficiency([200, 201, 202], denom_category=200)
+        acc.fill(probes.run, probes.luminosityBlock, probes.PV.npvs, probes.category_ids)
+        acc.efficiency(201, runs=(367100, 367200))
+        # -> (4211, 4530, 0.9296)
+        acc.efficiency_table("npvs", edges=[0, 20, 30, 40, 60])
+    """
+
+    def __init__(self, category_ids: Sequence[int], denom_category: int):
+        super().__init__()
+
+        if denom_category not in category_ids:
+            raise ValueError(f"denominator category {denom_category} not in categories {list(category_ids)}")
+
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)
+        self.denom_category = int(denom_category)
+
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros((len(self.category_ids), 0), dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} categories={len(self.category_ids)} "
+            f"entries={len(self.keys)} at {hex(id(self))}>"
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.counts.nbytes
+
+    @property
+    def run(self) -> np.ndarray:
+        return (self.keys >> run_shift).astype(np.uint32)
+
+    @property
+    def lumi(self) -> np.ndarray:
+        return ((self.keys >> lumi_shift) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    @property
+    def npvs(self) -> np.ndarray:
+        return (self.keys & np.uint64(max_npvs)).astype(np.int32)
+
+    @property
+    def runs(self) -> np.ndarray:
+        """
+        Sorted, unique runs containing probes.
+        """
+        return np.unique(self.run)
+
+    def copy(self) -> LumiEfficiency:
+        return copy.deepcopy(self)
+
+    def category_index(self, category_id: int) -> int:
+        """
+        Returns the row of the category with *category_id* in :py:attr:`counts`.
+        """
+        idx = np.flatnonzero(self.category_ids == category_id)
+        if not len(idx):
+            raise ValueError(f"category {category_id} not found in {self!r}")
+        return int(idx[0])
+
+    def _add(self, keys: np.ndarray, counts: np.ndarray) -> None:
+        # add the columns of *counts* (one per entry in the sorted, unique *keys*), growing the
+        # table only when new keys are added
+        if np.isin(keys, self.keys).all():
+            self.counts[:, np.searchsorted(self.keys, keys)] += counts
+            return
+
+        all_keys = np.union1d(self.keys, keys)
+        out = np.zeros((len(self.category_ids), len(all_keys)), dtype=np.int64)
+        out[:, np.searchsorted(all_keys, self.keys)] += self.counts
+        out[:, np.searchsorted(all_keys, keys)] += counts
+        self.keys, self.counts = all_keys, out
+
+    def fill(
+        self,
+        run: ak.Array | np.ndarray,
+        lumi: ak.Array | np.ndarray,
+        npvs: ak.Array | np.ndarray,
+        category_ids: ak.Array,
+    ) -> None:
+        """
+        Adds probes with *run*, *lumi*, number of primary vertices *npvs* and jagged *category_ids*.
+        Each probe is counted once per category it belongs to, categories not tracked by this
+        instance are skipped.
+        """
+        n_cats = ak.to_numpy(ak.num(category_ids, axis=1))
+        keys = np.repeat(encode_keys(ak.to_numpy(run), ak.to_numpy(lumi), ak.to_numpy(npvs)), n_cats)
+        cat_ids = ak.to_numpy(ak.flatten(category_ids, axis=1)).astype(np.int64)
+
+        # rows of tracked categories
+        order = np.argsort(self.category_ids)
+        pos = np.searchsorted(self.category_ids[order], cat_ids).clip(max=len(order) - 1)
+        tracked = self.category_ids[order][pos] == cat_ids
+        if not tracked.any():
+            return
+        rows = order[pos[tracked]]
+
+        # grouped counts via bincount over flat (row, key) indices
+        keys, inverse = np.unique(keys[tracked], return_inverse=True)
+        counts = np.bincount(
+            rows * len(keys) + inverse.ravel(),
+            minlength=len(self.category_ids) * len(keys),
+        ).reshape(len(self.category_ids), len(keys))
+        self._add(keys, counts)
+
+    def _check_compatible(self, other: LumiEfficiency) -> None:
+        if other.denom_category != self.denom_category or not np.array_equal(other.category_ids, self.category_ids):
+            raise ValueError(f"cannot add {other!r} with different categories to {self!r}")
+
+    def __iadd__(self, other: LumiEfficiency) -> LumiEfficiency:
+        self._check_compatible(other)
+        if len(other):
+            self._add(other.keys, other.counts)
+        return self
+
+    def __add__(self, other: LumiEfficiency) -> LumiEfficiency:
+        acc = self.copy()
+        acc += other
+        return acc
+
+    @classmethod
+    def merge(cls, accumulators: Iterable[LumiEfficiency]) -> LumiEfficiency:
+        """
+        Merges all *accumulators* with the same categories into a new instance. The table is
+        allocated only once with the union of all keys.
+        """
+        accumulators = list(accumulators)
+        if not accumulators:
+            raise ValueError("cannot merge empty sequence of accumulators")
+
+        first = accumulators[0]
+        merged = cls(first.category_ids, first.denom_category)
+        for acc in accumulators:
+            merged._check_compatible(acc)
+
+        merged.keys = np.unique(np.concatenate([acc.keys for acc in accumulators]))
+        merged.counts = np.zeros((len(merged.category_ids), len(merged.keys)), dtype=np.int64)
+        for acc in accumulators:
+            merged.counts[:, np.searchsorted(merged.keys, acc.keys)] += acc.counts
+
+        return merged
+
+    def mask(
+        self,
+        runs: tuple[int, int] | None = None,
+        lumis: tuple[int, int] | None = None,
+        npvs: tuple[int, int] | None = None,
+    ) -> slice | np.ndarray:
+        """
+        Returns a slice or boolean mask of all entries in the inclusive ranges of *runs*, *lumis*
+        and *npvs*. The run range is resolved by a binary search on the sorted keys.
+        """
+        mask = slice(None)
+        if runs is not None:
+            start, stop = np.searchsorted(
+                self.keys,
+                [np.uint64(runs[0]) << run_shift, np.uint64(runs[1] + 1) << run_shift],
+            )
+            mask = slice(int(start), int(stop))
+        if lumis is None and npvs is None:
+            return mask
+
+        sel = np.zeros(len(self.keys), dtype=bool)
+        sel[mask] = True
+        for values, value_range in [(self.lumi, lumis), (self.npvs, npvs)]:
+            if value_range is not None:
+                sel &= (values >= value_range[0]) & (values <= value_range[1])
+        return sel
+
+    def select(self, **kwargs) -> LumiEfficiency:
+        """
+        Returns a new accumulator with only the entries in the ranges passed to :py:meth:`mask`.
+        """
+        mask = self.mask(**kwargs)
+        acc = self.__class__(self.category_ids, self.denom_category)
+        acc.keys = self.keys[mask].copy()
+        acc.counts = self.counts[:, mask].copy()
+        return acc
+
+    def efficiency(self, category_id: int, **kwargs) -> tuple[int, int, float]:
+        """
+        Returns the number of probes in the category with *category_id* and in the denominator
+        category as well as their ratio, summed over all entries in the ranges passed to
+        :py:meth:`mask`.
+        """
+        counts = self.counts[:, self.mask(**kwargs)]
+        num = int(counts[self.category_index(category_id)].sum())
+        denom = int(counts[self.category_index(self.denom_category)].sum())
+        return num, denom, (num / denom if denom else 0.0)
+
+    def binned_counts(
+        self,
+        field: str,
+        edges: Sequence[float] | None = None,
+        **kwargs,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns bin *edges* of the key *field*, i.e., "run", "lumi" or "npvs", and the counts of all
+        categories in these bins with the shape ``(n_categories, n_bins)``, for all entries in the
+        ranges passed to :py:meth:`mask`. Bins include their lower edge, entries outside all bins
+        are dropped. *edges* default to one bin per distinct value.
+        """
+        if field not in key_fields:
+            raise ValueError(f"unknown field '{field}', must be one of {', '.join(key_fields)}")
+
+        mask = self.mask(**kwargs)
+        values = getattr(self, field)[mask]
+        if edges is None:
+            unique = np.unique(values)
+            edges = np.append(unique, unique[-1] + 1) if len(unique) else np.array([0, 1])
+        edges = np.asarray(edges, dtype=np.float64)
+
+        n_bins = len(edges) - 1
+        bins = np.searchsorted(edges, values, side="right") - 1
+        valid = (bins >= 0) & (bins < n_bins)
+        counts = self.counts[:, mask][:, valid]
+        flat = (np.arange(len(self.category_ids))[:, None] * n_bins + bins[valid][None, :]).ravel()
+        binned = np.bincount(
+            flat,
+            weights=counts.ravel(),
+            minlength=len(self.category_ids) * n_bins,
+        ).reshape(len(self.category_ids), n_bins)
+
+        return edges, binned.astype(np.int64)
+
+    def efficiency_table(
+        self,
+        field: str,
+        edges: Sequence[float] | None = None,
+        categories: Sequence[int] | None = None,
+        coverage: float | None = None,
+        **kwargs,
+    ):
+        """
+        Returns an :py:class:`l1m.efficiency.compute.EfficiencyTable` of all *categories*, defaulting
+        to all but the denominator category, in bins of the key *field*. *edges* and *kwargs* are
+        forwarded to :py:meth:`binned_counts`.
+        """
+        from l1m.efficiency.compute import EfficiencyTable
+
+        if categories is None:
+            categories = [int(c) for c in self.category_ids if c != self.denom_category]
+
+        edges, counts = self.binned_counts(field, edges=edges, **kwargs)
+        num = counts[[self.category_index(c) for c in categories]]
+        denom = counts[self.category_index(self.denom_category)]
+        axis = hist.axis.Variable(edges, name=field)
+
+        return EfficiencyTable(categories, [axis], num, denom, coverage=coverage)
+
+    def dump(self, f: BinaryIO) -> None:
+        """
+        Writes the accumulator to the binary file object *f* as a compressed numpy archive.
+        """
+        np.savez_compressed(
+            f,
+            category_ids=self.category_ids,
+            denom_category=self.denom_category,
+            keys=self.keys,
+            counts=self.counts,
+        )
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> LumiEfficiency:
+        """
+        Reads an accumulator from the binary file object *f* written by :py:meth:`dump`.
+        """
+        data = np.load(f)
+        acc = cls(data["category_ids"], int(data["denom_category"]))
+        acc.keys = data["keys"]
+        acc.counts = data["counts"].reshape(len(acc.category_ids), len(acc.keys))
+        return acc
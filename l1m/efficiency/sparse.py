@@ -0,0 +1,185 @@
+# coding: utf-8
+
+"""
+Sparse storage of multi-dimensional efficiency histograms that only allocates filled bins.
+"""
+
+from __future__ import annotations
+
+import copy
+
+import order as od
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+hist = maybe_import("hist")
+
+
+class SparseHist(object):
+    """
+    Weighted histogram with growing integer "category", "process" and "shift" axes followed by one
+    axis per variable, defined by its bin *edges*. Only filled bins are stored as sorted global bin
+    indices together with their sums of weights and squared weights, so that the memory scales with
+    the number of occupied bins rather than the product of all axis sizes. Under- and overflow bins
+    are kept for all variables.
+
+    Histograms are filled with the same arguments as :py:class:`hist.Hist` objects created by
+    :py:func:`l1m.efficiency.hists.create_hist`, can be added and are converted into dense
+    histograms of any subset of variables with :py:meth:`project`.
+
+    .. code-block:: python
+
+        h = SparseHist.from_variables([pt_inst, eta_inst, phi_inst])
+        fill_hist(h, probes, [pt_inst, eta_inst, phi_inst], shift_id=0)
+        h_pt_eta = h.project("probe_pt", "probe_eta")
+    """
+
+    category_axes = ("category", "process", "shift")
+
+    def __init__(self, edges: dict[str, np.ndarray], labels: dict[str, str] | None = None):
+        super().__init__()
+
+        self.edges = {name: np.asarray(e, dtype=np.float64) for name, e in edges.items()}
+        self.labels = dict(labels or {})
+        self.categories = {name: [] for name in self.category_axes}
+
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.sumw = np.zeros(0, dtype=np.float64)
+        self.sumw2 = np.zeros(0, dtype=np.float64)
+
+    @classmethod
+    def from_variables(cls, variable_insts: list[od.Variable]) -> SparseHist:
+        return cls(
+            {variable_inst.name: variable_inst.bin_edges for variable_inst in variable_insts},
+            labels={variable_inst.name: variable_inst.get_full_x_title() for variable_inst in variable_insts},
+        )
+
+    @property
+    def variables(self) -> list[str]:
+        return list(self.edges)
+
+    @property
+    def shape(self) -> tuple[int]:
+        """
+        Shape of the equivalent dense histogram including under- and overflow bins.
+        """
+        return (
+            *(max(len(self.categories[name]), 1) for name in self.category_axes),
+            *(len(e) + 1 for e in self.edges.values()),
+        )
+
+    @property
+    def n_bins(self) -> int:
+        """
+        Number of filled bins.
+        """
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.sumw.nbytes + self.sumw2.nbytes
+
+    def copy(self) -> SparseHist:
+        return copy.deepcopy(self)
+
+    def _grow(self, name: str, ids) -> None:
+        # add new category ids, re-encoding stored bins when the shape changes
+        new_ids = [int(i) for i in np.unique(ids) if int(i) not in self.categories[name]]
+        if not new_ids:
+            return
+        multi_index = np.unravel_index(self.keys, self.shape) if self.n_bins else None
+        self.categories[name].extend(new_ids)
+        if multi_index is not None:
+            self.keys = np.ravel_multi_index(multi_index, self.shape).astype(np.int64)
+
+    def _category_index(self, name: str, ids: np.ndarray) -> np.ndarray:
+        known = np.asarray(self.categories[name], dtype=np.int64)
+        order = np.argsort(known)
+        return order[np.searchsorted(known[order], ids)]
+
+    def _add(self, keys: np.ndarray, sumw: np.ndarray, sumw2: np.ndarray) -> None:
+        # merge with stored bins and sum up duplicate keys
+        keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.sumw = np.bincount(inverse, weights=np.concatenate([self.sumw, sumw]), minlength=len(keys))
+        self.sumw2 = np.bincount(inverse, weights=np.concatenate([self.sumw2, sumw2]), minlength=len(keys))
+        self.keys = keys.astype(np.int64)
+
+    def fill(self, weight: np.ndarray | float | None = None, **values) -> None:
+        """
+        Fills entries with the "category", "process" and "shift" ids and the values of all
+        variables in *values*, with optional *weight*. Scalars are broadcast to all entries.
+        """
+        n = max(np.size(values[name]) for name in [*self.category_axes, *self.edges])
+        if n == 0:
+            return
+
+        multi_index = []
+        for name in self.category_axes:
+            ids = np.broadcast_to(np.asarray(values[name], dtype=np.int64), (n,))
+            self._grow(name, ids)
+            multi_index.append(self._category_index(name, ids))
+        for name, edges in self.edges.items():
+            # index 0 is the underflow, len(edges) the overflow bin, as in boost-histogram
+            arr = np.broadcast_to(np.asarray(values[name], dtype=np.float64), (n,))
+            multi_index.append(np.searchsorted(edges, arr, side="right"))
+
+        weight = np.broadcast_to(np.asarray(1.0 if weight is None else weight, dtype=np.float64), (n,))
+        self._add(np.ravel_multi_index(multi_index, self.shape).astype(np.int64), weight, weight**2)
+
+    def __iadd__(self, other: SparseHist) -> SparseHist:
+        if list(self.edges) != list(other.edges) or not all(
+            np.array_equal(self.edges[name], other.edges[name]) for name in self.edges
+        ):
+            raise ValueError("cannot add sparse histograms with different variable axes")
+
+        if not other.n_bins:
+            return self
+
+        # translate category indices of the other histogram to those of this one
+        multi_index = list(np.unravel_index(other.keys, other.shape))
+        for i, name in enumerate(self.category_axes):
+            ids = np.asarray(other.categories[name], dtype=np.int64)
+            self._grow(name, ids)
+            multi_index[i] = self._category_index(name, ids)[multi_index[i]]
+        self._add(np.ravel_multi_index(multi_index, self.shape).astype(np.int64), other.sumw, other.sumw2)
+
+        return self
+
+    def __add__(self, other: SparseHist) -> SparseHist:
+        h = self.copy()
+        h += other
+        return h
+
+    def project(self, *variables: str) -> hist.Hist:
+        """
+        Returns a dense, weighted :py:class:`hist.Hist` with the category, process and shift axes
+        followed by the axes of the given *variables*, summing over all other variables including
+        their under- and overflow bins.
+        """
+        unknown = set(variables) - set(self.edges)
+        if unknown:
+            raise ValueError(f"unknown variables {', '.join(sorted(unknown))}")
+
+        h = (
+            hist.Hist.new
+            .IntCat(self.categories["category"], name="category", growth=True)
+            .IntCat(self.categories["process"], name="process", growth=True)
+            .IntCat(self.categories["shift"], name="shift", growth=True)
+        )
+        for name in variables:
+            h = h.Var(self.edges[name], name=name, label=self.labels.get(name, name))
+        h = h.Weight()
+
+        # sum all bins into the flat indices of the projected shape
+        n_cat = len(self.category_axes)
+        dims = [*range(n_cat), *(n_cat + self.variables.index(v) for v in variables)]
+        shape = h.view(flow=True).shape
+        multi_index = np.unravel_index(self.keys, self.shape)
+        keys = np.ravel_multi_index([multi_index[d] for d in dims], shape)
+        size = int(np.prod(shape))
+        view = h.view(flow=True)
+        view.value = np.bincount(keys, weights=self.sumw, minlength=size).reshape(shape)
+        view.variance = np.bincount(keys, weights=self.sumw2, minlength=size).reshape(shape)
+
+        return h
@@ -0,0 +1,141 @@
+# coding: utf-8
+
+"""
+Cumulative histograms of the highest matched L1 pt per quality cut, from which efficiencies of
+arbitrary grids of pt thresholds and quality cuts are derived without revisiting the events.
+"""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import order as od
+
+from columnflow.columnar_util import Route
+from columnflow.util import maybe_import
+
+from l1m.efficiency.compute import EfficiencyTable
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+hist = maybe_import("hist")
+
+
+def create_scan_hist(
+    variable_insts: list[od.Variable],
+    min_quals: Sequence[int],
+    l1_pt_edges: Sequence[float],
+) -> hist.Hist:
+    """
+    Creates an empty, weighted histogram with growing process and shift axes, one axis per variable
+    in *variable_insts*, a "min_qual" axis with the minimum L1 qualities *min_quals* and an "l1_pt"
+    axis of the highest matched L1 pt with *l1_pt_edges*.
+    """
+    h = (
+        hist.Hist.new
+        .IntCat([], name="process", growth=True)
+        .IntCat([], name="shift", growth=True)
+    )
+    for variable_inst in variable_insts:
+        h = h.Var(
+            variable_inst.bin_edges,
+            name=variable_inst.name,
+            label=variable_inst.get_full_x_title(),
+        )
+    h = (
+        h
+        .IntCat(list(min_quals), name="min_qual", label="Minimum L1 quality")
+        .Var(l1_pt_edges, name="l1_pt", label=r"Highest L1 $p_{T}$ / GeV")
+    )
+
+    return h.Weight()
+
+
+def fill_scan_hist(
+    h: hist.Hist,
+    probes: ak.Array,
+    variable_insts: list[od.Variable],
+    shift_id: int,
+    weight: np.ndarray | None = None,
+) -> None:
+    """
+    Fills the histogram *h* in-place with the flat *probes* which must contain the *process_id*
+    column and the "L1MaxPt.q<min_qual>" columns of all minimum qualities of *h* (see
+    :py:func:`l1m.production.trigger.l1_max_pt`). Each probe is filled once per minimum quality.
+    *weight* defaults to one per probe.
+    """
+    min_quals = list(h.axes["min_qual"])
+    n_quals = len(min_quals)
+    repeat = lambda arr: np.repeat(np.asarray(arr), n_quals)
+
+    if weight is None:
+        weight = np.ones(len(probes), dtype=np.float32)
+
+    # probe-major order, i.e., all quality cuts of the first probe first
+    l1_pt = np.stack([ak.to_numpy(probes.L1MaxPt[f"q{min_qual}"]) for min_qual in min_quals], axis=1)
+    fill_kwargs = {
+        "process": repeat(probes.process_id),
+        "shift": np.full(len(probes) * n_quals, shift_id, dtype=np.int32),
+        "min_qual": np.tile(min_quals, len(probes)),
+        "l1_pt": l1_pt.ravel(),
+        "weight": repeat(weight),
+    }
+    for variable_inst in variable_insts:
+        values = Route(variable_inst.expression).apply(probes, null_value=variable_inst.null_value)
+        fill_kwargs[variable_inst.name] = repeat(ak.to_numpy(values))
+
+    h.fill(**fill_kwargs)
+
+
+def scan_efficiencies(
+    h: hist.Hist,
+    thresholds: Sequence[float],
+    min_quals: Sequence[int] | None = None,
+    variables: Sequence[str] | None = None,
+    coverage: float | None = None,
+) -> EfficiencyTable:
+    """
+    Derives the efficiencies of all combinations of *min_quals* (defaulting to all of *h*) and pt
+    *thresholds* from a histogram *h* created by :py:func:`create_scan_hist`, binned in the given
+    *variables* (defaulting to all of *h*) and summed over all other axes. A probe passes a
+    threshold when the center of its "l1_pt" bin is above it, which equals the "pt > threshold"
+    requirement of ``config.x.triggers`` for bins centered on the hardware pt values. Probes in
+    the overflow bin pass all thresholds, probes in the underflow bin none.
+
+    Returns a :py:class:`l1m.efficiency.compute.EfficiencyTable` whose category ids are
+    ``(min_qual, threshold)`` tuples, ordered by quality cut first.
+    """
+    if variables is None:
+        variables = [axis.name for axis in h.axes if axis.name not in ("process", "shift", "min_qual", "l1_pt")]
+    if min_quals is None:
+        min_quals = list(h.axes["min_qual"])
+    missing = [q for q in min_quals if q not in h.axes["min_qual"]]
+    if missing:
+        raise ValueError(f"minimum qualities {missing} not found in histogram")
+
+    h = h.project(*variables, "min_qual", "l1_pt")
+
+    # counts with shape (*bins, n_quals, n_l1_pt) including under- and overflow of the l1 pt only
+    view = h.values(flow=True)
+    slices = tuple(
+        slice(int(axis.traits.underflow), int(axis.traits.underflow) + axis.size)
+        for axis in h.axes[:-1]
+    )
+    counts = np.take(view[slices], h.axes["min_qual"].index(list(min_quals)), axis=-2)
+
+    # reverse cumulative sums, padded so that thresholds above all bin centers yield zero
+    cum = np.flip(np.cumsum(np.flip(counts, axis=-1), axis=-1), axis=-1)
+    cum = np.concatenate([cum, np.zeros_like(cum[..., :1])], axis=-1)
+
+    # index of the first bin whose center is above each threshold
+    l1_axis = h.axes["l1_pt"]
+    centers = np.concatenate([[-np.inf], l1_axis.centers, [np.inf]])
+    first_bin = np.searchsorted(centers, np.asarray(thresholds, dtype=np.float64), side="right")
+
+    # numerators with shape (n_quals, n_thresholds, *bins)
+    num = np.moveaxis(cum[..., first_bin], (-2, -1), (0, 1))
+    num = num.reshape(len(min_quals) * len(thresholds), *num.shape[2:])
+    denom = counts[..., 0, :].sum(axis=-1)
+
+    category_ids = [(q, t) for q in min_quals for t in thresholds]
+    return EfficiencyTable(category_ids, [h.axes[v] for v in variables], num, denom, coverage=coverage)
@@ -0,0 +1,329 @@
+# coding: utf-8
+
+"""
+Helpers for locating and staging input files of custom datasets.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import law
+
+from columnflow.util import maybe_import
+
+
+uproot = maybe_import("uproot")
+
+
+logger = law.logger.get_logger(__name__)
+
+
+def lfn_fingerprint(lfn: str, **info) -> str:
+    """
+    Returns a fingerprint of the file with *lfn* and optional *info* such as its size, modification
+    time and number of entries, which changes whenever the file is replaced or modified. Without
+    *info*, the fingerprint only depends on the *lfn*, which is sufficient for immutable files such
+    as those of CMS datasets.
+    """
+    return law.util.create_hash((str(lfn), sorted(info.items())), l=16)
+
+
+class LFNIndex(object):
+    """
+    Persistent index of the ROOT files in a local *directory*, stored as json at *index_path*. Per
+    file, the size, modification time and number of entries in the "Events" tree are stored. The
+    index is rebuilt when the modification time of the directory or the size or modification time
+    of an indexed file changes, in which case entries of files whose size and modification time are
+    unchanged are reused, so that only new or modified files are opened.
+
+    .. code-block:: python
+
+        index = LFNIndex("/data/L1nano/tt", "/cache/lfn_index/tt.json")
+        index.lfns
+        # -> ["/data/L1nano/tt/nano_1.root", ...]
+        index.entries(index.lfns)
+        # -> [102400, ...]
+    """
+
+    def __init__(self, directory: str, index_path: str, pattern: str = "*.root"):
+        super().__init__()
+
+        self.directory = os.path.abspath(os.path.expandvars(os.path.expanduser(directory)))
+        self.index_path = os.path.expandvars(os.path.expanduser(index_path))
+        self.pattern = pattern
+
+        self._data = None
+
+    @classmethod
+    def for_dataset_key(cls, directory: str, dataset_key: str, **kwargs) -> LFNIndex:
+        """
+        Returns the index of *directory* stored in the "lfn_index_dir" of the analysis section of
+        the law config under a name derived from the *dataset_key*.
+        """
+        index_dir = law.config.get_expanded("analysis", "lfn_index_dir", "$CF_DATA/l1m/lfn_index")
+        name = dataset_key.strip("/").replace("/", "__")
+        return cls(directory, os.path.join(index_dir, f"{name}.json"), **kwargs)
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = self.load()
+        return self._data
+
+    @property
+    def lfns(self) -> list[str]:
+        """
+        Paths of all indexed files, sorted by name.
+        """
+        return [os.path.join(self.directory, name) for name in sorted(self.data["files"])]
+
+    def entries(self, lfns: list[str]) -> list[int]:
+        """
+        Returns the number of entries of all files at *lfns*, which must be located in the indexed
+        directory.
+        """
+        files = self.data["files"]
+        return [files[os.path.basename(lfn)]["entries"] for lfn in lfns]
+
+    def fingerprints(self, lfns: list[str]) -> list[str]:
+        """
+        Returns content fingerprints of all files at *lfns*, derived from their names, sizes,
+        modification times and numbers of entries, which must be located in the indexed directory.
+        """
+        files = self.data["files"]
+        return [
+            lfn_fingerprint(lfn, **files[os.path.basename(lfn)])
+            for lfn in lfns
+        ]
+
+    def load(self) -> dict:
+        """
+        Returns the index data, read from the index file when still valid, or rebuilt otherwise.
+        """
+        dir_mtime = os.stat(self.directory).st_mtime
+
+        data = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if (
+                data.get("dir_mtime") == dir_mtime and
+                data.get("pattern") == self.pattern and
+                self.unchanged(data["files"])
+            ):
+                return data
+
+        return self.build(previous=data, dir_mtime=dir_mtime)
+
+    def unchanged(self, files: dict) -> bool:
+        """
+        Returns whether all indexed *files* still exist with the stored sizes and modification
+        times. Files overwritten in place do not change the modification time of the directory.
+        """
+        for name, info in files.items():
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                return False
+            if stat.st_size != info["size"] or stat.st_mtime != info["mtime"]:
+                return False
+        return True
+
+    def build(self, previous: dict | None = None, dir_mtime: float | None = None) -> dict:
+        """
+        Rebuilds the index, reusing entries of unchanged files in *previous* index data, and writes
+        it to the index file.
+        """
+        if dir_mtime is None:
+            dir_mtime = os.stat(self.directory).st_mtime
+        prev_files = (previous or {}).get("files", {})
+
+        files = {}
+        n_opened = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or not law.util.multi_match(entry.name, self.pattern):
+                    continue
+                stat = entry.stat()
+                info = {"size": stat.st_size, "mtime": stat.st_mtime}
+                prev = prev_files.get(entry.name)
+                if prev and prev["size"] == info["size"] and prev["mtime"] == info["mtime"]:
+                    info["entries"] = prev["entries"]
+                else:
+                    # opening the file only reads the header and tree metadata
+                    with uproot.open(entry.path) as f:
+                        info["entries"] = int(f["Events"].num_entries)
+                    n_opened += 1
+                files[entry.name] = info
+
+        data = {"dir_mtime": dir_mtime, "pattern": self.pattern, "files": files}
+        logger.info(f"built lfn index of {self.directory} with {len(files)} files ({n_opened} opened)")
+
+        # write atomically so that concurrent readers never see partial indices
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+        self._data = data
+        return data
+
+
+class FileStager(object):
+    """
+    Copies files in background threads to a node-local *staging_dir* whose total size is bounded by
+    *max_size* bytes. When exceeded, least recently used staged files are removed, where usage is
+    tracked by their modification times so that stagers in different processes on the same node
+    share the directory.
+
+    Files are announced with :py:meth:`prefetch` and retrieved with :py:meth:`get`, which waits for
+    a pending copy in this process but never blocks on copies of other processes, returning the
+    original path instead.
+
+    .. code-block:: python
+
+        with FileStager("/tmp/staging", 20 * 1024**3) as stager:
+            stager.prefetch(next_paths)
+            path = stager.get(current_path)
+    """
+
+    suffix = ".staged"
+
+    def __init__(self, staging_dir: str, max_size: int, n_threads: int = 1):
+        super().__init__()
+
+        self.staging_dir = os.path.expandvars(os.path.expanduser(staging_dir))
+        self.max_size = max_size
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending: dict[str, Future] = {}
+        self._keep: set[str] = set()
+        self._pool = ThreadPoolExecutor(n_threads, thread_name_prefix="FileStager")
+
+    def __enter__(self) -> FileStager:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self, wait: bool = False) -> None:
+        """
+        Shuts down the copy threads. Unless *wait* is set, copies that did not start yet are
+        cancelled while a running copy is finished in the background, so that it is available to
+        subsequent processes.
+        """
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def staged_path(self, path: str) -> str:
+        """
+        Returns the path of the staged copy of the file at *path*.
+        """
+        name = law.util.create_hash(os.path.abspath(path), l=16)
+        return os.path.join(self.staging_dir, f"{name}_{os.path.basename(path)}{self.suffix}")
+
+    def prefetch(self, paths: list[str]) -> None:
+        """
+        Starts copying all files at *paths* that are neither staged nor pending yet, in order.
+        Staged copies of these files are protected from eviction until the next call.
+        """
+        with self._lock:
+            self._keep = {self.staged_path(path) for path in paths}
+            for path in paths:
+                if path in self._pending or os.path.exists(self.staged_path(path)):
+                    continue
+                self._pending[path] = self._pool.submit(self._stage, path)
+
+    def get(self, path: str) -> str:
+        """
+        Returns the path of the staged copy of the file at *path*, or *path* itself when it is not
+        staged and not pending in this stager.
+        """
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"staging of {path} failed: {e}")
+
+        staged_path = self.find(path)
+        if staged_path != path:
+            # protect from eviction while in use
+            with self._lock:
+                self._keep.add(staged_path)
+
+        return staged_path
+
+    def find(self, path: str) -> str:
+        """
+        Returns the path of the staged copy of the file at *path* and marks it as recently used, or
+        *path* itself when it is not staged. Does not wait for pending copies and can therefore also
+        be used in forked processes.
+        """
+        staged_path = self.staged_path(path)
+        try:
+            os.utime(staged_path)
+        except FileNotFoundError:
+            return path
+        return staged_path
+
+    def _stage(self, path: str) -> None:
+        staged_path = self.staged_path(path)
+        try:
+            size = os.stat(path).st_size
+            if size > self.max_size:
+                logger.info(f"not staging {path} with size {size} exceeding the staging size limit")
+                return
+
+            # free space, but never evict files that are in use or about to be used
+            with self._lock:
+                keep = set(self._keep)
+            self.evict(self.max_size - size, keep=keep)
+
+            # copy into a temporary file first so that other processes never see partial copies
+            tmp_path = f"{staged_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            t0 = time.perf_counter()
+            try:
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, staged_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.debug(f"staged {path} in {law.util.human_duration(seconds=time.perf_counter() - t0)}")
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def evict(self, max_size: int, keep: set[str] | None = None) -> None:
+        """
+        Removes least recently used staged files until their total size is at most *max_size*,
+        skipping paths in *keep*.
+        """
+        files = []
+        with os.scandir(self.staging_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= max_size:
+                break
+            if keep and path in keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                pass
+            total_size -= size
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+"""
+Measurement of import times to keep the startup of law invocations and remote jobs visible. Each
+module is imported *repeat* times in fresh interpreters with ``python -X importtime``, reporting the
+fastest total time and the modules with the largest cumulative import times of that run.
+
+.. code-block:: bash
+
+    # import times of the package and the analysis, failing when one of them exceeds 1.5 seconds
+    python -m l1m.importtime l1m l1m.config.analysis_l1m --max-time 1.5
+
+    # additionally build the default config after importing the analysis
+    python -m l1m.importtime l1m.config.analysis_l1m --build-config
+"""
+
+from __future__ import annotations
+
+import sys
+import argparse
+import subprocess
+
+
+# modules imported by every law invocation, index build and remote job
+default_modules = ["l1m", "l1m.config.analysis_l1m"]
+
+# statement building the default config lazily
+build_config_stmt = "l1m.config.analysis_l1m.config"
+
+
+def parse_importtime(output: str) -> list[tuple[str, int, int]]:
+    """
+    Parses the *output* of ``python -X importtime`` into (module name, self time, cumulative time)
+    tuples with times in microseconds.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        entries.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return entries
+
+
+def measure(module: str, build_config: bool = False) -> tuple[float, float | None, list]:
+    """
+    Imports *module* in a fresh interpreter and returns the total import time and, with
+    *build_config*, the time of building the default config afterwards, both in seconds, as well as
+    the parsed ``importtime`` entries.
+    """
+    stmts = [
+        "import time",
+        "t = time.perf_counter()",
+        f"import {module}",
+        "print(time.perf_counter() - t)",
+    ]
+    if build_config:
+        stmts += [
+            "import l1m.config.analysis_l1m",
+            "t = time.perf_counter()",
+            build_config_stmt,
+            "print(time.perf_counter() - t)",
+        ]
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(stmts)],
+        capture_output=True,
+        text=True,
+    )
+    if p.returncode != 0:
+        stderr = "\n".join(line for line in p.stderr.splitlines() if not line.startswith("import time:"))
+        raise Exception(f"import of {module} failed:\n{stderr}")
+
+    times = [float(line) for line in p.stdout.strip().splitlines()[-(2 if build_config else 1):]]
+    return times[0], (times[1] if build_config else None), parse_importtime(p.stderr)
+
+
+def main(args: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m l1m.importtime",
+        description="measures import times of modules in fresh interpreters",
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=default_modules,
+        help=f"modules to import; default: {' '.join(default_modules)}",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=3,
+        help="number of imports per module, of which the fastest is reported; default: 3",
+    )
+    parser.add_argument(
+        "--top",
+        "-t",
+        type=int,
+        default=10,
+        help="number of modules with the largest cumulative import times to list; default: 10",
+    )
+    parser.add_argument(
+        "--build-config",
+        "-c",
+        action="store_true",
+        help="also measure building the default config after each import",
+    )
+    parser.add_argument(
+        "--max-time",
+        "-m",
+        type=float,
+        default=None,
+        help="maximum import time per module in seconds, failing with exit code 1 when exceeded; "
+        "default: no maximum",
+    )
+    args = parser.parse_args(args)
+
+    exceeded = []
+    for module in args.modules:
+        runs = [measure(module, build_config=args.build_config) for _ in range(max(args.repeat, 1))]
+        total, build, entries = min(runs, key=lambda run: run[0])
+
+        msg = f"{module}: {total:.3f}s"
+        if build is not None:
+            msg += f", building the config: {min(run[1] for run in runs):.3f}s"
+        print(msg)
+        for name, _, cumulative in sorted(entries, key=lambda e: -e[2])[:args.top]:
+            print(f"  {cumulative / 1e6:>8.3f}s  {name}")
+
+        if args.max_time is not None and total > args.max_time:
+            exceeded.append(module)
+
+    if exceeded:
+        print(f"import time of {', '.join(exceeded)} exceeds {args.max_time:.3f}s", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 # coding: utf-8
 
 """
-Example plot functions for one-dimensional plots.
+Plot functions for efficiency plots and maps.
 """
 
 from __future__ import annotations
@@ -52,7 +52,7 @@ def plot_eff(
     Plot function to create efficiency plots
     """
 
-    from hist.intervals import clopper_pearson_interval
+    from l1m.efficiency.compute import sum_hists, compute_efficiencies
 
     remove_residual_axis(hists, "shift")
 
@@ -63,38 +63,24 @@ def plot_eff(
     hists = apply_density_to_hists(hists, density)
 
     # add all processes into 1 histogram
-    h_sum = sum(list(hists.values())[1:], list(hists.values())[0].copy())
+    h_sum = sum_hists(hists.values())
 
     # use CMS plotting style
     plt.style.use(mplhep.style.CMS)
     fig, ax = plt.subplots()
 
-    # get the histogram axis of the variable
-    var_axis = h_sum.axes[variable_inst.name]
-
-    # get the category instances
+    # compute efficiencies of all categories at once
     denom_cat = config_inst.get_category("valid_probe")
-    categories = [
-        h_sum.axes["category"].bin(i)
-        for i in range(h_sum.axes["category"].size)
-    ]
-    category_insts = [
-        config_inst.get_category(c) for c in categories
-        if c != denom_cat.id
-    ]
-
-    for category_inst in category_insts:
-        h_num = h_sum[{"category": hist.loc(category_inst.id)}].values()
-        h_denom = h_sum[{"category": hist.loc(denom_cat.id)}].values()
-        # vals = h_num / h_denom
-        vals = np.divide(h_num, h_denom, out=np.zeros_like(h_num), where=h_denom != 0)
-        yerr = clopper_pearson_interval(h_num, h_denom)
-        yerr = np.where(vals == 0, 0, np.abs(yerr - vals))
-        xerr = (var_axis.edges[1:] - var_axis.edges[:-1]) / 2
+    table = compute_efficiencies(h_sum, denom_cat.id, variables=[variable_inst.name])
+    var_axis = table.axes[0]
+    yerr = table.errors()
+    xerr = (var_axis.edges[1:] - var_axis.edges[:-1]) / 2
 
+    for i, category_id in enumerate(table.category_ids):
+        category_inst = config_inst.get_category(category_id)
         plot_kwargs = {
-            "x": var_axis.centers, "y": vals,
-            "yerr": yerr, "xerr": xerr,
+            "x": var_axis.centers, "y": table.efficiency[i],
+            "yerr": yerr[:, i], "xerr": xerr,
             "label": category_inst.label,
             "linestyle": "none", "marker": "D",
             "markersize": 7, "elinewidth": 2,
@@ -121,3 +107,58 @@ def plot_eff(
     plt.tight_layout()
 
     return fig, (ax,)
+
+
+def plot_eff_2d(
+    hists: OrderedDict,
+    config_inst: od.Config,
+    category_inst: od.Category,
+    variable_insts: list[od.Variable],
+    density: bool | None = False,
+    process_settings: dict | None = None,
+    variable_settings: dict | None = None,
+    **kwargs,
+) -> plt.Figure:
+    """
+    Plot function to create 2D efficiency maps, e.g. in pt x eta, with one panel per trigger
+    """
+    from l1m.efficiency.compute import sum_hists, compute_efficiencies
+
+    remove_residual_axis(hists, "shift")
+
+    x_inst, y_inst = variable_insts[:2]
+
+    hists = apply_variable_settings(hists, variable_insts, variable_settings)
+    hists = apply_process_settings(hists, process_settings)
+    hists = apply_density_to_hists(hists, density)
+
+    # add all processes into 1 histogram
+    h_sum = sum_hists(hists.values())
+
+    # compute efficiency maps of all categories at once
+    denom_cat = config_inst.get_category("valid_probe")
+    table = compute_efficiencies(h_sum, denom_cat.id, variables=[x_inst.name, y_inst.name])
+    x_edges, y_edges = (axis.edges for axis in table.axes)
+
+    # use CMS plotting style
+    plt.style.use(mplhep.style.CMS)
+    n_cats = len(table.category_ids)
+    fig, axs = plt.subplots(1, n_cats, figsize=(10 * n_cats, 9), squeeze=False)
+    axs = axs[0]
+
+    for ax, category_id, eff in zip(axs, table.category_ids, table.efficiency):
+        category_inst = config_inst.get_category(category_id)
+        mesh = ax.pcolormesh(x_edges, y_edges, eff.T, vmin=0.0, vmax=1.0, cmap="viridis")
+        fig.colorbar(mesh, ax=ax, label="L1T Efficiency")
+        ax.set(
+            title=category_inst.label,
+            xlabel=x_inst.x_title,
+            ylabel=y_inst.x_title,
+            xscale="log" if x_inst.x_log else "linear",
+            yscale="log" if y_inst.x_log else "linear",
+        )
+        mplhep.cms.label(ax=ax, **cms_label_kwargs)
+
+    plt.tight_layout()
+
+    return fig, tuple(axs)
@@ -6,10 +6,11 @@ Column production methods related to higher-level features.
 
 
 from columnflow.production import Producer, producer
-from columnflow.production.categories import category_ids
 from columnflow.production.normalization import normalization_weights
 from columnflow.util import maybe_import
 
+from l1m.production.trigger import trigger_category_ids
+
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
@@ -35,12 +36,12 @@ custom_collections = {
 
 
 @producer(
-    uses={category_ids, normalization_weights},
-    produces={category_ids, normalization_weights},
+    uses={trigger_category_ids, normalization_weights},
+    produces={trigger_category_ids, normalization_weights},
 )
 def default(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
-    # category ids
-    events = self[category_ids](events, **kwargs)
+    # trigger bits and category ids
+    events = self[trigger_category_ids](events, **kwargs)
 
     # mc-only weights
     if self.dataset_inst.is_mc:
@@ -0,0 +1,265 @@
+# coding: utf-8
+
+"""
+Column production methods related to the L1 trigger decisions of probe muons.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+
+import law
+
+from columnflow.production import Producer, producer
+from columnflow.selection import Selector
+from columnflow.columnar_util import set_ak_column
+from columnflow.util import maybe_import
+
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def get_trigger_luts(triggers: dict, n_qual: int = 16) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds lookup tables from the *triggers* defined in ``config.x.triggers``. Returns a 3-tuple
+    with the bitmask of all triggers accepting a certain L1 quality (indexed by quality), the pt
+    thresholds and the bit values of all triggers.
+    """
+    qual_lut = np.zeros(n_qual, dtype=np.int32)
+    pt_thresholds = np.zeros(len(triggers), dtype=np.float32)
+    bit_values = np.zeros(len(triggers), dtype=np.int32)
+    for i, trigger in enumerate(triggers.values()):
+        bit_values[i] = 1 << trigger.bit
+        pt_thresholds[i] = trigger.pt
+        qual_lut[list(trigger.qual)] |= bit_values[i]
+
+    return qual_lut, pt_thresholds, bit_values
+
+
+def compute_trigger_bits(
+    l1mu: ak.Array,
+    qual_lut: np.ndarray,
+    pt_thresholds: np.ndarray,
+    bit_values: np.ndarray,
+    max_dr: float = 0.4,
+) -> np.ndarray:
+    """
+    Computes the trigger bitmask per entry of the jagged L1 muon collection *l1mu* (one list of
+    matched L1 muons per probe) in a single pass over its flat content. Bit *i* is set when at least
+    one L1 muon passes the pt and quality requirements of the trigger with bit value *1 << i*.
+    """
+    counts = ak.to_numpy(ak.num(l1mu, axis=1))
+    pt = ak.to_numpy(ak.flatten(l1mu.pt, axis=1))
+    qual = ak.to_numpy(ak.flatten(l1mu.hwQual, axis=1))
+    dr = ak.to_numpy(ak.flatten(l1mu.dr, axis=1))
+
+    # bitmask per L1 muon: quality lookup & pt thresholds & dr requirement
+    # (this is the dr to the probe muon, which should already be required during the reduction)
+    pt_bits = (pt[:, None] > pt_thresholds[None, :]) @ bit_values
+    l1_bits = qual_lut[np.clip(qual, 0, len(qual_lut) - 1)] & pt_bits
+    l1_bits[dr >= max_dr] = 0
+
+    # or-reduce per probe, skipping probes without any L1 muon
+    bits = np.zeros(len(counts), dtype=np.int32)
+    non_empty = counts > 0
+    if np.any(non_empty):
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        bits[non_empty] = np.bitwise_or.reduceat(l1_bits, starts)
+
+    return bits
+
+
+def compute_trigger_bits_flat(
+    l1_pt: np.ndarray,
+    l1_qual: np.ndarray,
+    qual_lut: np.ndarray,
+    pt_thresholds: np.ndarray,
+    bit_values: np.ndarray,
+) -> np.ndarray:
+    """
+    Computes the trigger bitmask per probe from the flat pt and quality of its uniquely matched L1
+    muon (see :py:func:`l1m.reduction.muons.add_unique_l1_match`), with negative qualities marking
+    probes without a match.
+    """
+    pt_bits = (l1_pt[:, None] > pt_thresholds[None, :]) @ bit_values
+    bits = qual_lut[np.clip(l1_qual, 0, len(qual_lut) - 1)] & pt_bits
+    bits[l1_qual < 0] = 0
+
+    return bits.astype(np.int32)
+
+
+def compute_max_l1_pt(
+    l1mu: ak.Array,
+    min_quals: list[int],
+    max_dr: float = 0.4,
+) -> np.ndarray:
+    """
+    Computes the highest pt of all L1 muons in the jagged collection *l1mu* (one list of matched L1
+    muons per probe) with a quality of at least each of the *min_quals* in a single pass over its
+    flat content. Returns an array of shape ``(n_probes, len(min_quals))`` with -1 for probes
+    without any such L1 muon.
+    """
+    counts = ak.to_numpy(ak.num(l1mu, axis=1))
+    pt = ak.to_numpy(ak.flatten(l1mu.pt, axis=1))
+    qual = ak.to_numpy(ak.flatten(l1mu.hwQual, axis=1))
+    dr = ak.to_numpy(ak.flatten(l1mu.dr, axis=1))
+
+    # pt per L1 muon and quality cut, -1 when failing the quality or dr requirement
+    passed = (qual[:, None] >= np.asarray(min_quals)[None, :]) & (dr < max_dr)[:, None]
+    l1_pt = np.where(passed, pt[:, None], -1.0).astype(np.float32)
+
+    # max-reduce per probe, skipping probes without any L1 muon
+    max_pt = np.full((len(counts), len(min_quals)), -1.0, dtype=np.float32)
+    non_empty = counts > 0
+    if np.any(non_empty):
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        max_pt[non_empty] = np.maximum.reduceat(l1_pt, starts, axis=0)
+
+    return max_pt
+
+
+# columns of the L1 muons matched to probes, either as jagged lists or as flat unique matches
+# (see the "unique_l1_match" config entry)
+jagged_l1_columns = {"ProbeMuon.L1ProbeMuon.pt", "ProbeMuon.L1ProbeMuon.hwQual", "ProbeMuon.L1ProbeMuon.dr"}
+unique_l1_columns = {"ProbeMuon.l1_pt", "ProbeMuon.l1_qual"}
+
+
+def use_l1_columns(producer_inst: Producer) -> None:
+    """
+    Replaces the jagged L1 muon columns used by *producer_inst* by the flat ones when the unique L1
+    matching is configured, and stores the mode as *unique_l1_match*.
+    """
+    producer_inst.unique_l1_match = producer_inst.config_inst.x("unique_l1_match", None)
+    if producer_inst.unique_l1_match:
+        producer_inst.uses.difference_update(jagged_l1_columns)
+        producer_inst.uses.update(unique_l1_columns)
+
+
+@producer(
+    uses=set(jagged_l1_columns),
+)
+def l1_max_pt(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Produces the highest pt of the L1 muons matched to each probe for all minimum qualities of the
+    threshold scan in ``config.x.threshold_scan`` as columns "L1MaxPt.q<min_qual>", with -1 when
+    no L1 muon passes the quality cut.
+    """
+    if self.unique_l1_match:
+        # at most one L1 muon per probe
+        l1_pt = ak.to_numpy(events.ProbeMuon.l1_pt)
+        l1_qual = ak.to_numpy(events.ProbeMuon.l1_qual)
+        passed = l1_qual[:, None] >= np.asarray(self.min_quals)[None, :]
+        max_pt = np.where(passed, l1_pt[:, None], -1.0).astype(np.float32)
+    else:
+        max_pt = compute_max_l1_pt(events.ProbeMuon.L1ProbeMuon, self.min_quals)
+    for i, min_qual in enumerate(self.min_quals):
+        events = set_ak_column(events, f"L1MaxPt.q{min_qual}", max_pt[:, i], value_type=np.float32)
+
+    return events
+
+
+@l1_max_pt.init
+def l1_max_pt_init(self: Producer) -> None:
+    self.min_quals = list(self.config_inst.x.threshold_scan.min_quals)
+    self.produces.update(f"L1MaxPt.q{min_qual}" for min_qual in self.min_quals)
+    use_l1_columns(self)
+
+
+@producer(
+    uses={"ProbeMuon.eta"} | jagged_l1_columns,
+    produces={"trigger_bits", "tf_region"},
+)
+def trigger_bits(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Produces the bitmask of all triggers in ``config.x.triggers`` fired by the L1 muons matched to
+    each probe, as well as the integer-encoded track finder region of the probe
+    (0: barrel, 1: overlap, 2: endcap). With the unique L1 matching, bits are decided by flat
+    comparisons of the matched L1 muon.
+    """
+    if self.unique_l1_match:
+        bits = compute_trigger_bits_flat(
+            ak.to_numpy(events.ProbeMuon.l1_pt),
+            ak.to_numpy(events.ProbeMuon.l1_qual),
+            *self.trigger_luts,
+        )
+    else:
+        bits = compute_trigger_bits(events.ProbeMuon.L1ProbeMuon, *self.trigger_luts)
+    events = set_ak_column(events, "trigger_bits", bits, value_type=np.int32)
+
+    tf_region = np.digitize(np.abs(ak.to_numpy(events.ProbeMuon.eta)), self.tf_region_edges)
+    events = set_ak_column(events, "tf_region", tf_region, value_type=np.int8)
+
+    return events
+
+
+@trigger_bits.init
+def trigger_bits_init(self: Producer) -> None:
+    self.trigger_luts = get_trigger_luts(self.config_inst.x.triggers)
+    self.tf_region_edges = self.config_inst.x.tf_region_edges
+    use_l1_columns(self)
+
+
+@producer(
+    uses={trigger_bits},
+    produces={trigger_bits, "category_ids"},
+)
+def trigger_category_ids(
+    self: Producer,
+    events: ak.Array,
+    **kwargs,
+) -> ak.Array:
+    """
+    Assigns each probe an array of category ids. Trigger categories (marked with a "trigger" aux
+    entry) are decided by plain bit tests on the trigger bitmask so that adding triggers does not
+    require additional passes over the L1 muons. All other leaf categories are evaluated through
+    their selectors.
+    """
+    events = self[trigger_bits](events, **kwargs)
+
+    leaf_cats = self.config_inst.get_leaf_categories()
+    bits = ak.to_numpy(events.trigger_bits)
+    cat_masks = np.zeros((len(events), len(leaf_cats)), dtype=bool)
+    for i, cat_inst in enumerate(leaf_cats):
+        if cat_inst.x("trigger", None):
+            trigger = self.config_inst.x.triggers[cat_inst.x.trigger]
+            cat_masks[:, i] = (bits & (1 << trigger.bit)) != 0
+            continue
+
+        cat_mask = np.ones(len(events), dtype=bool)
+        for selector in self.category_to_selectors[cat_inst]:
+            _cat_mask = self[selector](events[cat_mask], **kwargs)
+            cat_mask[cat_mask] &= np.asarray(_cat_mask == 1)
+        cat_masks[:, i] = cat_mask
+
+    # build the jagged category ids of all categories at once
+    cat_ids = np.broadcast_to(np.array([cat_inst.id for cat_inst in leaf_cats]), cat_masks.shape)
+    category_ids = ak.unflatten(cat_ids[cat_masks], cat_masks.sum(axis=1))
+    events = set_ak_column(events, "category_ids", category_ids, value_type=np.int64)
+
+    return events
+
+
+@trigger_category_ids.init
+def trigger_category_ids_init(self: Producer) -> None:
+    # store a mapping from non-trigger leaf categories to selector classes
+    self.category_to_selectors = defaultdict(list)
+
+    for cat_inst in self.config_inst.get_leaf_categories():
+        if cat_inst.x("trigger", None):
+            continue
+
+        for sel in law.util.make_list(cat_inst.selection):
+            if Selector.derived_by(sel):
+                selector = sel
+            elif Selector.has_cls(sel):
+                selector = Selector.get_cls(sel)
+            else:
+                raise Exception(
+                    f"selection '{sel}' of category '{cat_inst.name}' cannot be resolved to an "
+                    "existing Selector object",
+                )
+
+            self.uses.add(selector)
+            self.produces.add(selector)
+            self.category_to_selectors[cat_inst].append(selector)
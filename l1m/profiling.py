@@ -0,0 +1,244 @@
+# coding: utf-8
+
+"""
+Lightweight instrumentation of processing steps with export to the Chrome trace event format.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import resource
+import threading
+import contextlib
+from typing import Any, Callable
+
+import law
+
+
+_null_context = contextlib.nullcontext()
+
+
+def _null_lap(*args, **kwargs) -> None:
+    return None
+
+
+def get_rss() -> int:
+    """
+    Returns the current resident set size of this process in bytes, falling back to its peak value
+    when the current one cannot be determined.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss()
+
+
+def get_peak_rss() -> int:
+    """
+    Returns the peak resident set size of this process in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_size(obj: Any) -> dict[str, int]:
+    """
+    Returns the length and, when available, the number of bytes of *obj*, e.g. an awkward or arrow
+    array.
+    """
+    size = {}
+    try:
+        size["len"] = len(obj)
+    except TypeError:
+        pass
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        size["nbytes"] = nbytes
+    return size
+
+
+class StepProfiler(object):
+    """
+    Records the wall time, CPU time, resident set size and optional array sizes of named steps. Steps
+    are recorded either with the :py:meth:`step` context manager, or as consecutive laps of a
+    :py:meth:`laps` timer that attribute the time since the previous lap to the given step. Records
+    are thread-safe and carry the current chunk index set with :py:meth:`chunk`.
+
+    When not *enabled*, all methods return shared no-op objects so that instrumented code has a
+    negligible overhead.
+
+    .. code-block:: python
+
+        profiler = StepProfiler()
+        with profiler.chunk(0), profiler.step("selection"):
+            lap = profiler.laps()
+            events = select(events)
+            lap("select", events)
+
+        trace = profiler.to_trace()
+        print(profiler.summary_table())
+    """
+
+    def __init__(self, enabled: bool = True):
+        super().__init__()
+
+        self.enabled = enabled
+        self.records = []
+
+        self._t0 = time.perf_counter()
+        self._local = threading.local()
+
+    def child(self) -> StepProfiler:
+        """
+        Returns a new, empty profiler with the same settings and time reference, e.g. to record
+        steps in forked worker processes whose records are added back via :py:meth:`extend`.
+        """
+        profiler = self.__class__(enabled=self.enabled)
+        profiler._t0 = self._t0
+        return profiler
+
+    def _record(self, name: str, t_start: float, t_stop: float, cpu: float, obj: Any = None, **kwargs):
+        record = {
+            "name": name,
+            "ts": t_start - self._t0,
+            "dur": t_stop - t_start,
+            "cpu": cpu,
+            "rss": get_rss(),
+            "peak_rss": get_peak_rss(),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "chunk": getattr(self._local, "chunk", None),
+        }
+        if obj is not None:
+            record.update(get_size(obj))
+        record.update(kwargs)
+        self.records.append(record)
+
+    @contextlib.contextmanager
+    def _chunk(self, index: Any):
+        prev = getattr(self._local, "chunk", None)
+        self._local.chunk = index
+        try:
+            yield
+        finally:
+            self._local.chunk = prev
+
+    def chunk(self, index: Any):
+        """
+        Context manager that attributes all steps recorded in the current thread to the chunk with
+        *index*.
+        """
+        return self._chunk(index) if self.enabled else _null_context
+
+    @contextlib.contextmanager
+    def _step(self, name: str, **kwargs):
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self._record(name, t0, time.perf_counter(), time.thread_time() - c0, **kwargs)
+
+    def step(self, name: str, **kwargs):
+        """
+        Context manager that records the step *name*, with *kwargs* stored in the record.
+        """
+        return self._step(name, **kwargs) if self.enabled else _null_context
+
+    def laps(self) -> Callable:
+        """
+        Starts a timer and returns a function ``lap(name, obj=None, **kwargs)`` that records the
+        time since the start or the previous lap as the step *name*, together with the size of the
+        result *obj* of the step.
+        """
+        if not self.enabled:
+            return _null_lap
+
+        last = [time.perf_counter(), time.thread_time()]
+
+        def lap(name: str, obj: Any = None, **kwargs) -> None:
+            t, c = time.perf_counter(), time.thread_time()
+            self._record(name, last[0], t, c - last[1], obj=obj, **kwargs)
+            last[:] = time.perf_counter(), time.thread_time()
+
+        return lap
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """
+        Returns a function that calls *func* within the step *name*, e.g. to record callables that
+        are executed in other threads. The chunk index at the time of wrapping is kept.
+        """
+        if not self.enabled:
+            return func
+
+        index = getattr(self._local, "chunk", None)
+
+        def wrapper(*args, **kwargs):
+            with self.chunk(index), self.step(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def extend(self, records: list[dict]) -> None:
+        """
+        Adds *records* of another profiler, e.g. one in a worker process. Their timestamps must be
+        relative to the same reference, which is the case for profilers in forked processes.
+        """
+        self.records.extend(records)
+
+    def to_trace(self) -> dict:
+        """
+        Returns all records as complete events ("ph": "X") in the Chrome trace event format, which
+        can be inspected with chrome://tracing or Perfetto.
+        """
+        events = []
+        for record in self.records:
+            args = {k: v for k, v in record.items() if k not in ("name", "ts", "dur", "pid", "tid")}
+            events.append({
+                "name": record["name"],
+                "ph": "X",
+                "ts": record["ts"] * 1e6,
+                "dur": record["dur"] * 1e6,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Returns per step name the number of calls, the total and maximum wall time, the total CPU
+        time, the maximum resident set size and the total number of bytes of step results.
+        """
+        summary = {}
+        for record in self.records:
+            s = summary.setdefault(record["name"], {
+                "calls": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0, "max_rss": 0, "nbytes": 0,
+            })
+            s["calls"] += 1
+            s["wall"] += record["dur"]
+            s["max_wall"] = max(s["max_wall"], record["dur"])
+            s["cpu"] += record["cpu"]
+            s["max_rss"] = max(s["max_rss"], record["rss"])
+            s["nbytes"] += record.get("nbytes", 0)
+        return summary
+
+    def summary_table(self) -> str:
+        """
+        Returns the :py:meth:`summary` as a table, sorted by decreasing total wall time.
+        """
+        lines = [
+            f"{'step':<28} {'calls':>6} {'wall [s]':>10} {'max [s]':>9} {'cpu [s]':>9} "
+            f"{'max rss':>10} {'result size':>12}",
+        ]
+        for name, s in sorted(self.summary().items(), key=lambda item: -item[1]["wall"]):
+            lines.append(
+                f"{name:<28} {s['calls']:>6} {s['wall']:>10.3f} {s['max_wall']:>9.3f} "
+                f"{s['cpu']:>9.3f} {law.util.human_bytes(s['max_rss'], fmt=True):>10} "
+                f"{law.util.human_bytes(s['nbytes'], fmt=True):>12}",
+            )
+        return "\n".join(lines)
+
+
+# shared disabled profiler as default of instrumented functions
+null_profiler = StepProfiler(enabled=False)
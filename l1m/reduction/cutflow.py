@@ -0,0 +1,306 @@
+# coding: utf-8
+
+"""
+Mergeable cutflow accumulator with counts grouped by selection step, process and optionally by
+run and luminosity block.
+"""
+
+from __future__ import annotations
+
+from typing import BinaryIO, Iterable
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# separator of variant names and step names of selection variants filled into the same cutflow
+variant_separator = ":"
+
+
+def variant_step(variant: str | None, step: str) -> str:
+    """
+    Returns the name of the cutflow *step* of the selection *variant*, which is the *step* itself
+    when *variant* is *None*.
+    """
+    return step if variant is None else f"{variant}{variant_separator}{step}"
+
+
+def _add_columns(
+    keys: np.ndarray,
+    table: np.ndarray,
+    new_keys: np.ndarray,
+    new_table: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Adds the columns of *new_table* (one per entry in the sorted, unique *new_keys*) to the columns
+    of *table* (one per entry in the sorted, unique *keys*) and returns the updated keys and table.
+    Both tables must have the same number of rows. *table* is updated in-place when it already
+    contains all *new_keys*.
+    """
+    if np.isin(new_keys, keys).all():
+        table[:, np.searchsorted(keys, new_keys)] += new_table
+        return keys, table
+
+    all_keys = np.union1d(keys, new_keys)
+    out = np.zeros((table.shape[0], len(all_keys)), dtype=table.dtype)
+    out[:, np.searchsorted(all_keys, keys)] += table
+    out[:, np.searchsorted(all_keys, new_keys)] += new_table
+    return all_keys, out
+
+
+class Cutflow(object):
+    """
+    Accumulator of the number of events and the sum of mc weights after each selection step, grouped
+    by process id. With *by_lumi*, event counts are additionally grouped by run and luminosity
+    block. Steps are registered in the order they are first filled.
+
+    Instances can be added in-place, merged in bulk with :py:meth:`merge`, and serialized to a
+    compressed numpy archive with :py:meth:`dump` and :py:meth:`load`.
+
+    .. code-block:: python
+
+        cutflow = Cutflow(by_lumi=True)
+        cutflow.fill("all", events.process_id, events.mc_weight, events.run, events.luminosityBlock)
+        cutflow.n_events("all")
+        # -> 1000
+    """
+
+    def __init__(self, by_lumi: bool = False):
+        super().__init__()
+
+        self.by_lumi = by_lumi
+
+        # step names, process ids and [step, process] tables
+        self.steps = []
+        self.process_ids = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.weights = np.zeros((0, 0), dtype=np.float64)
+
+        # (run << 32 | lumi) keys and [step, lumi] counts
+        self.lumi_keys = np.zeros(0, dtype=np.uint64)
+        self.lumi_counts = np.zeros((0, 0), dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} steps={len(self.steps)} "
+            f"processes={len(self.process_ids)} lumis={len(self.lumi_keys)} at {hex(id(self))}>"
+        )
+
+    def step_index(self, step: str) -> int:
+        """
+        Returns the index of the *step*, registering it when not existing yet.
+        """
+        if step not in self.steps:
+            self.steps.append(step)
+            self.counts = np.vstack([self.counts, np.zeros((1, self.counts.shape[1]), dtype=np.int64)])
+            self.weights = np.vstack([self.weights, np.zeros((1, self.weights.shape[1]))])
+            self.lumi_counts = np.vstack([
+                self.lumi_counts,
+                np.zeros((1, self.lumi_counts.shape[1]), dtype=np.int64),
+            ])
+        return self.steps.index(step)
+
+    def fill(
+        self,
+        step: str,
+        process_id: ak.Array | np.ndarray,
+        weight: ak.Array | np.ndarray | None = None,
+        run: ak.Array | np.ndarray | None = None,
+        lumi: ak.Array | np.ndarray | None = None,
+    ) -> None:
+        """
+        Adds events with *process_id* and optional *weight* to the *step*. *run* and *lumi* are only
+        considered when the cutflow is grouped by luminosity block.
+        """
+        i = self.step_index(step)
+
+        # grouped sums per process via bincount over unique process ids
+        process_ids, inverse = np.unique(np.asarray(process_id, dtype=np.int64), return_inverse=True)
+        n = len(process_ids)
+        row = np.zeros((len(self.steps), n), dtype=np.int64)
+        row[i] = np.bincount(inverse, minlength=n)
+        _, self.counts = _add_columns(self.process_ids, self.counts, process_ids, row)
+
+        weight_row = np.zeros((len(self.steps), n), dtype=np.float64)
+        if weight is not None:
+            weight_row[i] = np.bincount(inverse, weights=np.asarray(weight, dtype=np.float64), minlength=n)
+        self.process_ids, self.weights = _add_columns(self.process_ids, self.weights, process_ids, weight_row)
+
+        if self.by_lumi and run is not None and lumi is not None:
+            keys = (np.asarray(run, dtype=np.uint64) << np.uint64(32)) | np.asarray(lumi, dtype=np.uint64)
+            lumi_keys, inverse = np.unique(keys, return_inverse=True)
+            row = np.zeros((len(self.steps), len(lumi_keys)), dtype=np.int64)
+            row[i] = np.bincount(inverse, minlength=len(lumi_keys))
+            self.lumi_keys, self.lumi_counts = _add_columns(self.lumi_keys, self.lumi_counts, lumi_keys, row)
+
+    def _aligned_rows(self, other: Cutflow, table: np.ndarray) -> np.ndarray:
+        # reorder the rows of a table of *other* to the step order of this instance
+        out = np.zeros((len(self.steps), table.shape[1]), dtype=table.dtype)
+        out[[self.step_index(step) for step in other.steps]] = table
+        return out
+
+    def __iadd__(self, other: Cutflow) -> Cutflow:
+        for step in other.steps:
+            self.step_index(step)
+
+        _, self.counts = _add_columns(
+            self.process_ids, self.counts,
+            other.process_ids, self._aligned_rows(other, other.counts),
+        )
+        self.process_ids, self.weights = _add_columns(
+            self.process_ids, self.weights,
+            other.process_ids, self._aligned_rows(other, other.weights),
+        )
+        self.lumi_keys, self.lumi_counts = _add_columns(
+            self.lumi_keys, self.lumi_counts,
+            other.lumi_keys, self._aligned_rows(other, other.lumi_counts),
+        )
+        self.by_lumi |= other.by_lumi
+
+        return self
+
+    @classmethod
+    def merge(cls, cutflows: Iterable[Cutflow]) -> Cutflow:
+        """
+        Merges all *cutflows* into a new instance. The tables are allocated only once with the
+        union of all steps, processes and luminosity blocks.
+        """
+        cutflows = list(cutflows)
+        merged = cls(by_lumi=any(cutflow.by_lumi for cutflow in cutflows))
+        for cutflow in cutflows:
+            for step in cutflow.steps:
+                merged.step_index(step)
+
+        # allocate the merged tables
+        process_ids = np.unique(np.concatenate([merged.process_ids] + [c.process_ids for c in cutflows]))
+        lumi_keys = np.unique(np.concatenate([merged.lumi_keys] + [c.lumi_keys for c in cutflows]))
+        merged.process_ids = process_ids
+        merged.counts = np.zeros((len(merged.steps), len(process_ids)), dtype=np.int64)
+        merged.weights = np.zeros((len(merged.steps), len(process_ids)), dtype=np.float64)
+        merged.lumi_keys = lumi_keys
+        merged.lumi_counts = np.zeros((len(merged.steps), len(lumi_keys)), dtype=np.int64)
+
+        # add all tables
+        for cutflow in cutflows:
+            rows = [merged.steps.index(step) for step in cutflow.steps]
+            cols = np.searchsorted(process_ids, cutflow.process_ids)
+            merged.counts[np.ix_(rows, cols)] += cutflow.counts
+            merged.weights[np.ix_(rows, cols)] += cutflow.weights
+            cols = np.searchsorted(lumi_keys, cutflow.lumi_keys)
+            merged.lumi_counts[np.ix_(rows, cols)] += cutflow.lumi_counts
+
+        return merged
+
+    def select(self, steps: list[str], names: list[str] | None = None) -> Cutflow:
+        """
+        Returns a new cutflow with only the *steps* in the given order, optionally renamed to
+        *names*.
+        """
+        rows = [self.steps.index(step) for step in steps]
+        cutflow = self.__class__(by_lumi=self.by_lumi)
+        cutflow.steps = list(steps if names is None else names)
+        cutflow.process_ids = self.process_ids.copy()
+        cutflow.counts = self.counts[rows]
+        cutflow.weights = self.weights[rows]
+        cutflow.lumi_keys = self.lumi_keys.copy()
+        cutflow.lumi_counts = self.lumi_counts[rows]
+        return cutflow
+
+    def for_variant(self, variant: str) -> Cutflow:
+        """
+        Returns the cutflow of the selection *variant*, consisting of all steps shared by all
+        variants followed by the steps of *variant* (see :py:func:`variant_step`) without prefix.
+        """
+        prefix = variant_step(variant, "")
+        steps = [
+            step for step in self.steps
+            if variant_separator not in step or step.startswith(prefix)
+        ]
+        return self.select(steps, [step[len(prefix):] if step.startswith(prefix) else step for step in steps])
+
+    def n_events(self, step: str, process_id: int | None = None) -> int:
+        """
+        Returns the number of events after *step*, optionally only for *process_id*.
+        """
+        row = self.counts[self.steps.index(step)]
+        if process_id is None:
+            return int(row.sum())
+        idx = np.flatnonzero(self.process_ids == process_id)
+        return int(row[idx].sum())
+
+    def sum_weights(self, step: str, process_id: int | None = None) -> float:
+        """
+        Returns the sum of mc weights after *step*, optionally only for *process_id*.
+        """
+        row = self.weights[self.steps.index(step)]
+        if process_id is None:
+            return float(row.sum())
+        idx = np.flatnonzero(self.process_ids == process_id)
+        return float(row[idx].sum())
+
+    def lumi_table(self, step: str) -> np.ndarray:
+        """
+        Returns a structured array with fields *run*, *lumi* and *n_events* after *step* for all
+        luminosity blocks.
+        """
+        table = np.zeros(len(self.lumi_keys), dtype=[("run", np.uint32), ("lumi", np.uint32), ("n_events", np.int64)])
+        table["run"] = self.lumi_keys >> np.uint64(32)
+        table["lumi"] = self.lumi_keys & np.uint64(0xFFFFFFFF)
+        table["n_events"] = self.lumi_counts[self.steps.index(step)]
+        return table
+
+    def to_stats(self, is_mc: bool = False, norm_step: str | None = None) -> dict:
+        """
+        Converts the cutflow into the flat stats format used by cf.MergeSelectionStats. The first
+        step is stored as "n_events" (and "sum_mc_weight" when *is_mc*), all others with the step
+        name as suffix. The sums of mc weights per process are stored for *norm_step*, defaulting to
+        the last step.
+        """
+        stats = {}
+        for i, step in enumerate(self.steps):
+            suffix = f"_{step}" if i else ""
+            stats[f"n_events{suffix}"] = int(self.counts[i].sum())
+            if is_mc:
+                stats[f"sum_mc_weight{suffix}"] = float(self.weights[i].sum())
+
+        if is_mc and self.steps:
+            i = self.steps.index(norm_step) if norm_step else len(self.steps) - 1
+            stats["sum_mc_weight_per_process"] = {
+                int(process_id): float(w)
+                for process_id, w, n in zip(self.process_ids, self.weights[i], self.counts[i])
+                if n
+            }
+
+        return stats
+
+    def dump(self, f: BinaryIO) -> None:
+        """
+        Writes the cutflow to the binary file object *f* as a compressed numpy archive.
+        """
+        np.savez_compressed(
+            f,
+            by_lumi=self.by_lumi,
+            steps=np.array(self.steps, dtype=str),
+            process_ids=self.process_ids,
+            counts=self.counts,
+            weights=self.weights,
+            lumi_keys=self.lumi_keys,
+            lumi_counts=self.lumi_counts,
+        )
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> Cutflow:
+        """
+        Reads a cutflow from the binary file object *f* written by :py:meth:`dump`.
+        """
+        data = np.load(f)
+        cutflow = cls(by_lumi=bool(data["by_lumi"]))
+        cutflow.steps = [str(step) for step in data["steps"]]
+        cutflow.process_ids = data["process_ids"]
+        cutflow.counts = data["counts"].reshape(len(cutflow.steps), len(cutflow.process_ids))
+        cutflow.weights = data["weights"].reshape(len(cutflow.steps), len(cutflow.process_ids))
+        cutflow.lumi_keys = data["lumi_keys"]
+        cutflow.lumi_counts = data["lumi_counts"].reshape(len(cutflow.steps), len(cutflow.lumi_keys))
+        return cutflow
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+"""
+Bookkeeping of input files that were reduced incrementally.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+
+
+class ReductionLedger(object):
+    """
+    Record of all reduced input files of a dataset, mapping their lfns to content fingerprints and
+    the source of their reduction, i.e., "branch" for files reduced by the regular branches of
+    :py:class:`l1m.tasks.reduction.CustomReduceEvents` or "update" for files reduced afterwards.
+    Files are kept in the order they were added.
+
+    .. code-block:: python
+
+        ledger = ReductionLedger()
+        ledger.add("/data/nano_1.root", "ae2d53be97cbbd18", source="branch")
+        ledger.new({"/data/nano_1.root": "ae2d53be97cbbd18", "/data/nano_2.root": "0f1e..."})
+        # -> ["/data/nano_2.root"]
+    """
+
+    def __init__(self, data: dict | None = None):
+        super().__init__()
+
+        self.files = OrderedDict((data or {}).get("files", {}))
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, lfn: str) -> bool:
+        return lfn in self.files
+
+    def to_dict(self) -> dict:
+        return {"files": self.files}
+
+    def add(self, lfn: str, fingerprint: str, source: str = "update") -> None:
+        """
+        Adds the file with *lfn* and *fingerprint*, reduced by *source*. Files reduced by branches
+        are part of all merged results by construction.
+        """
+        self.files[lfn] = {"fingerprint": fingerprint, "source": source}
+
+    def new(self, fingerprints: dict[str, str]) -> list[str]:
+        """
+        Returns the lfns in *fingerprints* that are not yet recorded, in the given order.
+        """
+        return [lfn for lfn in fingerprints if lfn not in self.files]
+
+    def changed(self, fingerprints: dict[str, str]) -> list[str]:
+        """
+        Returns the recorded lfns whose fingerprint differs from the one in *fingerprints* or that
+        are missing in *fingerprints*.
+        """
+        return [
+            lfn for lfn, info in self.files.items()
+            if lfn not in fingerprints or fingerprints[lfn] != info["fingerprint"]
+        ]
+
+    def lfns(self, source: str | None = None) -> list[str]:
+        """
+        Returns the recorded lfns, optionally only those of files reduced by *source*.
+        """
+        return [lfn for lfn, info in self.files.items() if source in (None, info["source"])]
@@ -0,0 +1,241 @@
+# coding: utf-8
+
+"""
+Delta R matching of muon collections based on flat offsets and content buffers.
+
+Instead of building nested cartesian products per event, the kernels below loop over the flat
+content of two jagged collections and only store the pairs that pass the matching requirements.
+"""
+
+from __future__ import annotations
+
+import functools
+from collections import namedtuple
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+nb = maybe_import("numba")
+
+
+# container for the result of a pair matching
+MatchResult = namedtuple("MatchResult", ["counts", "index", "flat_index", "dr", "m_inv"])
+
+
+def jit(func):
+    """
+    Decorator that compiles *func* with numba upon the first call. The compilation is deferred so
+    that importing this module does not require numba, in which case *func* is used as is.
+    """
+    compiled = None
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        nonlocal compiled
+        if compiled is None:
+            compiled = nb.njit(nogil=True)(func) if nb else func
+        return compiled(*args)
+
+    return wrapper
+
+
+@jit
+def _any_match_kernel(offsets_a, eta_a, phi_a, offsets_b, eta_b, phi_b, max_dr):
+    mask = np.zeros(len(eta_a), dtype=np.bool_)
+    for evt in range(len(offsets_a) - 1):
+        for i in range(offsets_a[evt], offsets_a[evt + 1]):
+            for j in range(offsets_b[evt], offsets_b[evt + 1]):
+                deta = eta_a[i] - eta_b[j]
+                dphi = (phi_a[i] - phi_b[j] + np.pi) % (2 * np.pi) - np.pi
+                if np.sqrt(deta**2 + dphi**2) < max_dr:
+                    mask[i] = True
+                    break
+    return mask
+
+
+@jit
+def _pair_kernel(
+    offsets_a, pt_a, eta_a, phi_a, mass_a,
+    offsets_b, pt_b, eta_b, phi_b, mass_b,
+    min_dr, max_dr, min_mass, max_mass, check_mass,
+    counts, index, flat_index, dr, m_inv, fill,
+):
+    # when fill is False, only the number of accepted pairs per object in a is counted,
+    # otherwise the preallocated pair buffers are filled
+    k = 0
+    for evt in range(len(offsets_a) - 1):
+        for i in range(offsets_a[evt], offsets_a[evt + 1]):
+            for j in range(offsets_b[evt], offsets_b[evt + 1]):
+                # delta r
+                deta = np.float64(eta_a[i]) - np.float64(eta_b[j])
+                dphi = (np.float64(phi_a[i]) - np.float64(phi_b[j]) + np.pi) % (2 * np.pi) - np.pi
+                _dr = np.sqrt(deta**2 + dphi**2)
+                if not (min_dr < _dr < max_dr):
+                    continue
+
+                # invariant mass of the pair, only when requested and in double precision, as the
+                # energy and momentum sums cancel for nearly collinear pairs
+                _m_inv = np.nan
+                if check_mass:
+                    _pt_a, _eta_a, _phi_a = np.float64(pt_a[i]), np.float64(eta_a[i]), np.float64(phi_a[i])
+                    _pt_b, _eta_b, _phi_b = np.float64(pt_b[j]), np.float64(eta_b[j]), np.float64(phi_b[j])
+                    px = _pt_a * np.cos(_phi_a) + _pt_b * np.cos(_phi_b)
+                    py = _pt_a * np.sin(_phi_a) + _pt_b * np.sin(_phi_b)
+                    pz = _pt_a * np.sinh(_eta_a) + _pt_b * np.sinh(_eta_b)
+                    e_a = np.sqrt((_pt_a * np.cosh(_eta_a))**2 + np.float64(mass_a[i])**2)
+                    e_b = np.sqrt((_pt_b * np.cosh(_eta_b))**2 + np.float64(mass_b[j])**2)
+                    _m_inv = np.sqrt(max((e_a + e_b)**2 - px**2 - py**2 - pz**2, 0.0))
+                    if not (min_mass < _m_inv < max_mass):
+                        continue
+
+                if not fill:
+                    counts[i] += 1
+                    continue
+
+                index[k] = j - offsets_b[evt]
+                flat_index[k] = j
+                dr[k] = _dr
+                m_inv[k] = _m_inv
+                k += 1
+
+
+@jit
+def _greedy_kernel(order, pair_a, pair_b, n_a, n_b):
+    # visit pairs by rank and accept them when both objects are still unmatched
+    match = np.full(n_a, -1, dtype=np.int64)
+    used_b = np.zeros(n_b, dtype=np.bool_)
+    for k in order:
+        i = pair_a[k]
+        j = pair_b[k]
+        if match[i] >= 0 or used_b[j]:
+            continue
+        match[i] = k
+        used_b[j] = True
+    return match
+
+
+def _flat_buffers(coll: ak.Array, fields: tuple[str]) -> tuple[np.ndarray]:
+    """
+    Returns the offsets of a jagged collection *coll* followed by the flat numpy contents of all
+    *fields*.
+    """
+    counts = ak.to_numpy(ak.num(coll, axis=1))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return (offsets,) + tuple(
+        np.ascontiguousarray(ak.to_numpy(ak.flatten(coll[field], axis=1)))
+        for field in fields
+    )
+
+
+def any_match(coll_a: ak.Array, coll_b: ak.Array, max_dr: float) -> ak.Array:
+    """
+    Returns a jagged mask with the structure of *coll_a* that is *True* for all objects with at
+    least one object in *coll_b* of the same event within a delta R of *max_dr*.
+    """
+    offsets_a, eta_a, phi_a = _flat_buffers(coll_a, ("eta", "phi"))
+    offsets_b, eta_b, phi_b = _flat_buffers(coll_b, ("eta", "phi"))
+
+    mask = _any_match_kernel(offsets_a, eta_a, phi_a, offsets_b, eta_b, phi_b, max_dr)
+
+    return ak.unflatten(mask, np.diff(offsets_a))
+
+
+def match_pairs(
+    coll_a: ak.Array,
+    coll_b: ak.Array,
+    dr_range: tuple[float, float] | None = None,
+    mass_range: tuple[float, float] | None = None,
+) -> MatchResult:
+    """
+    Matches all objects in *coll_a* to all objects in *coll_b* of the same event and keeps the pairs
+    whose delta R and invariant mass lie (exclusively) within *dr_range* and *mass_range*. Both
+    collections must provide the fields pt, eta, phi and mass.
+
+    The returned :py:class:`MatchResult` contains the flat number of accepted pairs per object in
+    *coll_a* (*counts*) and, per accepted pair, the index of the object in *coll_b* within its event
+    (*index*), the index into the flat content of *coll_b* (*flat_index*), the delta R (*dr*) and the
+    invariant mass (*m_inv*). The invariant mass is only computed when *mass_range* has a finite
+    bound and is NaN otherwise.
+    """
+    if dr_range is None:
+        dr_range = (-np.inf, np.inf)
+    if mass_range is None:
+        mass_range = (-np.inf, np.inf)
+
+    fields = ("pt", "eta", "phi", "mass")
+    buffers_a = _flat_buffers(coll_a, fields)
+    buffers_b = _flat_buffers(coll_b, fields)
+
+    # first pass: count accepted pairs per object in a
+    bounds = (
+        float(dr_range[0]), float(dr_range[1]),
+        float(mass_range[0]), float(mass_range[1]),
+        bool(np.isfinite(mass_range).any()),
+    )
+    counts = np.zeros(len(buffers_a[1]), dtype=np.int64)
+    empty_i, empty_f = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    _pair_kernel(*buffers_a, *buffers_b, *bounds, counts, empty_i, empty_i, empty_f, empty_f, False)
+
+    # second pass: fill the pair buffers
+    n_pairs = counts.sum()
+    result = MatchResult(
+        counts=counts,
+        index=np.empty(n_pairs, dtype=np.int64),
+        flat_index=np.empty(n_pairs, dtype=np.int64),
+        dr=np.empty(n_pairs, dtype=np.float32),
+        m_inv=np.empty(n_pairs, dtype=np.float32),
+    )
+    _pair_kernel(*buffers_a, *buffers_b, *bounds, *result, True)
+
+    return result
+
+
+def matched_objects(
+    coll_a: ak.Array,
+    coll_b: ak.Array,
+    result: MatchResult,
+    fields: tuple[str] = ("dr",),
+) -> ak.Array:
+    """
+    Builds the doubly nested array of objects in *coll_b* that are matched to each object in
+    *coll_a* according to *result*, and attaches the requested matching *fields* of *result*. The
+    returned array has the structure ``events * coll_a * matched coll_b``.
+    """
+    from columnflow.columnar_util import set_ak_column
+
+    matched = ak.flatten(coll_b, axis=1)[result.flat_index]
+    for field in fields:
+        matched = set_ak_column(matched, field, getattr(result, field))
+
+    return ak.unflatten(ak.unflatten(matched, result.counts), ak.num(coll_a, axis=1))
+
+
+def unique_matches(
+    result: MatchResult,
+    n_b: int,
+    rank: str = "dr",
+    quality: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Resolves the pairs in *result* of :py:func:`match_pairs` into unique one-to-one matches, so that
+    each object in collection a and each of the *n_b* flat objects in collection b is part of at
+    most one match. Pairs are accepted greedily by increasing delta R when *rank* is "dr", or by
+    decreasing *quality* (indexed by the flat index of objects in b) and then increasing delta R
+    when *rank* is "quality".
+
+    Returns the index of the matched pair per flat object in a, or -1 when it remained unmatched.
+    """
+    pair_a = np.repeat(np.arange(len(result.counts), dtype=np.int64), result.counts)
+    if rank == "dr":
+        order = np.argsort(result.dr, kind="stable")
+    elif rank == "quality":
+        if quality is None:
+            raise ValueError("quality-ranked matching requires the quality of objects in b")
+        order = np.lexsort((result.dr, -np.asarray(quality)[result.flat_index]))
+    else:
+        raise ValueError(f"unknown rank '{rank}', expected 'dr' or 'quality'")
+
+    return _greedy_kernel(order.astype(np.int64), pair_a, result.flat_index, len(result.counts), n_b)
@@ -4,16 +4,22 @@
 Exemplary selection methods for direct reduction
 """
 
+from __future__ import annotations
+
 from collections import defaultdict
 
 from columnflow.columnar_util import set_ak_column, has_ak_column
-from columnflow.util import maybe_import
+from columnflow.util import DotDict, maybe_import
 from columnflow.selection import Selector, SelectionResult, selector
 from columnflow.production.util import attach_coffea_behavior
 from columnflow.production.processes import process_ids
 from columnflow.production.cms.mc_weight import mc_weight
 from columnflow.production.cms.seeds import deterministic_seeds
 
+from l1m.profiling import StepProfiler, null_profiler
+from l1m.reduction.cutflow import Cutflow, variant_step
+from l1m.reduction.matching import MatchResult, any_match, match_pairs, matched_objects, unique_matches
+
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 
@@ -40,73 +46,165 @@ def attach_coffea_behavior_l1(self: Selector, events: ak.Array, **kwargs) -> ak.
 
 
 @selector(
-    uses={"mc_weight"},
+    uses={"process_id", "mc_weight", "run", "luminosityBlock"},
 )
-def cutflow_routine(self, events, stats, step, **kwargs):
-    print(f"Number of events after step {step}: {len(events)}")
-    stats[f"n_events_{step}"] += len(events)
+def cutflow_routine(self: Selector, events: ak.Array, cutflow: Cutflow, step: str, **kwargs) -> None:
+    """
+    Fills the *events* remaining after selection *step* into the *cutflow*.
+    """
+    cutflow.fill(
+        step,
+        events.process_id,
+        weight=events.mc_weight if self.dataset_inst.is_mc else None,
+        run=events.run,
+        lumi=events.luminosityBlock,
+    )
 
-    if self.dataset_inst.is_mc:
-        stats[f"sum_mc_weight_{step}"] += ak.sum(events.mc_weight)
+
+# default settings of muon_reduction that can be overwritten by derived selectors
+muon_reduction_defaults = {
+    "max_dr": 0.4,
+    "tag_iso": 0.1,
+    "tag_pt": 26.,
+    "prb_pt": 22.,  # skip, use categories?
+    "req_z": True,
+    "req_hlt": False,
+    "req_uGMT": True,
+    "req_BXi": 0,
+}
+
+
+# value of the flat l1_* probe columns of unique matches for probes without a matched L1 muon
+# (l1_idx is -1 in this case)
+l1_no_match = -99
+
+
+def add_unique_l1_match(events: ak.Array, l1_pairs: MatchResult, rank: str = "dr") -> ak.Array:
+    """
+    Resolves the probe to L1 muon pairs *l1_pairs* into unique one-to-one matches (see
+    :py:func:`l1m.reduction.matching.unique_matches` for the *rank* options) and stores the index
+    of the matched L1 muon within the event as well as its delta R, pt, quality and bunch crossing
+    as flat probe columns "l1_idx", "l1_dr", "l1_pt", "l1_qual" and "l1_bx". Probes without a match
+    get an index of -1 and :py:data:`l1_no_match` in all other columns.
+    """
+    l1mu = ak.flatten(events.L1Mu, axis=1)
+    n_probes = ak.num(events.ProbeMuon, axis=1)
+    pair = unique_matches(l1_pairs, len(l1mu), rank=rank, quality=ak.to_numpy(l1mu.hwQual))
+    matched = pair >= 0
+    flat_index = l1_pairs.flat_index[pair[matched]]
+
+    def probe_column(values, default, dtype):
+        column = np.full(len(pair), default, dtype=dtype)
+        column[matched] = values
+        return ak.unflatten(column, n_probes)
+
+    columns = {
+        "l1_idx": probe_column(l1_pairs.index[pair[matched]], -1, np.int16),
+        "l1_dr": probe_column(l1_pairs.dr[pair[matched]], l1_no_match, np.float32),
+        "l1_pt": probe_column(ak.to_numpy(l1mu.pt)[flat_index], l1_no_match, np.float32),
+        "l1_qual": probe_column(ak.to_numpy(l1mu.hwQual)[flat_index], l1_no_match, np.int8),
+        "l1_bx": probe_column(ak.to_numpy(l1mu.bx)[flat_index], l1_no_match, np.int8),
+    }
+    for name, column in columns.items():
+        events = set_ak_column(events, f"ProbeMuon.{name}", column)
+
+    return events
+
+
+def get_reduction_settings(self: Selector, overrides: dict | None = None) -> DotDict:
+    """
+    Returns the settings of :py:data:`muon_reduction_defaults` of the selector, updated with
+    *overrides*, e.g. of a selection variant.
+    """
+    unknown = set(overrides or {}) - set(muon_reduction_defaults)
+    if unknown:
+        raise ValueError(
+            f"unknown settings of {self.cls_name}: {', '.join(sorted(unknown))}, valid settings are "
+            f"{', '.join(muon_reduction_defaults)}",
+        )
+    return DotDict({name: getattr(self, name) for name in muon_reduction_defaults}, **(overrides or {}))
+
+
+def baseline_muon_mask(muon: ak.Array) -> ak.Array:
+    return (
+        (muon.pt > 3) &
+        (abs(muon.eta) < 2.5) &
+        (muon.mediumId)
+    )
 
 
 @selector(
     uses={
-        cutflow_routine, attach_coffea_behavior_l1,
-        mc_weight, process_ids, deterministic_seeds,
-        "nMuon", "Muon.pt", "Muon.eta", "Muon.phi", "Muon.mass",
-        "Muon.tightId", "Muon.mediumId", "Muon.charge",
-        "L1Mu.pt", "L1Mu.eta", "L1Mu.phi", "L1Mu.mass", "L1Mu.bx", "L1Mu.hwQual",
+        cutflow_routine, process_ids, mc_weight,
+        "nMuon", "Muon.pt", "Muon.eta", "Muon.mediumId",
     },
-    produces={
-        mc_weight, process_ids, deterministic_seeds,
-        "ProbeMuon.*", "N_probes",
-    },
-    exposed=True,
 )
-def muon_reduction(
+def muon_pair_preselection(
         self: Selector,
         events: ak.Array,
         stats: defaultdict,
+        cutflow: Cutflow,
         **kwargs,
-) -> [ak.Array, SelectionResult]:
+) -> ak.Array:
+    """
+    Event-level preselection requiring at least two baseline muons. It only needs a few flat muon
+    columns, so that it can be evaluated before reading all other columns (e.g. L1Mu) in
+    :py:class:`CustomReduceEvents`. Returns the event mask.
+    """
+    # add process ids and the mc weight for the cutflow
+    if not has_ak_column(events, "process_id"):
+        events = self[process_ids](events, **kwargs)
+    if self.dataset_inst.is_mc and not has_ak_column(events, "mc_weight"):
+        events = self[mc_weight](events, **kwargs)
+    self[cutflow_routine](events, cutflow, "all")
 
-    stats["n_events"] += len(events)
+    # Require at least two muons
+    muon_sel = ak.sum(baseline_muon_mask(events.Muon), axis=1) >= 2
+    self[cutflow_routine](events[muon_sel], cutflow, "muon_pair")
 
-    results = SelectionResult()
+    return muon_sel
 
-    # create process ids (used for normalization)
-    events = self[process_ids](events, **kwargs)
 
-    # deterministic seeds (needed?)
-    # events = self[deterministic_seeds](events, **kwargs)
+def muon_pair_cost(events: ak.Array) -> np.ndarray:
+    """
+    Returns the relative memory cost of each event in :py:func:`muon_reduction`, which is dominated
+    by the muon-muon and muon-L1 muon pairs of its cartesian products, as one plus the number of
+    these pairs. Only the columns in ``muon_pair_cost.uses`` are required, so that costs are also
+    known when only the preselection columns were read.
+    """
+    n_muon = ak.to_numpy(events.nMuon).astype(np.float64)
+    n_l1 = ak.to_numpy(events.nL1Mu).astype(np.float64)
+    return 1.0 + n_muon * (n_muon + n_l1)
 
-    # coffea behavior for L1 objects
-    events = self[attach_coffea_behavior_l1](events, **kwargs)
 
-    # add the mc weight
-    if self.dataset_inst.is_mc:
-        events = self[mc_weight](events, **kwargs)
+muon_pair_cost.uses = {"nMuon", "nL1Mu"}
 
-    # Baseline Muon requirements
-    muon_mask = (
-        (events.Muon.pt > 3) &
-        (abs(events.Muon.eta) < 2.5) &
-        (events.Muon.mediumId)
-    )
-    set_ak_column(events, "Muon", events.Muon[muon_mask])
 
-    # Require at least two muons
-    muon_sel = ak.sum(muon_mask, axis=1) >= 2
-    events = events[muon_sel]
-    self[cutflow_routine](events, stats, "muon_pair")
+def reduce_tag_probe(
+        self: Selector,
+        events: ak.Array,
+        cutflow: Cutflow,
+        settings: DotDict,
+        probe_table: bool = False,
+        profiler: StepProfiler = null_profiler,
+        variant: str | None = None,
+) -> tuple[ak.Array, ak.Array | None]:
+    """
+    Tag and probe selection of :py:func:`muon_reduction` with the given *settings*, applied to
+    preselected *events* with baseline muons. Steps are filled into the *cutflow* and recorded
+    with the *profiler* under names prefixed with the *variant*, when given (see
+    :py:func:`l1m.reduction.cutflow.variant_step`). Returns the flat probes and, with
+    *probe_table*, the event table.
+    """
+    step = lambda name: variant_step(variant, name)
+    lap = profiler.laps()
 
     # Baseline TagMuon requirements (and require at least one)
     tag_reqs = (
-        # (events.Muon.iso < self.tag_iso) &
-        (events.Muon.pt > self.tag_pt)
+        # (events.Muon.iso < settings.tag_iso) &
+        (events.Muon.pt > settings.tag_pt)
     )
-    if self.req_hlt:
+    if settings.req_hlt:
         # TODO: which columns to use?
         tag_reqs = tag_reqs & (
             events.Muon.hlt_isomu != 0 &  # name?
@@ -115,103 +213,212 @@ def muon_reduction(
 
     events = set_ak_column(events, "TagMuon", events.Muon[tag_reqs])
     events = events[ak.num(events.TagMuon, axis=1) >= 1]
-    self[cutflow_routine](events, stats, "tag_reqs")
+    self[cutflow_routine](events, cutflow, step("tag_reqs"))
+    lap(step("tag_reqs"), events)
 
     # Baseline L1TagMuon requirements
     l1tag_reqs = (
         (events.L1Mu.hwQual >= 12) &
-        (events.L1Mu.pt > self.tag_pt - 4.01)
+        (events.L1Mu.pt > settings.tag_pt - 4.01)
     )
     events = set_ak_column(events, "L1TagMuon", events.L1Mu[l1tag_reqs])
-    self[cutflow_routine](events, stats, "l1tag_reqs")
+    self[cutflow_routine](events, cutflow, step("l1tag_reqs"))
+    lap(step("l1tag_reqs"), events)
 
     # Require at least 1 TagMuon with dR match to a L1TagMuon
-    tag_matched_mask = ak.any(events.TagMuon.metric_table(events.L1TagMuon) < self.max_dr, axis=2)
+    tag_matched_mask = any_match(events.TagMuon, events.L1TagMuon, settings.max_dr)
 
     events = set_ak_column(events, "TagMuon", events.TagMuon[tag_matched_mask])
     events = events[ak.num(events.TagMuon, axis=1) >= 1]
-    self[cutflow_routine](events, stats, "l1tag_match")
+    self[cutflow_routine](events, cutflow, step("l1tag_match"))
+    lap(step("l1tag_match"), events)
 
     # to simplify for now: only leading TagMuon
     # events = set_ak_column(events, "TagMuon", ak.from_regular(events.TagMuon[:, [0]]))
 
     # Baseline ProbeMuon requirements
     probe_reqs = (
-        (events.Muon.pt > self.prb_pt)  # can I move this requirement to the producer?
+        (events.Muon.pt > settings.prb_pt)  # can I move this requirement to the producer?
     )
     events = set_ak_column(events, "ProbeMuon", events.Muon[probe_reqs])
 
-    # broadcast arrays to calculate invariant mass and delta R
-    probe, tag = ak.unzip(ak.cartesian([events.ProbeMuon, events.TagMuon], nested=True))
-    tag = set_ak_column(tag, "dr", probe.delta_r(tag))
-    tag = set_ak_column(tag, "m_inv", (tag + probe).mass)
-
-    match_reqs = tag.dr > 2 * self.max_dr
-    if self.req_z:
-        match_reqs = match_reqs & (tag.m_inv > 81) & (tag.m_inv < 101)
+    # match tags to probes via delta R and invariant mass
+    tag_pairs = match_pairs(
+        events.ProbeMuon,
+        events.TagMuon,
+        dr_range=(2 * settings.max_dr, np.inf),
+        mass_range=(81, 101) if settings.req_z else None,
+    )
 
     # store matched Tags as part of the ProbeMuons
-    events["ProbeMuon", "TagMuon"] = tag[match_reqs]
+    events["ProbeMuon", "TagMuon"] = matched_objects(
+        events.ProbeMuon, events.TagMuon, tag_pairs, fields=("dr", "m_inv"),
+    )
 
     # probes with at least one match are kept
     events = set_ak_column(
         events, "ProbeMuon",
-        events.ProbeMuon[ak.num(events.ProbeMuon.TagMuon, axis=2) >= 1],
+        events.ProbeMuon[ak.unflatten(tag_pairs.counts >= 1, ak.num(events.ProbeMuon, axis=1))],
     )
 
     # require at least one probe with m_inv match
     events = events[ak.num(events.ProbeMuon, axis=1) >= 1]
-    self[cutflow_routine](events, stats, "probe_match")
+    self[cutflow_routine](events, cutflow, step("probe_match"))
 
-    self[cutflow_routine](events, stats, "selected")
+    self[cutflow_routine](events, cutflow, step("selected"))
+    lap(step("probe_match"), events)
 
     # TODO: match L1Mu to Probe (without cutting), flatten ProbeMuons (+ required columns broadcasted)
     # and return flattened muons instead of events
 
-    # match L1Mu to Probe
-    probe, l1mu = ak.unzip(ak.cartesian([events.ProbeMuon, events.L1Mu], nested=True))
-    l1mu = set_ak_column(l1mu, "dr", probe.delta_r(l1mu))
-    events["ProbeMuon", "L1ProbeMuon"] = l1mu[l1mu.dr < self.max_dr]
-
-    # sums per process id (for normalization weights)
-    if self.dataset_inst.is_mc:
-        stats.setdefault("sum_mc_weight_per_process", defaultdict(float))
-        unique_process_ids = np.unique(events.process_id)
-        for p in unique_process_ids:
-            stats["sum_mc_weight_per_process"][int(p)] += ak.sum(
-                events.mc_weight[events.process_id == p],
-            )
+    # match L1Mu to Probe, either keeping all L1 muons within max_dr per probe or, with the
+    # unique matching, storing flat columns of at most one L1 muon per probe
+    l1_pairs = match_pairs(events.ProbeMuon, events.L1Mu, dr_range=(-np.inf, settings.max_dr))
+    if self.unique_l1_match:
+        events = add_unique_l1_match(events, l1_pairs, rank=self.unique_l1_match)
+    else:
+        events["ProbeMuon", "L1ProbeMuon"] = matched_objects(events.ProbeMuon, events.L1Mu, l1_pairs)
 
     # store the number of probe muons (NOTE: changes if we define cuts on probes later)
     events = set_ak_column(events, "N_probes", ak.num(events.ProbeMuon, axis=1))
+    lap(step("l1probe_match"), events)
 
-    # flatten ProbeMuon collection + some (broadcasted) other columns
-    keep_columns = {"process_id", "event", "ProbeMuon", "N_probes"}
+    # event-level columns, including the run, luminosity block and number of primary vertices for
+    # efficiencies versus time and pileup
+    keep_columns = {"process_id", "run", "luminosityBlock", "event", "PV", "N_probes"}
     if self.dataset_inst.is_mc:
         keep_columns.add("mc_weight")
 
-    arrays = ak.flatten(ak.cartesian({field: events[field] for field in keep_columns}))
+    event_table = None
+    if probe_table:
+        # flat ProbeMuon collection + index of the event row in the separate event table
+        event_table = ak.zip({field: events[field] for field in keep_columns})
+        arrays = ak.zip({
+            "ProbeMuon": ak.flatten(events.ProbeMuon, axis=1),
+            "event_row": np.repeat(np.arange(len(events)), ak.to_numpy(events.N_probes)),
+        }, depth_limit=1)
+    else:
+        # flatten ProbeMuon collection + some (broadcasted) other columns
+        keep_columns.add("ProbeMuon")
+        arrays = ak.flatten(ak.cartesian({field: events[field] for field in keep_columns}))
+    lap(step("flattening"), arrays)
+
+    return arrays, event_table
+
+
+@selector(
+    uses={
+        cutflow_routine, attach_coffea_behavior_l1, muon_pair_preselection,
+        mc_weight, process_ids, deterministic_seeds,
+        "nMuon", "Muon.pt", "Muon.eta", "Muon.phi", "Muon.mass",
+        "Muon.tightId", "Muon.mediumId", "Muon.charge",
+        "L1Mu.pt", "L1Mu.eta", "L1Mu.phi", "L1Mu.mass", "L1Mu.bx", "L1Mu.hwQual",
+        "PV.npvs",
+    },
+    produces={
+        mc_weight, process_ids, deterministic_seeds,
+        "ProbeMuon.*", "N_probes", "event_row",
+    },
+    preselector=muon_pair_preselection,
+    chunk_cost=muon_pair_cost,
+    exposed=True,
+)
+def muon_reduction(
+        self: Selector,
+        events: ak.Array,
+        stats: defaultdict,
+        cutflow: Cutflow,
+        preselected: bool = False,
+        probe_table: bool = False,
+        profiler: StepProfiler = null_profiler,
+        variants: dict[str, dict] | None = None,
+        **kwargs,
+) -> [ak.Array, SelectionResult]:
+    """
+    Tag-and-probe reduction to flat probe muons. Event counts and sums of mc weights after each step
+    are filled into the *cutflow*. When *preselected* is *True*, *events* are expected to have
+    passed the :py:attr:`preselector` already, which is then skipped. The memory cost of events
+    for adaptive chunk sizes is estimated by :py:attr:`chunk_cost` (see :py:func:`muon_pair_cost`).
+
+    By default, event-level columns are broadcast to all probes. With *probe_table*, the returned
+    probes only carry the index "event_row" into a separate event table that is stored in the
+    "event_table" aux entry of the selection result (see :py:func:`l1m.columnar_util.join_events`).
+
+    L1 muons within ``max_dr`` are attached to each probe as a jagged "L1ProbeMuon" list, or, when
+    the "unique_l1_match" config entry is set, resolved into unique matches that are stored as flat
+    probe columns (see :py:func:`add_unique_l1_match`).
+
+    *variants* can map names of selection variants to overrides of the settings in
+    :py:data:`muon_reduction_defaults`. The event preparation and preselection are then done once,
+    followed by the tag and probe selection of each variant (see :py:func:`reduce_tag_probe`) with
+    cutflow steps prefixed by the variant name. The returned probes and the event tables are then
+    dictionaries mapping variant names to the respective arrays.
+
+    All sub-steps are recorded with the *profiler*.
+    """
+    results = SelectionResult()
+    lap = profiler.laps()
+
+    # create process ids (used for normalization)
+    events = self[process_ids](events, **kwargs)
+    lap("process_ids")
+
+    # deterministic seeds (needed?)
+    # events = self[deterministic_seeds](events, **kwargs)
+
+    # coffea behavior for L1 objects
+    events = self[attach_coffea_behavior_l1](events, **kwargs)
+    lap("attach_coffea_behavior_l1")
+
+    # add the mc weight
+    if self.dataset_inst.is_mc:
+        events = self[mc_weight](events, **kwargs)
+        lap("mc_weight")
+
+    # Require at least two muons (unless already done when reading the events)
+    if not preselected:
+        events = events[self[muon_pair_preselection](events, stats, cutflow, **kwargs)]
+        lap("muon_pair", events)
+
+    # Baseline Muon requirements
+    muon_mask = baseline_muon_mask(events.Muon)
+    set_ak_column(events, "Muon", events.Muon[muon_mask])
+
+    # tag and probe selection with the settings of this selector
+    if variants is None:
+        arrays, event_table = reduce_tag_probe(
+            self, events, cutflow, get_reduction_settings(self), probe_table=probe_table, profiler=profiler,
+        )
+        if probe_table:
+            results.aux["event_table"] = event_table
+        return arrays, results
+
+    # tag and probe selection per variant on the same events
+    arrays, event_tables = {}, {}
+    for variant, overrides in variants.items():
+        arrays[variant], event_tables[variant] = reduce_tag_probe(
+            self,
+            events,
+            cutflow,
+            get_reduction_settings(self, overrides),
+            probe_table=probe_table,
+            profiler=profiler,
+            variant=variant,
+        )
+    if probe_table:
+        results.aux["event_table"] = event_tables
 
     return arrays, results
 
 
 @muon_reduction.init
 def muon_reduction_init(self: Selector) -> None:
-    # define default settings that can be overwritten
-    defaults = {
-        "max_dr": 0.4,
-        "tag_iso": 0.1,
-        "tag_pt": 26.,
-        "prb_pt": 22.,  # skip, use categories?
-        "req_z": True,
-        "req_hlt": False,
-        "req_uGMT": True,
-        "req_BXi": 0,
-    }
-
     # set defaults to class attributes if not present
-    for variable, value in defaults.items():
+    for variable, value in muon_reduction_defaults.items():
         if getattr(self, variable, None) is None:
             setattr(self, variable, value)
 
+    # unique L1 matching mode, shared with the producers of trigger decisions via the config
+    self.unique_l1_match = self.config_inst.x("unique_l1_match", None)
+
     # NOTE: it might also be nice to have these settings in the config (or even in some output txt file to)
@@ -1,5 +1,9 @@
 # coding: utf-8
 # flake8: noqa
 
+# columnflow loads all task modules of the law config when imported, which must be done before
+# these modules import the base tasks, also when a task module is imported first
+import columnflow
+
 # provisioning imports
 import l1m.tasks.base
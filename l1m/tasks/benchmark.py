@@ -0,0 +1,295 @@
+# coding: utf-8
+
+"""
+Tasks to benchmark storage and processing settings.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+
+import law
+import luigi
+
+from l1m.tasks.base import L1MTask
+from l1m.tasks.reduction import CustomReduceEvents
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.framework.mixins import CalibratorsMixin, SelectorMixin, SelectorStepsMixin
+from columnflow.util import maybe_import, dev_sandbox
+
+
+ak = maybe_import("awkward")
+pq = maybe_import("pyarrow.parquet")
+
+
+class BenchmarkStorage(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Rewrites the reduced events of one :py:class:`CustomReduceEvents` branch with different storage
+    policies and measures the file size against the throughput of the standard histogram workload,
+    i.e., reading the file, assigning trigger categories and filling histograms of all probe
+    variables. Compared are the default writer settings of awkward ("default", without changing
+    column types), the policy defined in the config ("config") and the config policy with all
+    *codecs*.
+    """
+
+    codecs = law.CSVParameter(
+        default=("snappy", "lz4", "gzip", "zstd"),
+        description="compression codecs to compare with the config policy; default: "
+        "snappy,lz4,gzip,zstd",
+    )
+    reduction_branch = luigi.IntParameter(
+        default=0,
+        description="branch of CustomReduceEvents whose events are used; default: 0",
+    )
+    n_repetitions = luigi.IntParameter(
+        default=3,
+        significant=False,
+        description="number of repetitions of the workload per policy, the fastest one is "
+        "reported; default: 3",
+    )
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        CustomReduceEvents=CustomReduceEvents,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        from l1m.production.trigger import trigger_category_ids
+        self.category_producer_inst = trigger_category_ids(
+            inst_dict=self.get_array_function_kwargs(task=self),
+        )
+
+    def requires(self):
+        return self.reqs.CustomReduceEvents.req(self, branch=self.reduction_branch)
+
+    def output(self):
+        return self.target(f"storage_benchmark_{self.reduction_branch}.json")
+
+    def get_policies(self) -> dict:
+        from l1m.columnar_util import StoragePolicy
+
+        config_policy = self.config_inst.x("storage_policy", {}).get(CustomReduceEvents.task_family, {})
+        policies = {
+            "default": StoragePolicy(codec="zstd"),
+            "config": StoragePolicy(**config_policy),
+        }
+        for codec in self.codecs:
+            # only some codecs support compression levels
+            level = config_policy.get("compression_level") if codec in ("gzip", "zstd") else None
+            policies[f"config_{codec}"] = StoragePolicy(**{
+                **config_policy,
+                "codec": codec,
+                "compression_level": level,
+            })
+
+        return policies
+
+    def run_workload(self, path: str) -> int:
+        """
+        Reads the events at *path*, assigns trigger categories and fills histograms of all probe
+        variables. Returns the number of probes.
+        """
+        from l1m.efficiency.hists import create_hist, fill_hist
+
+        events = ak.from_parquet(path)
+        events = self.category_producer_inst(events)
+        weight = events.mc_weight if self.dataset_inst.is_mc else None
+        for variable_name in self.config_inst.x.variable_groups["probe"]:
+            variable_inst = self.config_inst.get_variable(variable_name)
+            fill_hist(create_hist([variable_inst]), events, [variable_inst], shift_id=0, weight=weight)
+
+        return len(events)
+
+    @law.decorator.log
+    @law.decorator.localize(input=True, output=False)
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.columnar_util import ParquetStreamWriter
+
+        table = pq.read_table(self.input()["events"].abspath)
+
+        tmp_dir = law.LocalDirectoryTarget(is_tmp=True)
+        tmp_dir.touch()
+
+        results = {}
+        for name, policy in self.get_policies().items():
+            # write the events with the policy
+            tmp = tmp_dir.child(f"{name}.parquet", type="f")
+            t0 = time.perf_counter()
+            with ParquetStreamWriter(tmp.abspath, policy=policy) as writer:
+                writer.write(0, table)
+            write_time = time.perf_counter() - t0
+
+            # run the workload
+            read_times = []
+            for _ in range(self.n_repetitions):
+                t0 = time.perf_counter()
+                n_probes = self.run_workload(tmp.abspath)
+                read_times.append(time.perf_counter() - t0)
+
+            results[name] = {
+                "size": tmp.stat().st_size,
+                "write_time": write_time,
+                "read_time": min(read_times),
+                "probes_per_second": n_probes / max(min(read_times), 1e-9),
+            }
+
+        # print a summary
+        self.publish_message(
+            f"{'policy':<16} {'size':>12} {'write [s]':>10} {'workload [s]':>13} {'probes/s':>12}",
+        )
+        for name, res in results.items():
+            self.publish_message(
+                f"{name:<16} {law.util.human_bytes(res['size'], fmt=True):>12} "
+                f"{res['write_time']:>10.3f} {res['read_time']:>13.3f} {res['probes_per_second']:>12.0f}",
+            )
+
+        self.output().dump(results, indent=4, formatter="json")
+
+
+class BenchmarkReduction(
+    L1MTask,
+    SelectorMixin,
+    DatasetTask,
+):
+    """
+    Times and memory-profiles the steps of the tag-and-probe reduction and the trigger
+    categorization on deterministic synthetic events (see :py:mod:`l1m.benchmark`). The configured
+    *selector* and :py:func:`l1m.production.trigger.trigger_category_ids` are applied as in
+    :py:class:`CustomReduceEvents`, treating the synthetic events as events of the *dataset*, and
+    steps are taken from the laps they record with their profiler. Results are
+    compared to a baseline file and the task fails when a step got slower or needs more memory than
+    the baseline by more than the *threshold*. With *update_baseline*, the results are stored as the
+    new baseline instead. Note that baselines are only meaningful on the machine they were created.
+    """
+
+    n_events = luigi.IntParameter(
+        default=100000,
+        description="number of synthetic events; default: 100000",
+    )
+    seed = luigi.IntParameter(
+        default=0,
+        description="seed of the synthetic event generation; default: 0",
+    )
+    z_fraction = luigi.FloatParameter(
+        default=0.3,
+        description="fraction of synthetic events with a muon pair from a Z decay; default: 0.3",
+    )
+    n_repetitions = luigi.IntParameter(
+        default=3,
+        significant=False,
+        description="number of repetitions of all steps, the fastest one is reported; default: 3",
+    )
+    threshold = luigi.FloatParameter(
+        default=0.2,
+        significant=False,
+        description="maximum relative increase of the time or memory of a step with respect to the "
+        "baseline; default: 0.2",
+    )
+    baseline = luigi.Parameter(
+        default=law.config.get_expanded(
+            "analysis",
+            "reduction_benchmark_baseline",
+            "$L1M_BASE/benchmarks/reduction_baseline.json",
+        ),
+        significant=False,
+        description="path of the baseline file; default: value of 'reduction_benchmark_baseline' "
+        "in the law config or $L1M_BASE/benchmarks/reduction_baseline.json",
+    )
+    update_baseline = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="when True, store the results as the new baseline instead of comparing to it; "
+        "default: False",
+    )
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        from l1m.production.trigger import trigger_category_ids
+        self.category_producer_inst = trigger_category_ids(
+            inst_dict=self.get_array_function_kwargs(task=self),
+        )
+
+    def output(self):
+        return self.target(f"reduction_benchmark_{self.n_events}_{self.seed}_{self.z_fraction}.json")
+
+    @property
+    def generator_settings(self) -> dict:
+        return {"n_events": self.n_events, "seed": self.seed, "z_fraction": self.z_fraction}
+
+    @property
+    def benchmark_settings(self) -> dict:
+        return {**self.generator_settings, "dataset": self.dataset, "selector": self.selector}
+
+    def run_reduction(self, events: ak.Array, profiler) -> ak.Array:
+        from l1m.benchmark.reduction import run_reduction
+
+        return run_reduction(events, self.selector_inst, self.category_producer_inst, profiler=profiler)
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.benchmark.synthetic import generate_events
+        from l1m.benchmark.reduction import run_steps, compare_to_baseline
+
+        with self.publish_step(f"generate {self.n_events} synthetic events ..."):
+            events = generate_events(**self.generator_settings)
+
+        with self.publish_step(f"run reduction steps {self.n_repetitions} times ..."):
+            results = run_steps(events, self.run_reduction, n_repetitions=self.n_repetitions)
+
+        # print a summary
+        self.publish_message(
+            f"{'step':<24} {'calls':>6} {'time [ms]':>10} {'cpu [ms]':>10} {'peak memory':>12} "
+            f"{'rows in':>9} {'rows out':>9}",
+        )
+        for name, res in results.items():
+            self.publish_message(
+                f"{name:<24} {res['n_calls']:>6} {res['time'] * 1000:>10.2f} "
+                f"{res['cpu_time'] * 1000:>10.2f} {law.util.human_bytes(res['peak_memory'], fmt=True):>12} "
+                f"{res['n_in']:>9} {res['n_out']:>9}",
+            )
+
+        data = {"settings": self.benchmark_settings, "steps": results}
+        baseline_path = os.path.expandvars(os.path.expanduser(self.baseline))
+        if self.update_baseline:
+            os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+            with open(baseline_path, "w") as f:
+                json.dump(data, f, indent=4)
+            self.publish_message(f"stored baseline at {baseline_path}")
+
+        elif not os.path.exists(baseline_path):
+            self.logger.warning(f"no baseline found at {baseline_path}, skip comparison")
+
+        else:
+            with open(baseline_path, "r") as f:
+                baseline = json.load(f)
+            if baseline.get("settings") != self.benchmark_settings:
+                self.logger.warning(
+                    f"settings of the baseline {baseline.get('settings')} differ from "
+                    f"{self.benchmark_settings}, skip comparison",
+                )
+            else:
+                regressions = compare_to_baseline(results, baseline["steps"], threshold=self.threshold)
+                if regressions:
+                    raise Exception(
+                        f"{len(regressions)} regression(s) with respect to the baseline at "
+                        f"{baseline_path}:\n" + "\n".join(regressions),
+                    )
+                self.publish_message("no regressions with respect to the baseline")
+
+        self.output().dump(data, indent=4, formatter="json")
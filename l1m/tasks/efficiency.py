@@ -0,0 +1,405 @@
+# coding: utf-8
+
+"""
+Tasks related to efficiency histograms filled directly during the reduction.
+"""
+
+import law
+import luigi
+
+from l1m.tasks.base import L1MTask
+from l1m.tasks.reduction import CustomReduceEvents
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.framework.mixins import CalibratorsMixin, SelectorStepsMixin, VariablesMixin
+from columnflow.tasks.framework.plotting import PlotBase
+from columnflow.tasks.framework.remote import RemoteWorkflow
+from columnflow.tasks.plotting import PlotVariables1D, PlotVariables2D
+from columnflow.util import dev_sandbox
+
+
+class MergeEfficiencyHistograms(
+    L1MTask,
+    VariablesMixin,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+    law.LocalWorkflow,
+    RemoteWorkflow,
+):
+    online_efficiency = luigi.ChoiceParameter(
+        default="only",
+        choices=("add", "only"),
+        description="online efficiency mode of the required CustomReduceEvents task; 'add' keeps "
+        "the reduced events, 'only' does not produce them; default: only",
+    )
+    threshold_scan = CustomReduceEvents.threshold_scan.copy()
+    remove_previous = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="when True, remove particular input histograms after merging; default: False",
+    )
+
+    # probe variables by default, multi-dimensional variables are projected from efficiency maps
+    default_variables = ("probe",)
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        RemoteWorkflow.reqs,
+        CustomReduceEvents=CustomReduceEvents,
+    )
+
+    def create_branch_map(self):
+        # create a dummy branch map so that this task could as a job
+        return {0: None}
+
+    def workflow_requires(self):
+        reqs = super().workflow_requires()
+
+        reqs["hists"] = self.as_branch().requires()
+
+        return reqs
+
+    def requires(self):
+        return self.reqs.CustomReduceEvents.req(self, branch=-1, _exclude={"branches"})
+
+    def output(self):
+        # same structure as cf.MergeHistograms so that plotting tasks can consume the outputs
+        return {
+            "hists": law.SiblingFileCollection({
+                variable_name: self.target(f"hist__{variable_name}.pickle")
+                for variable_name in self.variables
+            }),
+            "maps": law.SiblingFileCollection({
+                map_name: self.target(f"map__{map_name}.pickle")
+                for map_name in self.config_inst.x("efficiency_maps", {})
+            }),
+            "scans": law.SiblingFileCollection({
+                variable_name: self.target(f"scan__{variable_name}.pickle")
+                for variable_name in (self.config_inst.x.threshold_scan.variables if self.threshold_scan else [])
+            }),
+        }
+
+    def get_variable_hist(self, merged: dict, variable_name: str):
+        """
+        Returns the histogram of the possibly multi-dimensional *variable_name*, either taken from
+        the *merged* histograms directly or projected from the first efficiency map containing all
+        its variables.
+        """
+        if variable_name in merged:
+            return merged[variable_name]
+
+        parts = self.split_multi_variable(variable_name)
+        for map_name, map_variables in self.config_inst.x("efficiency_maps", {}).items():
+            if map_name in merged and set(parts) <= set(map_variables):
+                return merged[map_name].project(*parts)
+
+        raise ValueError(
+            f"no efficiency histogram or map found for variable '{variable_name}', define a map "
+            "containing it in the 'efficiency_maps' auxiliary data of the config",
+        )
+
+    @law.decorator.log
+    def run(self):
+        inputs = self.input()["collection"]
+        outputs = self.output()
+
+        # load and sum up input histograms
+        merged = {}
+        for inp in self.iter_progress(inputs.targets.values(), len(inputs)):
+            for variable_name, h in inp["hists"].load(formatter="pickle").items():
+                if variable_name in merged:
+                    merged[variable_name] += h
+                else:
+                    merged[variable_name] = h
+
+        # create a separate file per output variable and map
+        for variable_name, out in outputs["hists"].targets.items():
+            self.publish_message(f"merged histograms for '{variable_name}'")
+            out.dump(self.get_variable_hist(merged, variable_name), formatter="pickle")
+        for map_name, out in outputs["maps"].targets.items():
+            h = merged[map_name]
+            self.publish_message(
+                f"merged efficiency map '{map_name}' with {h.n_bins} filled bins "
+                f"({law.util.human_bytes(h.nbytes, fmt=True)})",
+            )
+            out.dump(h, formatter="pickle")
+        for variable_name, out in outputs["scans"].targets.items():
+            self.publish_message(f"merged threshold scan histograms for '{variable_name}'")
+            out.dump(merged[f"scan__{variable_name}"], formatter="pickle")
+
+        # optionally remove inputs
+        if self.remove_previous:
+            for inp in inputs.targets.values():
+                inp["hists"].remove()
+
+
+class MergeLumiEfficiencies(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+    law.tasks.ForestMerge,
+    RemoteWorkflow,
+):
+    """
+    Tree-merges the probe counts per run, luminosity block and number of primary vertices that all
+    :py:class:`CustomReduceEvents` branches of a dataset fill in the online efficiency mode (see
+    :py:class:`l1m.efficiency.lumi.LumiEfficiency`).
+    """
+
+    online_efficiency = MergeEfficiencyHistograms.online_efficiency.copy()
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # recursively merge 50 accumulators into one
+    merge_factor = 50
+
+    # upstream requirements
+    reqs = Requirements(
+        RemoteWorkflow.reqs,
+        CustomReduceEvents=CustomReduceEvents,
+    )
+
+    def create_branch_map(self):
+        # DatasetTask implements a custom branch map, but we want to use the one in ForestMerge
+        return law.tasks.ForestMerge.create_branch_map(self)
+
+    def merge_workflow_requires(self):
+        return self.reqs.CustomReduceEvents.req(self, _exclude={"branches"})
+
+    def merge_requires(self, start_branch, end_branch):
+        return self.reqs.CustomReduceEvents.req(self, branches=((start_branch, end_branch),))
+
+    def trace_merge_inputs(self, inputs):
+        return super().trace_merge_inputs(inputs["collection"].targets.values())
+
+    def merge_output(self):
+        return {"lumi": self.target("lumi.npz")}
+
+    def merge(self, inputs, output):
+        from l1m.efficiency.lumi import LumiEfficiency
+
+        accumulators = []
+        for inp in inputs:
+            with inp["lumi"].open("rb") as f:
+                accumulators.append(LumiEfficiency.load(f))
+        acc = LumiEfficiency.merge(accumulators)
+
+        with output["lumi"].open("wb") as f:
+            acc.dump(f)
+
+        if self.is_root():
+            self.publish_message(
+                f"merged probe counts of {len(acc.runs)} runs in {len(acc)} entries "
+                f"({law.util.human_bytes(acc.nbytes, fmt=True)})",
+            )
+
+
+class PlotEfficiencies(
+    L1MTask,
+    PlotVariables1D,
+):
+    """
+    Efficiency plots based on the histograms filled during the reduction, skipping the parquet round
+    trips through cf.MergeReducedEvents, cf.ProduceColumns and cf.CreateHistograms.
+    """
+
+    plot_function = PlotBase.plot_function.copy(
+        default="l1m.plotting.plot_efficiencies.plot_eff",
+        add_default_to_description=True,
+    )
+
+    # upstream requirements
+    reqs = Requirements(
+        PlotVariables1D.reqs,
+        MergeHistograms=MergeEfficiencyHistograms,
+    )
+
+
+class PlotEfficiencies2D(
+    L1MTask,
+    PlotVariables2D,
+):
+    """
+    Two-dimensional efficiency maps based on the histograms filled during the reduction, with
+    histograms of variable pairs such as "probe_pt-probe_eta" projected from the sparse efficiency
+    maps defined in the config.
+    """
+
+    plot_function = PlotBase.plot_function.copy(
+        default="l1m.plotting.plot_efficiencies.plot_eff_2d",
+        add_default_to_description=True,
+    )
+
+    # upstream requirements
+    reqs = Requirements(
+        PlotVariables2D.reqs,
+        MergeHistograms=MergeEfficiencyHistograms,
+    )
+
+
+class ExportEfficiencies(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Exports the efficiencies of all triggers in the bins of all probe variables as a table, based
+    on the histograms filled during the reduction.
+    """
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        MergeEfficiencyHistograms=MergeEfficiencyHistograms,
+    )
+
+    def requires(self):
+        return self.reqs.MergeEfficiencyHistograms.req(self, branch=0)
+
+    def output(self):
+        return self.target("efficiencies.json")
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.efficiency.compute import compute_efficiencies
+
+        denom_cat = self.config_inst.get_category("valid_probe")
+
+        tables = {}
+        for variable_name, inp in self.input()["hists"].targets.items():
+            h = inp.load(formatter="pickle")
+            records = compute_efficiencies(h, denom_cat.id, variables=[variable_name]).to_records()
+            for record in records:
+                record["category"] = self.config_inst.get_category(record["category"]).name
+            tables[variable_name] = records
+            self.publish_message(f"exported efficiencies in {len(records)} bins for '{variable_name}'")
+
+        self.output().dump(tables, indent=4, formatter="json")
+
+
+class ThresholdScanEfficiencies(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Derives the efficiencies of all combinations of L1 pt *thresholds* and minimum qualities in the
+    bins of the probe variables of the threshold scan from cumulative histograms filled during the
+    reduction, so that scanning thresholds does not require reprocessing any events.
+    """
+
+    thresholds = law.CSVParameter(
+        cls=luigi.FloatParameter,
+        default=(0.0, 3.0, 5.0, 7.0, 8.0, 10.0, 12.0, 15.0, 18.0, 20.0, 22.0, 25.0),
+        description="L1 pt thresholds in GeV, probes pass when their L1 pt is above; default: "
+        "0,3,5,7,8,10,12,15,18,20,22,25",
+    )
+    min_quals = law.CSVParameter(
+        cls=luigi.IntParameter,
+        default=(),
+        description="minimum L1 qualities, which must be part of the 'threshold_scan' config entry; "
+        "default: all of them",
+    )
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        MergeEfficiencyHistograms=MergeEfficiencyHistograms,
+    )
+
+    def requires(self):
+        return self.reqs.MergeEfficiencyHistograms.req(self, branch=0, threshold_scan=True)
+
+    def output(self):
+        return self.target("threshold_scan.json")
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.efficiency.threshold_scan import scan_efficiencies
+
+        tables = {}
+        for variable_name, inp in self.input()["scans"].targets.items():
+            h = inp.load(formatter="pickle")
+            table = scan_efficiencies(
+                h,
+                self.thresholds,
+                min_quals=self.min_quals or None,
+                variables=[variable_name],
+            )
+            records = table.to_records()
+            for record in records:
+                record["min_qual"], record["threshold"] = record.pop("category")
+            tables[variable_name] = records
+            self.publish_message(
+                f"derived efficiencies of {len(table.category_ids)} threshold and quality "
+                f"combinations for '{variable_name}'",
+            )
+
+        self.output().dump(tables, indent=4, formatter="json")
+
+
+class ExportLumiEfficiencies(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Exports the efficiencies of all triggers per run and in bins of the number of primary vertices
+    as tables, based on the probe counts per luminosity block filled during the reduction.
+    """
+
+    runs = law.CSVParameter(
+        cls=luigi.IntParameter,
+        default=(),
+        max_len=2,
+        description="a single run or the first and last run of an inclusive range to consider; "
+        "default: all runs",
+    )
+    npvs_edges = law.CSVParameter(
+        cls=luigi.FloatParameter,
+        default=(0.0, 10.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0, 60.0, 80.0),
+        description="bin edges in the number of primary vertices; default: "
+        "0,10,20,25,30,35,40,45,50,60,80",
+    )
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        MergeLumiEfficiencies=MergeLumiEfficiencies,
+    )
+
+    def requires(self):
+        return self.reqs.MergeLumiEfficiencies.req(self)
+
+    def output(self):
+        return self.target("lumi_efficiencies.json")
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.efficiency.lumi import LumiEfficiency
+
+        with self.input()["lumi"].open("rb") as f:
+            acc = LumiEfficiency.load(f)
+        runs = (self.runs[0], self.runs[-1]) if self.runs else None
+
+        tables = {}
+        for field, edges in [("run", None), ("npvs", self.npvs_edges)]:
+            records = acc.efficiency_table(field, edges=edges, runs=runs).to_records()
+            for record in records:
+                record["category"] = self.config_inst.get_category(record["category"]).name
+            tables[field] = records
+            self.publish_message(f"exported efficiencies in {len(records)} bins of '{field}'")
+
+        self.output().dump(tables, indent=4, formatter="json")
@@ -0,0 +1,142 @@
+# coding: utf-8
+
+"""
+Tasks dealing with external data, such as input file metadata.
+"""
+
+from __future__ import annotations
+
+import math
+
+import law
+
+from l1m.tasks.base import L1MTask
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.external import GetDatasetLFNs
+from columnflow.util import ensure_proxy, dev_sandbox
+
+
+class GetDatasetEntries(
+    L1MTask,
+    DatasetTask,
+):
+    """
+    Determines the number of events per input file of a dataset from the ROOT file headers only and
+    caches them for the event range partitioning in :py:class:`CustomReduceEvents`. When the config
+    defines a "get_dataset_lfn_entries" function that returns a mapping of lfns to entries per
+    dataset key, it is used instead of opening files.
+    """
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        GetDatasetLFNs=GetDatasetLFNs,
+    )
+
+    def requires(self):
+        return self.reqs.GetDatasetLFNs.req(self)
+
+    def output(self):
+        return self.target("entries.json")
+
+    @law.decorator.log
+    @ensure_proxy
+    @law.decorator.safe_output
+    def run(self):
+        lfn_task = self.requires()
+        n_files = self.dataset_info_inst.n_files
+
+        # try to look up entries via the config
+        entries = self.get_entries_from_config(lfn_task)
+        if entries is not None:
+            self.publish_message(f"found {sum(entries)} events in {n_files} files via config")
+            self.output().dump({"entries": entries}, indent=4, formatter="json")
+            return
+
+        # opening the file only reads the header and tree metadata, no baskets are decompressed
+        entries = []
+        lfn_indices = list(range(n_files))
+        for lfn_index, input_file in lfn_task.iter_nano_files(self, lfn_indices=lfn_indices):
+            with input_file.load(formatter="uproot") as nano_file:
+                entries.append(int(nano_file["Events"].num_entries))
+
+        self.publish_message(f"found {sum(entries)} events in {n_files} files")
+        self.output().dump({"entries": entries}, indent=4, formatter="json")
+
+    def get_entries_from_config(self, lfn_task: GetDatasetLFNs) -> list[int] | None:
+        """
+        Returns the number of entries of all lfns of *lfn_task* obtained from the optional
+        "get_dataset_lfn_entries" function in the config, or *None* when not available for all of
+        them.
+        """
+        get_dataset_lfn_entries = self.config_inst.x("get_dataset_lfn_entries", None)
+        if not callable(get_dataset_lfn_entries):
+            return None
+
+        lfn_entries = {}
+        for key in sorted(self.dataset_info_inst.keys):
+            key_entries = get_dataset_lfn_entries(self.dataset_inst, self.global_shift_inst, key)
+            if key_entries is None:
+                return None
+            lfn_entries.update(key_entries)
+
+        lfns = lfn_task.output().load(formatter="json")
+        if not all(str(lfn) in lfn_entries for lfn in lfns):
+            return None
+
+        return [lfn_entries[str(lfn)] for lfn in lfns]
+
+
+def partition_entries(entries: list[int], partition_size: int) -> list[list[tuple[int, int, int]]]:
+    """
+    Splits the consecutive events of all files, given by their numbers of *entries*, into partitions
+    of *partition_size* events (the last one being possibly smaller). Each partition is a list of
+    (file index, entry start, entry stop) ranges, so that small files are packed into one partition
+    and large files are split across several.
+
+    .. code-block:: python
+
+        partition_entries([10, 5, 30], 20)
+        # -> [[(0, 0, 10), (1, 0, 5), (2, 0, 5)], [(2, 5, 25)], [(2, 25, 30)]]
+    """
+    partitions = []
+    current, n_current = [], 0
+    for file_index, n in enumerate(entries):
+        entry_start = 0
+        while entry_start < n:
+            entry_stop = min(n, entry_start + partition_size - n_current)
+            current.append((file_index, entry_start, entry_stop))
+            n_current += entry_stop - entry_start
+            entry_start = entry_stop
+
+            # close the partition when full
+            if n_current >= partition_size:
+                partitions.append(current)
+                current, n_current = [], 0
+
+    if current:
+        partitions.append(current)
+
+    return partitions
+
+
+def partition_merge_factor(avg_size: float, max_size: float, n_files: int, n_partitions: int) -> int:
+    """
+    Returns the merge factor of cf.MergeReductionStats for reduced outputs of *n_partitions* event
+    range partitions (see :py:func:`partition_entries`) of *n_files* input files, given their
+    average size *avg_size* and the maximum size of merged files *max_size*. cf.MergeReducedEvents
+    and all tasks using its outputs derive the number of merged files from the number of input
+    files and this factor, so it is expressed in units of input files. It is bounded such that
+    there are at most as many merged files as partitions, which cf.MergeReducedEvents distributes
+    evenly over them.
+
+    .. code-block:: python
+
+        # 100 files in 20 partitions of 100MB each, merged into files of up to 500MB
+        partition_merge_factor(100.0, 500.0, 100, 20)
+        # -> 25, i.e. 4 merged files of 5 partitions each
+    """
+    avg_file_size = avg_size * n_partitions / n_files
+    merge_factor = int(round(max_size / avg_file_size)) if avg_file_size > 0 else n_files
+    return min(max(merge_factor, math.ceil(n_files / n_partitions), 1), n_files)
@@ -0,0 +1,310 @@
+# coding: utf-8
+
+"""
+Tasks to incrementally reduce files added to growing datasets.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+
+import law
+import luigi
+
+from l1m.tasks.base import L1MTask
+from l1m.tasks.reduction import CustomReduceEvents
+from l1m.tasks.efficiency import MergeEfficiencyHistograms, MergeLumiEfficiencies
+from l1m.file_util import lfn_fingerprint
+from l1m.reduction.incremental import ReductionLedger
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.framework.mixins import CalibratorsMixin, SelectorStepsMixin
+from columnflow.tasks.external import GetDatasetLFNs
+from columnflow.util import ensure_proxy, dev_sandbox
+
+
+class UpdateReducedEvents(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Reduces files that were added to a growing dataset, such as a prompt dataset, after the
+    :py:class:`CustomReduceEvents` branches of its first ``n_files`` files were processed, without
+    changing the number of files or the branch map.
+
+    Current files are listed with the same config functions as in cf.GetDatasetLFNs and identified
+    by content fingerprints (see the "get_dataset_lfn_fingerprints" config function). A ledger
+    records all reduced files, so that only new files are reduced. Their outputs are appended next to
+    the branch outputs of :py:class:`CustomReduceEvents`, named after their fingerprints. In the
+    online efficiency mode, the histograms and probe counts of :py:class:`MergeEfficiencyHistograms`
+    and :py:class:`MergeLumiEfficiencies`, with those of all files reduced by updates so far added,
+    are stored as outputs of this task, while the merged results themselves are left unchanged.
+
+    The appended reduced events are not part of cf.MergeReducedEvents, whose merged files and
+    cf.MergeReductionStats are left unchanged, and must be read from the appended outputs directly.
+
+    Outputs are stored per *update_name*, e.g. the date of the update, so files are only listed when
+    the task runs and a new update name is needed to reduce files added since. Modified or removed
+    files cannot be subtracted and require a full reprocessing instead.
+    """
+
+    update_name = luigi.Parameter(
+        default=law.NO_STR,
+        description="name of the update, under which the results including all files reduced so "
+        "far are stored; default: the current date as YYYYMMDD",
+    )
+
+    online_efficiency = CustomReduceEvents.online_efficiency.copy()
+    partition_size = CustomReduceEvents.partition_size.copy()
+    cutflow_per_lumi = CustomReduceEvents.cutflow_per_lumi.copy()
+    threshold_scan = CustomReduceEvents.threshold_scan.copy()
+    probe_table = CustomReduceEvents.probe_table.copy()
+    staged_read = CustomReduceEvents.staged_read.copy()
+    decompression_threads = CustomReduceEvents.decompression_threads.copy()
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        GetDatasetLFNs=GetDatasetLFNs,
+        CustomReduceEvents=CustomReduceEvents,
+        MergeEfficiencyHistograms=MergeEfficiencyHistograms,
+        MergeLumiEfficiencies=MergeLumiEfficiencies,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # calibrated columns only exist for files of the branches
+        if self.calibrators:
+            raise Exception(
+                f"{self.__class__.__name__} does not support calibrators, but got "
+                f"{self.calibrators}",
+            )
+
+        # branch task whose setup is used to reduce new files
+        self.reduce_task = self.reqs.CustomReduceEvents.req(self, branch=0, n_processes=1, profile=False)
+
+        # cached fingerprints of the current files
+        self._fingerprints = None
+
+    @classmethod
+    def resolve_param_values(cls, params):
+        params = super().resolve_param_values(params)
+
+        # name updates by the current date by default
+        if params.get("update_name") in (None, law.NO_STR, ""):
+            params["update_name"] = time.strftime("%Y%m%d")
+
+        return params
+
+    def get_fingerprints(self) -> OrderedDict[str, str]:
+        """
+        Returns the fingerprints of all current files of the dataset, mapped to their lfns in the
+        order of cf.GetDatasetLFNs but without limiting them to the number of files in the config.
+        Without a "get_dataset_lfn_fingerprints" function in the config, fingerprints only depend
+        on the lfns.
+        """
+        if self._fingerprints is not None:
+            return self._fingerprints
+
+        get_dataset_lfns = self.config_inst.x("get_dataset_lfns", None)
+        if not callable(get_dataset_lfns):
+            get_dataset_lfns = self.reqs.GetDatasetLFNs.req(self).get_dataset_lfns_dasgoclient
+        get_dataset_lfn_fingerprints = self.config_inst.x("get_dataset_lfn_fingerprints", None)
+
+        fingerprints = OrderedDict()
+        for key in sorted(self.dataset_info_inst.keys):
+            lfns = get_dataset_lfns(self.dataset_inst, self.global_shift_inst, key)
+            key_fingerprints = None
+            if callable(get_dataset_lfn_fingerprints):
+                key_fingerprints = get_dataset_lfn_fingerprints(self.dataset_inst, self.global_shift_inst, key)
+            for lfn in map(str, lfns):
+                fingerprints[lfn] = (key_fingerprints or {}).get(lfn) or lfn_fingerprint(lfn)
+
+        self._fingerprints = fingerprints
+        return fingerprints
+
+    @classmethod
+    def output_key(cls, fingerprint: str) -> str:
+        """
+        Returns the key of the :py:class:`CustomReduceEvents` outputs of the file with
+        *fingerprint*.
+        """
+        return f"lfn_{fingerprint}"
+
+    def requires(self):
+        reqs = {
+            "lfns": self.reqs.GetDatasetLFNs.req(self),
+            "reduction": self.reqs.CustomReduceEvents.req(self),
+        }
+        if self.online_efficiency != "none":
+            reqs["hists"] = self.reqs.MergeEfficiencyHistograms.req(self, branch=0)
+            reqs["lumi"] = self.reqs.MergeLumiEfficiencies.req(self)
+        return reqs
+
+    def output(self):
+        update_dir = f"update__{self.update_name}"
+        outputs = {"update": self.target(update_dir, "update.json")}
+
+        # same structure as the merged results the updated histograms and probe counts are based on
+        if self.online_efficiency != "none":
+            hist_outputs = self.reqs.MergeEfficiencyHistograms.req(self, branch=0).output()
+            outputs["hists"] = {
+                key: law.SiblingFileCollection({
+                    name: self.target(update_dir, target.basename)
+                    for name, target in coll.targets.items()
+                })
+                for key, coll in hist_outputs.items()
+            }
+            outputs["lumi"] = self.target(update_dir, "lumi.npz")
+
+        return outputs
+
+    def ledger_target(self) -> law.FileSystemFileTarget:
+        """
+        Returns the target of the ledger of reduced files, which persists across updates.
+        """
+        return self.target("ledger.json")
+
+    def get_input_file(self, lfn: str) -> law.FileSystemFileTarget:
+        """
+        Returns the first existing input file of the *lfn* on the file systems that cf.GetDatasetLFNs
+        considers as well.
+        """
+        remote_fs = None
+        get_remote_fs = self.config_inst.x("get_dataset_lfns_remote_fs", None)
+        if callable(get_remote_fs):
+            remote_fs = get_remote_fs(self.dataset_inst)
+        if not remote_fs:
+            remote_fs = law.config.get_expanded("outputs", "lfn_sources", split_csv=True)
+
+        for fs in law.util.make_list(remote_fs or []):
+            fs_base = law.config.get_expanded(fs, "base")
+            if law.target.file.get_scheme(fs_base) in (None, "file"):
+                input_file = law.LocalFileTarget(lfn.lstrip(os.sep), fs=fs)
+            else:
+                input_file = law.wlcg.WLCGFileTarget(lfn, fs=fs)
+            if input_file.exists():
+                return input_file
+
+        raise Exception(f"lfn {lfn} not found at any of the file systems {remote_fs}")
+
+    def reduce_file(self, lfn_index: int, lfn: str, fingerprint: str) -> None:
+        """
+        Reduces all events of the file with *lfn* and writes them into the outputs for its
+        *fingerprint*. *lfn_index* only identifies the file among its chunks.
+        """
+        task = self.reduce_task
+        chunks = task.get_chunk_positions([(lfn_index, self.get_input_file(lfn), 0, None)])
+        results = {key: task.process_chunk_in_worker(key, pos) for key, pos in chunks.items()}
+        for nano_file in task.worker_files.values():
+            nano_file.close()
+
+        task.write_chunk_results(results, task.get_outputs(self.output_key(fingerprint)))
+
+    def write_efficiency_hists(self, inputs: dict, outputs: dict, lfns: list[str], ledger: ReductionLedger):
+        """
+        Writes the histograms, maps and threshold scans in the *inputs* of
+        :py:class:`MergeEfficiencyHistograms` with the efficiency histograms of the files with *lfns*
+        added to the corresponding *outputs*.
+        """
+        added = {}
+        for lfn in lfns:
+            outputs_key = self.output_key(ledger.files[lfn]["fingerprint"])
+            for name, h in self.reduce_task.get_outputs(outputs_key)["hists"].load(formatter="pickle").items():
+                if name in added:
+                    added[name] += h
+                else:
+                    added[name] = h
+
+        merge_task = self.requires()["hists"]
+        get_added = {
+            "hists": lambda name: merge_task.get_variable_hist(added, name),
+            "maps": lambda name: added[name],
+            "scans": lambda name: added[f"scan__{name}"],
+        }
+        for key, coll in outputs.items():
+            for name, target in coll.targets.items():
+                h = inputs[key][name].load(formatter="pickle")
+                if added:
+                    h += get_added[key](name)
+                target.dump(h, formatter="pickle")
+
+    def write_lumi_efficiencies(
+        self,
+        inp: law.FileSystemFileTarget,
+        output: law.FileSystemFileTarget,
+        lfns: list[str],
+        ledger: ReductionLedger,
+    ) -> None:
+        """
+        Writes the probe counts per luminosity block in the input *inp* of
+        :py:class:`MergeLumiEfficiencies` with those of the files with *lfns* added to *output*.
+        """
+        from l1m.efficiency.lumi import LumiEfficiency
+
+        targets = [inp] + [
+            self.reduce_task.get_outputs(self.output_key(ledger.files[lfn]["fingerprint"]))["lumi"]
+            for lfn in lfns
+        ]
+        accumulators = []
+        for target in targets:
+            with target.open("rb") as f:
+                accumulators.append(LumiEfficiency.load(f))
+
+        with output.open("wb") as f:
+            LumiEfficiency.merge(accumulators).dump(f)
+
+    @law.decorator.log
+    @ensure_proxy
+    @law.decorator.safe_output
+    def run(self):
+        inputs = self.input()
+        outputs = self.output()
+        fingerprints = self.get_fingerprints()
+
+        # load the ledger, initially containing all files reduced by the branches
+        ledger_target = self.ledger_target()
+        ledger = ReductionLedger(ledger_target.load(formatter="json") if ledger_target.exists() else None)
+        if not len(ledger):
+            lfns = inputs["lfns"].load(formatter="json")[:self.dataset_info_inst.n_files]
+            for lfn in map(str, lfns):
+                ledger.add(lfn, fingerprints.get(lfn), source="branch")
+
+        # reduced files cannot be changed in merged results
+        changed = ledger.changed(fingerprints)
+        if changed:
+            raise Exception(
+                f"{len(changed)} reduced file(s) of dataset {self.dataset} were modified or removed "
+                f"since their reduction, which requires a full reprocessing: {', '.join(changed)}",
+            )
+
+        # reduce new files one by one, recording each of them once done
+        new_lfns = ledger.new(fingerprints)
+        if new_lfns:
+            self.reduce_task.setup_chunk_context(self.reduce_task.requires(), self.reduce_task.input())
+        lfn_indices = {lfn: i for i, lfn in enumerate(fingerprints)}
+        msg = f"reduce {len(new_lfns)} new file(s) ..."
+        for lfn in self.iter_progress(new_lfns, len(new_lfns), msg=msg):
+            self.reduce_file(lfn_indices[lfn], lfn, fingerprints[lfn])
+            ledger.add(lfn, fingerprints[lfn])
+            ledger_target.dump(ledger.to_dict(), indent=4, formatter="json")
+
+        # add outputs of all files reduced by updates so far to the merged results
+        update_lfns = ledger.lfns(source="update")
+        if "hists" in outputs:
+            with self.publish_step(f"add {len(update_lfns)} file(s) to efficiency histograms ..."):
+                self.write_efficiency_hists(inputs["hists"], outputs["hists"], update_lfns, ledger)
+            with self.publish_step(f"add {len(update_lfns)} file(s) to probe counts ..."):
+                self.write_lumi_efficiencies(inputs["lumi"]["lumi"], outputs["lumi"], update_lfns, ledger)
+
+        self.publish_message(f"reduced {len(new_lfns)} new file(s), {len(ledger)} in total")
+        outputs["update"].dump({
+            "n_files": len(ledger),
+            "new": {lfn: fingerprints[lfn] for lfn in new_lfns},
+            "updates": {lfn: ledger.files[lfn]["fingerprint"] for lfn in update_lfns},
+        }, indent=4, formatter="json")
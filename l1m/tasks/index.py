@@ -0,0 +1,78 @@
+# coding: utf-8
+
+"""
+Tasks to index merged reduced events for reading selected runs and luminosity blocks.
+"""
+
+from __future__ import annotations
+
+import law
+
+from l1m.tasks.base import L1MTask
+from l1m.tasks.reduction import CustomReduceEvents  # noqa: F401, patched into cf tasks
+from l1m.columnflow_patches import patch_all
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.framework.mixins import CalibratorsMixin, SelectorStepsMixin
+from columnflow.tasks.reduction import MergeReducedEvents
+from columnflow.util import dev_sandbox
+
+
+# merged reduced events are produced from CustomReduceEvents with a clustered merge
+patch_all()
+
+
+class IndexReducedEvents(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Builds a sidecar index of the ranges of the columns in the "reduced_sort_columns" config entry,
+    e.g. run and luminosity block, in all row groups of all files of cf.MergeReducedEvents from
+    their row group statistics (see :py:class:`l1m.columnar_util.RowGroupIndex`). Files are indexed
+    by their basenames. Readers select files and row groups of run ranges from the index and skip
+    all others:
+
+    .. code-block:: python
+
+        index = RowGroupIndex.from_dict(task.output().load(formatter="json"))
+        paths = {inp["events"].basename: inp["events"].abspath for inp in task.input().targets}
+        table = index.read(paths, columns=["ProbeMuon.pt"], run=(367100, 367200))
+    """
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        MergeReducedEvents=MergeReducedEvents,
+    )
+
+    def requires(self):
+        return self.reqs.MergeReducedEvents.req(self, tree_index=-1)
+
+    def output(self):
+        return self.target("index.json")
+
+    @law.decorator.log
+    @law.decorator.safe_output
+    def run(self):
+        from l1m.columnar_util import RowGroupIndex
+
+        columns = list(self.config_inst.x("reduced_sort_columns", []))
+        if not columns:
+            raise Exception(
+                f"no columns to index defined in 'reduced_sort_columns' of config {self.config_inst.name}",
+            )
+
+        index = RowGroupIndex(columns)
+        inputs = [inp["events"] for inp in self.input().targets]
+        for inp in self.iter_progress(inputs, len(inputs)):
+            with inp.localize("r") as local_inp:
+                index.add_file(local_inp.abspath, inp.basename)
+
+        self.publish_message(
+            f"indexed {len(index.row_groups)} row groups in {len(index.names)} files with "
+            f"{index.num_rows.sum()} rows",
+        )
+        self.output().dump(index.to_dict(), indent=4, formatter="json")
@@ -4,11 +4,26 @@
 Tasks related to reducing events for use on further tasks.
 """
 
+from __future__ import annotations
+
+import os
+import copy
+import tempfile
+import threading
+import contextlib
 from collections import defaultdict
+from typing import Callable
 
 import law
+import luigi
 
 from l1m.tasks.base import L1MTask
+from l1m.columnflow_patches import patch_all
+from l1m.columnar_util import ParquetStreamWriter, StoragePolicy
+from l1m.file_util import FileStager
+from l1m.profiling import StepProfiler, null_profiler
+from l1m.reduction.cutflow import Cutflow
+from l1m.tasks.external import GetDatasetEntries, partition_entries
 from columnflow.tasks.framework.base import Requirements, DatasetTask
 from columnflow.tasks.framework.mixins import (
     CalibratorsMixin, SelectorStepsMixin, ChunkedIOMixin,
@@ -16,10 +31,13 @@ from columnflow.tasks.framework.mixins import (
 from columnflow.tasks.framework.remote import RemoteWorkflow
 from columnflow.tasks.external import GetDatasetLFNs
 from columnflow.tasks.selection import CalibrateEvents
-from columnflow.util import maybe_import, ensure_proxy, dev_sandbox
+from columnflow.util import DotDict, maybe_import, ensure_proxy, dev_sandbox
 
 
+np = maybe_import("numpy")
 ak = maybe_import("awkward")
+uproot = maybe_import("uproot")
+pa = maybe_import("pyarrow")
 
 
 class CustomReduceEvents(
@@ -31,19 +49,210 @@ class CustomReduceEvents(
     law.LocalWorkflow,
     RemoteWorkflow,
 ):
+    online_efficiency = luigi.ChoiceParameter(
+        default="none",
+        choices=("none", "add", "only"),
+        description="when 'add', efficiency histograms of all probe variables are filled per "
+        "trigger category during the reduction and saved alongside the reduced events; when "
+        "'only', the reduced events are not saved at all; default: none",
+    )
+
+    partition_size = luigi.IntParameter(
+        default=law.NO_INT,
+        description="target number of events per branch; when positive, branches process "
+        "consecutive event ranges that can span several small files or a fraction of a large file "
+        "instead of exactly one file; default: config value 'reduction_partition_size' or 0",
+    )
+
+    n_processes = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_process_pool_size", 1),
+        significant=False,
+        description="number of worker processes that read, reduce and write chunks in parallel "
+        "within one branch; default: value of 'reduction_process_pool_size' in the law config or 1",
+    )
+
+    cutflow_per_lumi = luigi.BoolParameter(
+        default=False,
+        description="when True, additionally count events after each selection step per run and "
+        "luminosity block in the cutflow; default: False",
+    )
+    threshold_scan = luigi.BoolParameter(
+        default=False,
+        description="when True, store the highest matched L1 pt per probe for all minimum qualities "
+        "in the 'threshold_scan' config entry and, in the online efficiency mode, fill cumulative "
+        "histograms from which efficiencies of arbitrary pt thresholds are derived; default: False",
+    )
+    sweep = luigi.Parameter(
+        default=law.NO_STR,
+        description="name of a sweep in the 'reduction_sweeps' config entry, mapping names of "
+        "variants to overrides of selector settings; when set, the tag and probe selection of all "
+        "variants is evaluated on the same chunks and one set of outputs is written per variant; "
+        "default: empty",
+    )
+    probe_table = luigi.BoolParameter(
+        default=False,
+        description="when True, write flat probes with an 'event_row' index into a separate event "
+        "table instead of broadcasting event-level columns to all probes; note that cf tasks "
+        "consuming the reduced events require broadcast columns; default: False",
+    )
+    staged_read = luigi.BoolParameter(
+        default=True,
+        significant=False,
+        description="when the selector defines a preselector, first read only the columns it uses "
+        "and all other columns only for events passing it; default: True",
+    )
+    prefetch_files = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_prefetch_files", 0),
+        significant=False,
+        description="number of upcoming local input files, also of subsequent branches, to copy to "
+        "the node-local staging directory while the current file is processed; default: value of "
+        "'reduction_prefetch_files' in the law config or 0",
+    )
+    read_ahead = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_read_ahead", 0),
+        significant=False,
+        description="when positive, read and decompress up to this number of chunks ahead of the "
+        "one being processed and write outputs in a separate thread; default: value of "
+        "'reduction_read_ahead' in the law config or 0",
+    )
+    max_in_flight = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_max_in_flight_chunks", 4),
+        significant=False,
+        description="maximum number of chunks being read, processed or written at the same time "
+        "when reading ahead; default: value of 'reduction_max_in_flight_chunks' in the law config "
+        "or 4",
+    )
+    decompression_threads = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_decompression_threads", 1),
+        significant=False,
+        description="number of threads used by uproot to decompress baskets of input files; "
+        "default: value of 'reduction_decompression_threads' in the law config or 1",
+    )
+    memory_budget = luigi.Parameter(
+        default=law.config.get_expanded("analysis", "reduction_memory_budget", "0"),
+        significant=False,
+        description="resident memory budget per process, e.g. '1.8GB'; when set, the sizes of "
+        "chunks adapt to the measured memory per event and chunks whose estimated memory exceeds "
+        "the budget are processed in parts; sizes only adapt when reading chunks sequentially "
+        "without read_ahead or n_processes; default: value of 'reduction_memory_budget' in the "
+        "law config or 0, i.e., fixed chunk sizes",
+    )
+    profile = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="when True, record the wall and CPU time, resident memory and array sizes of "
+        "all processing steps per chunk and save them as a Chrome trace and a summary table; "
+        "default: False",
+    )
+
     sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
 
     # upstream requirements
     reqs = Requirements(
         RemoteWorkflow.reqs,
         GetDatasetLFNs=GetDatasetLFNs,
+        GetDatasetEntries=GetDatasetEntries,
         CalibrateEvents=CalibrateEvents,
     )
 
+    # profiler of processing steps, replaced by an enabled one in run() when profiling
+    profiler = null_profiler
+
+    @classmethod
+    def resolve_param_values(cls, params):
+        params = super().resolve_param_values(params)
+
+        # check for the default partition size
+        if "partition_size" in params and params["partition_size"] in (None, law.NO_INT):
+            partition_size = 0
+            if "config_inst" in params:
+                partition_size = params["config_inst"].x("reduction_partition_size", partition_size)
+            params["partition_size"] = int(partition_size)
+
+        return params
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # calibrated columns are stored per input file and cannot be aligned with event ranges or
+        # read in worker processes
+        if self.calibrators and (self.partitioned or self.n_processes > 1):
+            raise Exception(
+                f"{self.__class__.__name__} does not support calibrators when partitioning "
+                "branches by event ranges or processing chunks in multiple processes, but got "
+                f"partition_size {self.partition_size}, n_processes {self.n_processes} and "
+                f"calibrators {self.calibrators}",
+            )
+
+        # variants of selector settings in the sweep mode
+        self.sweep_variants = None
+        if self.sweep not in (None, law.NO_STR, ""):
+            sweeps = self.config_inst.x("reduction_sweeps", {})
+            if self.sweep not in sweeps:
+                raise ValueError(
+                    f"sweep '{self.sweep}' not found in 'reduction_sweeps' of config "
+                    f"{self.config_inst.name}, available sweeps: {', '.join(sweeps) or 'none'}",
+                )
+            self.sweep_variants = dict(sweeps[self.sweep])
+
+        # producer that assigns trigger categories to probes for the online efficiency mode
+        self.efficiency_producer_inst = None
+        if self.online_efficiency != "none":
+            from l1m.production.trigger import trigger_category_ids
+            self.efficiency_producer_inst = trigger_category_ids(
+                inst_dict=self.get_array_function_kwargs(task=self),
+            )
+
+        # producer of the highest matched L1 pt per quality cut for the threshold scan mode
+        self.scan_producer_inst = None
+        if self.threshold_scan:
+            from l1m.production.trigger import l1_max_pt
+            self.scan_producer_inst = l1_max_pt(
+                inst_dict=self.get_array_function_kwargs(task=self),
+            )
+
+    @property
+    def partitioned(self) -> bool:
+        return self.partition_size > 0
+
+    @property
+    def variant_names(self) -> list[str | None]:
+        """
+        Names of all selection variants in the sweep mode, or a single *None* otherwise.
+        """
+        return list(self.sweep_variants) if self.sweep_variants else [None]
+
+    def store_parts(self):
+        parts = super().store_parts()
+
+        # outputs of sweeps are stored separately
+        if self.sweep_variants:
+            parts.insert_after("selector", "sweep", f"sweep__{self.sweep}")
+
+        return parts
+
+    def create_branch_map(self):
+        if not self.partitioned:
+            return super().create_branch_map()
+
+        # the partitioning requires the number of entries per file, so as long as they are not
+        # known, return a dummy branch map that is not cached
+        entries = self.reqs.GetDatasetEntries.req(self).output()
+        if not entries.exists():
+            self._cache_branches = False
+            return {0: None}
+        self._cache_branches = True
+
+        # map branches to lists of (lfn_index, entry_start, entry_stop) ranges
+        entries = entries.load(formatter="json")["entries"]
+        return dict(enumerate(partition_entries(entries, self.partition_size)))
+
     def workflow_requires(self):
         reqs = super().workflow_requires()
 
         reqs["lfns"] = self.reqs.GetDatasetLFNs.req(self)
+        if self.partitioned:
+            reqs["entries"] = self.reqs.GetDatasetEntries.req(self)
 
         if not self.pilot:
             reqs["calib"] = [
@@ -68,6 +277,8 @@ class CustomReduceEvents(
                 for c in self.calibrators
             ],
         }
+        if self.partitioned:
+            reqs["entries"] = self.reqs.GetDatasetEntries.req(self)
 
         # add selector dependent requirements
         reqs["selector"] = self.selector_inst.run_requires()
@@ -75,37 +286,109 @@ class CustomReduceEvents(
         return reqs
 
     def output(self):
+        return self.get_outputs(self.branch)
+
+    def get_outputs(self, key: int | str) -> dict:
+        """
+        Returns the outputs for the events processed under *key*, which is the branch number for
+        branches of this workflow, or e.g. a file fingerprint for outputs appended by
+        :py:class:`l1m.tasks.incremental.UpdateReducedEvents`. In the sweep mode, outputs of all
+        variants are stored in a "variants" dictionary.
+        """
+        if self.sweep_variants:
+            outputs = {
+                "variants": {
+                    variant: self.get_variant_outputs(f"{key}__{variant}")
+                    for variant in self.sweep_variants
+                },
+            }
+        else:
+            outputs = self.get_variant_outputs(key)
+        if self.profile:
+            outputs["trace"] = self.target(f"trace_{key}.json")
+            outputs["profile"] = self.target(f"profile_{key}.txt")
+        return outputs
+
+    def get_variant_outputs(self, key: int | str) -> dict:
         outputs = {
-            "events": self.target(f"events_{self.branch}.parquet"),
-            "stats": self.target(f"stats_{self.branch}.json"),
+            "stats": self.target(f"stats_{key}.json"),
+            "cutflow": self.target(f"cutflow_{key}.npz"),
         }
+        if self.online_efficiency != "only":
+            outputs["events"] = self.target(f"events_{key}.parquet")
+            if self.probe_table:
+                outputs["event_table"] = self.target(f"event_table_{key}.parquet")
+        if self.online_efficiency != "none":
+            outputs["hists"] = self.target(f"hists_{key}.pickle")
+            outputs["lumi"] = self.target(f"lumi_{key}.npz")
         return outputs
 
+    def iter_variant_outputs(self, outputs: dict):
+        """
+        Generator that yields 2-tuples (variant name, variant outputs) for all
+        :py:attr:`variant_names` given all *outputs*.
+        """
+        for variant in self.variant_names:
+            yield variant, (outputs if variant is None else outputs["variants"][variant])
+
     @law.decorator.log
     @ensure_proxy
     @law.decorator.localize
     @law.decorator.safe_output
     def run(self):
-        from columnflow.columnar_util import (
-            Route, RouteFilter, mandatory_coffea_columns, update_ak_array, add_ak_aliases,
-            sorted_ak_to_parquet,
-        )
-
         # prepare inputs and outputs
         reqs = self.requires()
         lfn_task = reqs["lfns"]
         inputs = self.input()
         outputs = self.output()
-        column_chunks = {}
         stats = defaultdict(float)
+        cutflow = Cutflow(by_lumi=self.cutflow_per_lumi)
+        self.profiler = StepProfiler(enabled=self.profile)
+
+        # run the selector setup and define columns to read and write
+        self.setup_chunk_context(reqs, inputs)
+
+        # prepare efficiency histograms
+        histograms = self.create_efficiency_hists() if self.efficiency_producer_inst else None
+
+        # open writers that stream chunks directly into the output files in chunk order
+        writers = self.create_writers(outputs)
+
+        # process all chunks in all entry ranges of this branch
+        entry_ranges = list(self.iter_entry_ranges(lfn_task))
+        with contextlib.ExitStack() as stack:
+            for writer in writers.values():
+                stack.enter_context(writer)
+            # optionally stage upcoming input files on the local node
+            self.file_stager = None
+            if self.prefetch_files > 0:
+                self.file_stager = stack.enter_context(self.create_file_stager())
+                self.prefetch_lfns = lfn_task.output().load(formatter="json")
+            if self.n_processes > 1:
+                self.process_chunks_multiprocess(entry_ranges, writers, stats, cutflow, histograms)
+            else:
+                self.process_chunks(entry_ranges, inputs, writers, stats, cutflow, histograms)
+
+        # save histograms, the cutflow and stats
+        self.save_outputs(outputs, stats, cutflow, histograms)
+
+        # save the profile
+        if self.profile:
+            table = self.profiler.summary_table()
+            self.publish_message(table)
+            outputs["trace"].dump(self.profiler.to_trace(), formatter="json")
+            outputs["profile"].dump(table + "\n", formatter="text")
+
+    def setup_chunk_context(self, reqs: dict, inputs: dict) -> None:
+        """
+        Runs the selector setup with its requirements and *inputs* and stores everything needed to
+        process single chunks, also in worker processes, in :py:attr:`chunk_context`.
+        """
+        from columnflow.columnar_util import Route, RouteFilter, mandatory_coffea_columns
 
         # run the selector setup
         self.selector_inst.run_setup(reqs["selector"], inputs["selector"])
 
-        # create a temp dir for saving intermediate files
-        tmp_dir = law.LocalDirectoryTarget(is_tmp=True)
-        tmp_dir.touch()
-
         # get shift dependent aliases
         aliases = self.local_shift_inst.x("column_aliases", {})
 
@@ -113,54 +396,1015 @@ class CustomReduceEvents(
         read_columns = mandatory_coffea_columns | self.selector_inst.used_columns | set(aliases.values())
         read_columns = {Route(c) for c in read_columns}
 
+        # optional adaptive chunk sizes, with event costs estimated by the selector when defined
+        chunk_sizer, chunk_cost = None, None
+        memory_budget = law.util.parse_bytes(self.memory_budget or "0")
+        if memory_budget > 0:
+            from l1m.columnar_util import AdaptiveChunkSize
+            chunk_size = law.config.get_expanded_int("analysis", "chunked_io_chunk_size", 50000)
+            # start with a fraction of the nominal chunk size until the memory per event is known
+            chunk_sizer = AdaptiveChunkSize(
+                memory_budget,
+                initial_size=chunk_size // 10,
+                min_size=min(1000, chunk_size),
+                max_size=10 * chunk_size,
+            )
+            chunk_cost = getattr(self.selector_inst, "chunk_cost", None)
+            if chunk_cost:
+                read_columns |= {Route(c) for c in getattr(chunk_cost, "uses", ())}
+
         # define columns that will be written
-        write_columns = {
-            Route(c)
-            for c in self.config_inst.x.keep_columns.get(self.task_family, ["*"])
-        } | mandatory_coffea_columns | self.selector_inst.produced_columns
-        route_filter = RouteFilter(write_columns)
+        write_columns = set()
+        if self.online_efficiency != "only":
+            write_columns = {
+                Route(c)
+                for c in self.config_inst.x.keep_columns.get(self.task_family, ["*"])
+            } | mandatory_coffea_columns | self.selector_inst.produced_columns
+            if self.scan_producer_inst:
+                write_columns |= self.scan_producer_inst.produced_columns
+
+        # optional preselection on a subset of columns, see staged_read
+        preselector_inst = None
+        if self.staged_read and getattr(self.selector_inst, "preselector", None):
+            preselector_inst = self.selector_inst[self.selector_inst.preselector]
+
+        self.chunk_context = DotDict(
+            aliases=aliases,
+            read_columns=read_columns,
+            first_read_columns=(
+                {Route(c) for c in preselector_inst.used_columns} |
+                {Route(c) for c in aliases.values()} |
+                {Route(c) for c in getattr(chunk_cost, "uses", ())}
+                if preselector_inst else
+                read_columns
+            ),
+            write_columns=write_columns,
+            route_filter=RouteFilter(write_columns),
+            preselector_inst=preselector_inst,
+            sort_columns=list(self.config_inst.x("reduced_sort_columns", [])),
+            chunk_sizer=chunk_sizer,
+            chunk_cost=chunk_cost,
+        )
+
+        # trace allocations from here on, i.e., on top of the memory of the selector setup
+        if chunk_sizer:
+            chunk_sizer.start()
+
+    def create_writers(self, outputs: dict) -> dict[str, ParquetStreamWriter]:
+        """
+        Returns stream writers of all tables to write into the *outputs*, mapped to output names
+        that are prefixed by the variant name in the sweep mode (see :py:func:`variant_key`).
+        """
+        writers = {}
+        if not self.chunk_context.write_columns:
+            return writers
+
+        policy = StoragePolicy.from_config(self.config_inst, self.task_family)
+        for variant, variant_outputs in self.iter_variant_outputs(outputs):
+            writers[variant_key(variant, "events")] = ParquetStreamWriter(
+                variant_outputs["events"].abspath,
+                # shift the event rows of probes by the number of events in all previous chunks
+                offset_column="event_row" if self.probe_table else None,
+                policy=policy,
+            )
+            if self.probe_table:
+                writers[variant_key(variant, "event_table")] = ParquetStreamWriter(
+                    variant_outputs["event_table"].abspath,
+                    policy=policy,
+                )
 
-        # let the lfn_task prepare the nano file (basically determine a good pfn)
-        [(lfn_index, input_file)] = lfn_task.iter_nano_files(self)
+        return writers
 
-        # open the input file with uproot
-        with self.publish_step("load and open ..."):
-            nano_file = input_file.load(formatter="uproot")
+    def save_outputs(
+        self,
+        outputs: dict,
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None,
+    ) -> None:
+        """
+        Saves the efficiency *histograms*, the *cutflow* and the *stats*, completed by the counts of
+        the cutflow, into the *outputs*. The probe counts per luminosity block in the "lumi" entry of
+        *histograms* are saved separately. In the sweep mode, they are split into the outputs of all
+        variants, each receiving the cutflow steps shared by all variants and its own steps.
+        """
+        from columnflow.tasks.selection import MergeSelectionStats
+
+        for variant, variant_outputs in self.iter_variant_outputs(outputs):
+            variant_stats, variant_cutflow, variant_histograms = stats, cutflow, histograms
+            if variant is not None:
+                variant_stats = copy.deepcopy(stats)
+                variant_cutflow = cutflow.for_variant(variant)
+                if histograms is not None:
+                    variant_histograms = self.get_variant_hists(histograms, variant)
+
+            if variant_histograms is not None:
+                variant_histograms = dict(variant_histograms)
+                with variant_outputs["lumi"].open("wb") as f:
+                    variant_histograms.pop("lumi").dump(f)
+                variant_outputs["hists"].dump(variant_histograms, formatter="pickle")
+
+            with variant_outputs["cutflow"].open("wb") as f:
+                variant_cutflow.dump(f)
+            MergeSelectionStats.merge_counts(
+                variant_stats,
+                variant_cutflow.to_stats(is_mc=self.dataset_inst.is_mc),
+            )
+            variant_outputs["stats"].dump(variant_stats, indent=4, formatter="json")
+
+    def process_chunk(
+        self,
+        events: ak.Array,
+        diffs: list[ak.Array],
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None = None,
+        nano_file: uproot.ReadOnlyDirectory | None = None,
+        pos: tuple | None = None,
+    ) -> dict[str, ak.Array] | None:
+        """
+        Applies calibrated *diffs*, aliases and the selector to a chunk of *events*, updating
+        *stats*, the *cutflow* and optional efficiency *histograms* in-place. Returns the tables to
+        write, i.e., the reduced "events" with only the columns to write and, with
+        :py:attr:`probe_table`, the "event_table", or *None* if nothing is written. In the sweep
+        mode, tables and histograms of all variants are prefixed by their names (see
+        :py:func:`variant_key`).
+
+        When a preselector is used, *events* are only expected to contain the columns it uses and
+        the sources of aliases. The preselector is applied after the calibrated *diffs* and aliases,
+        so that it cuts on the same values as the selector. All other columns are then read from the
+        *nano_file* at chunk position *pos* for events passing the preselection.
+
+        Written tables are sorted by the event-level columns in the "reduced_sort_columns" config
+        entry, e.g. run and luminosity block.
+        """
+        from columnflow.columnar_util import update_ak_array, add_ak_aliases
+        from l1m.columnar_util import read_selected_coffea_root, sort_by_columns
+
+        ctx = self.chunk_context
+        lap = self.profiler.laps()
+
+        # apply the calibrated diffs and add aliases
+        update_columns = lambda events, diffs: add_ak_aliases(
+            update_ak_array(events, *diffs),
+            ctx.aliases,
+            remove_src=True,
+        )
+
+        # preselect events on updated columns and read all columns only for those
+        if ctx.preselector_inst:
+            mask = ak.to_numpy(ctx.preselector_inst(update_columns(events, diffs), stats, cutflow))
+            lap("preselection", mask)
+            events = read_selected_coffea_root(nano_file, pos, mask, ctx.read_columns)
+            diffs = [diff[mask] for diff in diffs]
+            lap("read_selected", events)
+
+        events = update_columns(events, diffs)
+        lap("update_columns")
+
+        # invoke the selection function, optionally for all variants of the sweep
+        selector_kwargs = {"variants": self.sweep_variants} if self.sweep_variants else {}
+        events, results = self.selector_inst(
+            events,
+            stats,
+            cutflow=cutflow,
+            preselected=bool(ctx.preselector_inst),
+            probe_table=self.probe_table,
+            profiler=self.profiler,
+            **selector_kwargs,
+        )
+        event_tables = results.aux.get("event_table")
+        if not self.sweep_variants:
+            lap("selection", events)
+            events, event_tables = {None: events}, {None: event_tables}
+        else:
+            lap("selection")
+
+        tables = {}
+        for variant in self.variant_names:
+            variant_events, event_table = events[variant], (event_tables or {}).get(variant)
+
+            # add the highest matched L1 pt per quality cut
+            if self.scan_producer_inst:
+                variant_events = self.scan_producer_inst(variant_events)
+                lap("l1_max_pt")
+
+            # fill efficiency histograms
+            if histograms is not None:
+                self.fill_efficiency_hists(self.get_variant_hists(histograms, variant), variant_events, event_table)
+                lap("efficiency_hists")
+
+            # remove columns
+            if not ctx.write_columns:
+                continue
+            variant_events = ctx.route_filter(variant_events)
+
+            # optional check for finite values
+            if self.check_finite:
+                self.raise_if_not_finite(variant_events)
+            lap("filter_columns", variant_events)
+
+            # sort by event-level columns so that row groups cover narrow ranges of them
+            if ctx.sort_columns:
+                variant_events, event_table = sort_by_columns(variant_events, ctx.sort_columns, event_table)
+                lap("sort", variant_events)
+
+            tables[variant_key(variant, "events")] = variant_events
+            if self.probe_table:
+                tables[variant_key(variant, "event_table")] = event_table
+
+        return tables or None
+
+    def process_chunk_within_budget(
+        self,
+        events: ak.Array,
+        diffs: list[ak.Array],
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None = None,
+        nano_file: uproot.ReadOnlyDirectory | None = None,
+        pos: tuple | None = None,
+    ) -> dict[str, ak.Array] | None:
+        """
+        Same as :py:meth:`process_chunk`, but with a :py:attr:`memory_budget`, the chunk is
+        processed in consecutive parts whose estimated memory fits into the budget, with costs of
+        events given by the "chunk_cost" function of the selector when defined (see
+        :py:meth:`l1m.columnar_util.AdaptiveChunkSize.split`). The memory of all parts is measured
+        to adapt subsequent chunks, and their tables are concatenated.
+        """
+        ctx = self.chunk_context
+        if not ctx.chunk_sizer:
+            return self.process_chunk(events, diffs, stats, cutflow, histograms, nano_file, pos)
+
+        weights = ctx.chunk_cost(events) if ctx.chunk_cost else np.ones(len(events))
+        parts = []
+        for start, stop in ctx.chunk_sizer.split(weights):
+            part_pos = pos
+            if pos is not None:
+                part_pos = pos._replace(entry_start=pos.entry_start + start, entry_stop=pos.entry_start + stop)
+            with ctx.chunk_sizer.measure(weights[start:stop].sum()):
+                parts.append(self.process_chunk(
+                    events[start:stop],
+                    [diff[start:stop] for diff in diffs],
+                    stats,
+                    cutflow,
+                    histograms,
+                    nano_file,
+                    part_pos,
+                ))
+
+        return self.concat_chunk_tables(parts)
+
+    def concat_chunk_tables(self, parts: list[dict[str, ak.Array] | None]) -> dict[str, ak.Array] | None:
+        """
+        Concatenates the tables of consecutive *parts* of a chunk, as returned by
+        :py:meth:`process_chunk`, shifting the event rows of probes in the probe table mode by the
+        number of events in previous parts.
+        """
+        from columnflow.columnar_util import set_ak_column
+
+        parts = [tables for tables in parts if tables is not None]
+        if len(parts) <= 1:
+            return parts[0] if parts else None
+
+        tables = {}
+        for name in parts[0]:
+            variant, _, table_name = name.rpartition("/")
+            name_tables = [part[name] for part in parts]
+            if self.probe_table and table_name == "events":
+                event_table_name = variant_key(variant or None, "event_table")
+                offsets = np.cumsum([0] + [len(part[event_table_name]) for part in parts[:-1]])
+                name_tables = [
+                    set_ak_column(table, "event_row", table.event_row + offset)
+                    for table, offset in zip(name_tables, offsets)
+                ]
+            tables[name] = ak.concatenate(name_tables, axis=0)
+
+        return tables
+
+    def write_chunk_tables(
+        self,
+        writers: dict[str, ParquetStreamWriter],
+        seq: int,
+        tables: dict[str, ak.Array | pa.Table],
+        queue: Callable | None = None,
+    ) -> None:
+        """
+        Passes all *tables* of the chunk with sequence number *seq* to the corresponding *writers*,
+        either directly or via *queue*.
+        """
+        for name, writer in writers.items():
+            # number of rows in the event table of the same variant to shift event rows of probes
+            event_table_name = variant_key(name.rpartition("/")[0] or None, "event_table")
+            n_event_rows = len(tables[event_table_name]) if event_table_name in tables else 0
+            write = self.profiler.wrap(f"write_{name}", writer.write)
+            if queue:
+                queue(write, (seq, tables[name], n_event_rows))
+            else:
+                write(seq, tables[name], n_event_rows)
+
+    def process_chunks(
+        self,
+        entry_ranges: list[tuple],
+        inputs: dict,
+        writers: dict[str, ParquetStreamWriter],
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None,
+    ) -> None:
+        """
+        Processes all chunks of all *entry_ranges* sequentially in the current process and passes
+        their tables to the *writers*.
+        """
+        from l1m.columnar_util import (
+            EntryRangeChunkedIOHandler, PipelinedChunkedIOHandler, AdaptiveChunkedIOHandler,
+        )
+
+        # optionally overlap reading, processing and writing
+        handler_cls, handler_kwargs = EntryRangeChunkedIOHandler, {}
+        chunk_sizer = self.chunk_context.chunk_sizer
+        if self.read_ahead > 0:
+            handler_cls = PipelinedChunkedIOHandler
+            handler_kwargs = {"read_ahead": self.read_ahead, "max_in_flight": self.max_in_flight}
+        elif chunk_sizer:
+            # choose the size of each chunk right before reading it
+            handler_cls = AdaptiveChunkedIOHandler
+            handler_kwargs = {"sizer": chunk_sizer}
 
         # iterate over chunks of events and diffs
+        seq_offset = 0
         n_calib = len(inputs["calibrations"])
-        for (events, *diffs), pos in self.iter_chunked_io(
-            [nano_file] + [inp.path for inp in inputs["calibrations"]],
-            source_type=["coffea_root"] + n_calib * ["awkward_parquet"],
-            read_columns=(1 + n_calib) * [read_columns],
-        ):
-            # apply the calibrated diffs
-            events = update_ak_array(events, *diffs)
+        for lfn_index, input_file, entry_start, entry_stop in entry_ranges:
+            # stage upcoming files while this one is processed
+            self.prefetch_input_files(lfn_index)
 
-            # add aliases
-            events = add_ak_aliases(events, aliases, remove_src=True)
+            # open the input file with uproot
+            with self.publish_step("load and open ..."):
+                nano_file = self.open_input_file(input_file)
 
-            # invoke the selection function
-            # NOTE: results not used at all at the moment
-            events, results = self.selector_inst(events, stats)
+            handler = handler_cls(
+                [nano_file] + [inp.path for inp in inputs["calibrations"]],
+                source_type=["coffea_root"] + n_calib * ["awkward_parquet"],
+                read_columns=[self.chunk_context.first_read_columns] + n_calib * [self.chunk_context.read_columns],
+                entry_start=entry_start,
+                entry_stop=entry_stop,
+                **handler_kwargs,
+            )
+            n_chunks = 0
+            lap = self.profiler.laps()
+            for (events, *diffs), pos in self.iter_chunked_io(handler):
+                n_chunks += 1
+                seq = seq_offset + pos.index
+                lap("read", events, chunk=seq)
+                with self.profiler.chunk(seq), self.profiler.step("process_chunk"):
+                    tables = self.process_chunk_within_budget(
+                        events, diffs, stats, cutflow, histograms, nano_file, pos,
+                    )
+                    if tables is not None:
+                        # write tables in a thread of the handler
+                        self.write_chunk_tables(writers, seq, tables, self.chunked_io.queue)
+                lap = self.profiler.laps()
 
-            # remove columns
-            if write_columns:
-                events = route_filter(events)
+            seq_offset += n_chunks
+
+            if self.read_ahead > 0:
+                self.publish_message("stage utilization: " + ", ".join(
+                    f"{stage} {frac:.0%}" for stage, frac in handler.utilization().items()
+                ))
+
+        if chunk_sizer:
+            self.publish_message(
+                f"adaptive chunk sizes: {seq_offset} chunks, {chunk_sizer.n_split} split into parts, "
+                f"next size {chunk_sizer.next_size()} events",
+            )
+
+    def process_chunks_multiprocess(
+        self,
+        entry_ranges: list[tuple],
+        writers: dict[str, ParquetStreamWriter],
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None,
+    ) -> None:
+        """
+        Processes all chunks of all *entry_ranges* in a pool of :py:attr:`n_processes` worker
+        processes that decode, reduce and convert chunks to arrow tables independently. Tables are
+        passed to the *writers* as soon as chunks are done, while per-chunk stats, cutflows and
+        histograms are merged in deterministic (lfn index, chunk index) order.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        # stage upcoming files of subsequent branches while the files of this branch are processed
+        if entry_ranges:
+            self.prefetch_input_files(entry_ranges[-1][0])
+
+        # determine all chunk positions upfront
+        chunks = self.get_chunk_positions(entry_ranges)
+
+        # workers are forked from this process so that they inherit the selector setup
+        results = {}
+        msg = f"process {len(chunks)} chunks in {self.n_processes} worker processes ..."
+        with ProcessPoolExecutor(
+            self.n_processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_chunk_worker,
+            initargs=(self,),
+        ) as pool:
+            futures = {
+                pool.submit(_process_chunk_in_worker, key, pos): (seq, key)
+                for seq, (key, pos) in enumerate(sorted(chunks.items()))
+            }
+            for future in self.iter_progress(as_completed(futures), len(futures), msg=msg):
+                seq, key = futures[future]
+                chunk_stats, chunk_cutflow, chunk_histograms, tables, records = future.result()
+                results[key] = (chunk_stats, chunk_cutflow, chunk_histograms)
+                self.profiler.extend(records)
+                if tables is not None:
+                    with self.profiler.chunk(key):
+                        self.write_chunk_tables(writers, seq, tables)
+
+        self.merge_chunk_results(results, stats, cutflow, histograms)
+
+    def get_chunk_positions(self, entry_ranges: list[tuple]) -> dict[tuple[int, int], tuple]:
+        """
+        Returns the positions of all chunks of all *entry_ranges* as plain (index, entry start,
+        entry stop, chunk size) tuples that can be sent to other processes, mapped to (lfn index,
+        chunk index) keys. Input files are registered in :py:attr:`worker_inputs` and only their
+        headers are read to determine the number of entries when needed.
+        """
+        chunk_size = law.config.get_expanded_int("analysis", "chunked_io_chunk_size", 50000)
+
+        self.worker_inputs = {}
+        self.worker_files = {}
+        chunks = {}
+        for lfn_index, input_file, entry_start, entry_stop in entry_ranges:
+            self.worker_inputs[lfn_index] = input_file
+            if entry_stop is None:
+                with self.open_input_file(input_file) as nano_file:
+                    entry_stop = nano_file["Events"].num_entries
+            for index, start in enumerate(range(entry_start, entry_stop, chunk_size)):
+                chunks[(lfn_index, index)] = (index, start, min(start + chunk_size, entry_stop), chunk_size)
+
+        return chunks
+
+    def merge_chunk_results(
+        self,
+        results: dict[tuple[int, int], tuple],
+        stats: defaultdict,
+        cutflow: Cutflow,
+        histograms: dict | None,
+    ) -> None:
+        """
+        Merges the stats, cutflows and histograms in the first three elements of the chunk
+        *results* into *stats*, the *cutflow* and *histograms* in-place, in deterministic order of
+        the (lfn index, chunk index) keys of *results*.
+        """
+        from columnflow.tasks.selection import MergeSelectionStats
+
+        cutflow += Cutflow.merge(results[key][1] for key in sorted(results))
+        for key in sorted(results):
+            chunk_stats, _, chunk_histograms = results[key][:3]
+            MergeSelectionStats.merge_counts(stats, chunk_stats)
+            if histograms is not None:
+                for variable_name, h in chunk_histograms.items():
+                    histograms[variable_name] += h
+
+    def process_chunk_in_worker(
+        self,
+        key: tuple[int, int],
+        pos: tuple,
+    ) -> tuple[defaultdict, Cutflow, dict | None, dict[str, pa.Table] | None, list[dict]]:
+        """
+        Reads the chunk at position *pos*, as returned by :py:meth:`get_chunk_positions`, of the
+        input file with the lfn index in *key* and reduces it. Meant to be called in worker
+        processes. Returns the stats, cutflow and histograms of this chunk, its tables to write,
+        converted to arrow tables, and the profiler records of the chunk.
+        """
+        from columnflow.columnar_util import ChunkedIOHandler
+
+        # open each input file once per worker
+        lfn_index = key[0]
+        if lfn_index not in self.worker_files:
+            self.worker_files[lfn_index] = self.open_input_file(self.worker_inputs[lfn_index], wait=False)
+
+        # record steps of this chunk with a profiler local to the worker
+        self.profiler = self.profiler.child()
+
+        nano_file = self.worker_files[lfn_index]
+        stats = defaultdict(float)
+        cutflow = Cutflow(by_lumi=self.cutflow_per_lumi)
+        histograms = self.create_efficiency_hists() if self.efficiency_producer_inst else None
+
+        pos = ChunkedIOHandler.ChunkPosition(*pos)
+        with self.profiler.chunk(key), self.profiler.step("process_chunk"):
+            with self.profiler.step("read"):
+                events = ChunkedIOHandler.read_coffea_root(
+                    nano_file,
+                    pos,
+                    read_columns=self.chunk_context.first_read_columns,
+                )
+
+            tables = self.process_chunk_within_budget(events, [], stats, cutflow, histograms, nano_file, pos)
+
+            if tables is not None:
+                with self.profiler.step("to_table"):
+                    tables = {name: ParquetStreamWriter.to_table(table) for name, table in tables.items()}
+
+        return stats, cutflow, histograms, tables, self.profiler.records
+
+    def write_chunk_results(
+        self,
+        results: dict[tuple[int, int], tuple],
+        outputs: dict | None = None,
+    ) -> tuple[defaultdict, Cutflow, dict | None]:
+        """
+        Writes the *results* of all chunks of this branch, as returned by
+        :py:meth:`process_chunk_in_worker` and mapped to (lfn index, chunk index) keys, into the
+        *outputs*, defaulting to those of this branch, e.g. after the chunks were processed by an
+        external scheduler. Returns the merged stats, cutflow and histograms.
+        """
+        stats = defaultdict(float)
+        cutflow = Cutflow(by_lumi=self.cutflow_per_lumi)
+        histograms = self.create_efficiency_hists() if self.efficiency_producer_inst else None
+
+        with law.localize_file_targets(outputs or self.output(), mode="w") as outputs:
+            with contextlib.ExitStack() as stack:
+                writers = self.create_writers(outputs)
+                for writer in writers.values():
+                    stack.enter_context(writer)
+                for seq, key in enumerate(sorted(results)):
+                    tables = results[key][3]
+                    if tables is not None:
+                        self.write_chunk_tables(writers, seq, tables)
+
+            self.merge_chunk_results(results, stats, cutflow, histograms)
+            self.save_outputs(outputs, stats, cutflow, histograms)
+
+        return stats, cutflow, histograms
+
+    def iter_entry_ranges(self, lfn_task: GetDatasetLFNs):
+        """
+        Generator that yields 4-tuples (lfn index, input file, entry start, entry stop) for all
+        entry ranges handled by this branch. Without partitioning, this is exactly one file whose
+        entries are all processed (with *None* as entry stop).
+        """
+        if not self.partitioned:
+            # let the lfn_task prepare the nano file (basically determine a good pfn)
+            [(lfn_index, input_file)] = lfn_task.iter_nano_files(self)
+            yield lfn_index, input_file, 0, None
+            return
+
+        for lfn_index, entry_start, entry_stop in self.branch_data:
+            # let the lfn_task prepare the nano file (basically determine a good pfn)
+            [(_, input_file)] = lfn_task.iter_nano_files(self, lfn_indices=[lfn_index])
+            yield lfn_index, input_file, entry_start, entry_stop
+
+    def create_file_stager(self) -> FileStager:
+        """
+        Returns a :py:class:`FileStager` with the staging directory and maximum size configured in
+        the analysis section of the law config.
+        """
+        staging_dir = (
+            law.config.get_expanded("analysis", "reduction_staging_dir", None) or
+            os.path.join(tempfile.gettempdir(), "l1m_staging")
+        )
+        max_size = law.util.parse_bytes(
+            law.config.get_expanded("analysis", "reduction_staging_max_size", "20GB"),
+        )
+        return FileStager(staging_dir, max_size)
+
+    def get_lfn_index_order(self) -> list[int]:
+        """
+        Returns the indices of all files in the order they are processed by this and all subsequent
+        branches of the workflow.
+        """
+        lfn_indices = []
+        for branch, data in sorted(self.branch_map.items()):
+            if branch < self.branch:
+                continue
+            for lfn_index in ([d[0] for d in data] if self.partitioned else data):
+                if lfn_index not in lfn_indices:
+                    lfn_indices.append(lfn_index)
+        return lfn_indices
+
+    def prefetch_input_files(self, lfn_index: int) -> None:
+        """
+        Starts staging the :py:attr:`prefetch_files` local input files processed after the one with
+        *lfn_index*. Files that are not accessible locally, e.g. remote ones, are skipped.
+        """
+        if not self.file_stager:
+            return
+
+        order = self.get_lfn_index_order()
+        upcoming = order[order.index(lfn_index) + 1:] if lfn_index in order else []
+        paths = [
+            path for path in (str(self.prefetch_lfns[i]) for i in upcoming)
+            if os.path.isabs(path) and os.path.isfile(path)
+        ]
+        self.file_stager.prefetch(paths[:self.prefetch_files])
+
+    def open_input_file(self, input_file: law.FileSystemFileTarget, wait: bool = True):
+        """
+        Opens the *input_file* with uproot, using its staged copy when existing. With *wait*, a
+        pending copy of the file is awaited first. Baskets are decompressed in
+        :py:attr:`decompression_threads` threads.
+        """
+        open_options = {}
+        if self.decompression_threads > 1:
+            # the executor is shut down by uproot when the file is closed
+            from concurrent.futures import ThreadPoolExecutor
+            open_options["decompression_executor"] = ThreadPoolExecutor(self.decompression_threads)
+
+        if getattr(self, "file_stager", None) and isinstance(input_file, law.LocalFileTarget):
+            stager = self.file_stager
+            path = (stager.get if wait else stager.find)(input_file.abspath)
+            if path != input_file.abspath:
+                return uproot.open(path, **open_options)
+
+        return input_file.load(formatter="uproot", **open_options)
+
+    def get_efficiency_hist_variables(self) -> dict[str, list[str]]:
+        """
+        Returns the names of the variables of all efficiency histograms, i.e., of all probe
+        variables and the efficiency maps defined in the config, mapped to histogram names.
+        """
+        return {
+            **{
+                variable_name: [variable_name]
+                for variable_name in self.config_inst.x.variable_groups["probe"]
+            },
+            **self.config_inst.x("efficiency_maps", {}),
+        }
+
+    def create_efficiency_hists(self) -> dict:
+        """
+        Returns empty efficiency histograms for all probe variables and sparse histograms for all
+        efficiency maps, mapped to histogram names. In the threshold scan mode, histograms of the
+        highest matched L1 pt are added as "scan__<variable>". Probe counts of the denominator and
+        all trigger categories per run, luminosity block and number of primary vertices are added
+        as "lumi". In the sweep mode, histograms are created for all variants with names prefixed by
+        the variant name (see :py:func:`variant_key`).
+        """
+        from l1m.efficiency.hists import create_hist
+        from l1m.efficiency.lumi import LumiEfficiency
+        from l1m.efficiency.sparse import SparseHist
+        from l1m.efficiency.threshold_scan import create_scan_hist
+
+        maps = self.config_inst.x("efficiency_maps", {})
+        histograms = {}
+        for name, variable_names in self.get_efficiency_hist_variables().items():
+            variable_insts = [self.config_inst.get_variable(variable_name) for variable_name in variable_names]
+            create_func = SparseHist.from_variables if name in maps else create_hist
+            histograms[name] = create_func(variable_insts)
+
+        if self.threshold_scan:
+            scan = self.config_inst.x.threshold_scan
+            for variable_name in scan.variables:
+                histograms[f"scan__{variable_name}"] = create_scan_hist(
+                    [self.config_inst.get_variable(variable_name)],
+                    scan.min_quals,
+                    scan.l1_pt_edges,
+                )
+
+        denom_cat = self.config_inst.get_category("valid_probe")
+        histograms["lumi"] = LumiEfficiency(
+            [denom_cat.id] + [
+                cat_inst.id
+                for cat_inst in self.config_inst.get_leaf_categories()
+                if cat_inst.x("trigger", None)
+            ],
+            denom_category=denom_cat.id,
+        )
+
+        if self.sweep_variants:
+            histograms = {
+                variant_key(variant, name): h.copy()
+                for variant in self.sweep_variants
+                for name, h in histograms.items()
+            }
+
+        return histograms
+
+    def get_variant_hists(self, histograms: dict, variant: str | None) -> dict:
+        """
+        Returns the efficiency *histograms* of the *variant*, mapped to names without the variant
+        prefix. Histograms are not copied.
+        """
+        if variant is None:
+            return histograms
+
+        prefix = variant_key(variant, "")
+        return {name[len(prefix):]: h for name, h in histograms.items() if name.startswith(prefix)}
+
+    def fill_efficiency_hists(
+        self,
+        histograms: dict,
+        events: ak.Array,
+        event_table: ak.Array | None = None,
+    ) -> None:
+        """
+        Assigns trigger categories to the reduced probe *events* and fills them into the
+        *histograms* of all probe variables, efficiency maps and threshold scans as well as into the
+        probe counts per luminosity block. When given, columns of the *event_table* are joined to
+        the probes first.
+        """
+        from l1m.columnar_util import join_events
+        from l1m.efficiency.hists import fill_hist
+        from l1m.efficiency.threshold_scan import fill_scan_hist
+
+        if event_table is not None:
+            events = join_events(events, event_table)
+
+        probes = self.efficiency_producer_inst(events)
+        weight = probes.mc_weight if self.dataset_inst.is_mc else None
+        hist_variables = self.get_efficiency_hist_variables()
+
+        # scan histograms only contain probes of the denominator category
+        if self.threshold_scan:
+            denom_cat = self.config_inst.get_category(self.config_inst.x.threshold_scan.denom_category)
+            denom_mask = ak.to_numpy(ak.any(probes.category_ids == denom_cat.id, axis=1))
+            denom_probes = probes[denom_mask]
+            denom_weight = None if weight is None else weight[denom_mask]
+
+        for name, h in histograms.items():
+            if name == "lumi":
+                h.fill(probes.run, probes.luminosityBlock, probes.PV.npvs, probes.category_ids)
+                continue
+
+            if name.startswith("scan__"):
+                fill_scan_hist(
+                    h,
+                    denom_probes,
+                    [self.config_inst.get_variable(name[len("scan__"):])],
+                    shift_id=self.global_shift_inst.id,
+                    weight=denom_weight,
+                )
+                continue
+
+            fill_hist(
+                h,
+                probes,
+                [self.config_inst.get_variable(variable_name) for variable_name in hist_variables[name]],
+                shift_id=self.global_shift_inst.id,
+                weight=weight,
+            )
+
+
+class MergeCutflows(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+    law.tasks.ForestMerge,
+    RemoteWorkflow,
+):
+    """
+    Tree-merges the binary cutflows of all :py:class:`CustomReduceEvents` branches of a dataset.
+    """
+
+    sandbox = dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh")
+
+    # recursively merge 50 cutflows into one
+    merge_factor = 50
+
+    # upstream requirements
+    reqs = Requirements(
+        RemoteWorkflow.reqs,
+        CustomReduceEvents=CustomReduceEvents,
+    )
+
+    def create_branch_map(self):
+        # DatasetTask implements a custom branch map, but we want to use the one in ForestMerge
+        return law.tasks.ForestMerge.create_branch_map(self)
+
+    def merge_workflow_requires(self):
+        return self.reqs.CustomReduceEvents.req(self, _exclude={"branches"})
+
+    def merge_requires(self, start_branch, end_branch):
+        return self.reqs.CustomReduceEvents.req(self, branches=((start_branch, end_branch),))
+
+    def trace_merge_inputs(self, inputs):
+        return super().trace_merge_inputs(inputs["collection"].targets.values())
+
+    def merge_output(self):
+        return {"cutflow": self.target("cutflow.npz")}
+
+    def merge(self, inputs, output):
+        cutflows = []
+        for inp in inputs:
+            with inp["cutflow"].open("rb") as f:
+                cutflows.append(Cutflow.load(f))
+        cutflow = Cutflow.merge(cutflows)
+
+        with output["cutflow"].open("wb") as f:
+            cutflow.dump(f)
+
+        # print the final cutflow
+        if self.is_root():
+            for step in cutflow.steps:
+                self.publish_message(f"{step:<20} {cutflow.n_events(step):>12}")
+
+
+class DaskReduceEvents(
+    L1MTask,
+    SelectorStepsMixin,
+    CalibratorsMixin,
+    DatasetTask,
+):
+    """
+    Alternative execution backend of :py:class:`CustomReduceEvents` that reduces all incomplete
+    branches of a dataset in a single dask graph, executed on a local multi-process cluster or an
+    existing (multi-node) dask scheduler. Each chunk of each branch is one node of the graph that
+    reads and reduces the chunk in a worker, and one node per branch writes the results of all its
+    chunks in chunk order into exactly the outputs of the :py:class:`CustomReduceEvents` branch, so
+    that all downstream tasks consume them unchanged.
+
+    Worker processes instantiate the branch tasks themselves and must be able to import this
+    analysis and reach its input and output locations.
+    """
+
+    online_efficiency = CustomReduceEvents.online_efficiency.copy()
+    partition_size = CustomReduceEvents.partition_size.copy()
+    cutflow_per_lumi = CustomReduceEvents.cutflow_per_lumi.copy()
+    threshold_scan = CustomReduceEvents.threshold_scan.copy()
+    probe_table = CustomReduceEvents.probe_table.copy()
+    staged_read = CustomReduceEvents.staged_read.copy()
+    decompression_threads = CustomReduceEvents.decompression_threads.copy()
+    memory_budget = CustomReduceEvents.memory_budget.copy()
+
+    scheduler = luigi.Parameter(
+        default=law.config.get_expanded("analysis", "reduction_dask_scheduler", None) or law.NO_STR,
+        significant=False,
+        description="address of an existing dask scheduler, e.g. tcp://host:8786; when empty, a "
+        "local cluster is started; default: value of 'reduction_dask_scheduler' in the law config "
+        "or empty",
+    )
+    n_workers = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_dask_workers", 0),
+        significant=False,
+        description="number of worker processes of the local cluster, 0 for one per CPU; default: "
+        "value of 'reduction_dask_workers' in the law config or 0",
+    )
+    threads_per_worker = luigi.IntParameter(
+        default=law.config.get_expanded_int("analysis", "reduction_dask_threads_per_worker", 1),
+        significant=False,
+        description="number of threads per worker process of the local cluster; note that selectors "
+        "are not guaranteed to be thread-safe; default: value of "
+        "'reduction_dask_threads_per_worker' in the law config or 1",
+    )
+    memory_limit = luigi.Parameter(
+        default=law.config.get_expanded("analysis", "reduction_dask_memory_limit", "auto"),
+        significant=False,
+        description="memory limit per worker process of the local cluster, e.g. 4GB; default: "
+        "value of 'reduction_dask_memory_limit' in the law config or auto",
+    )
+
+    sandbox = dev_sandbox("bash::$L1M_BASE/sandboxes/example.sh")
+
+    # upstream requirements
+    reqs = Requirements(
+        CustomReduceEvents=CustomReduceEvents,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # same restriction as for multiple processes in CustomReduceEvents
+        if self.calibrators:
+            raise Exception(
+                f"{self.__class__.__name__} does not support calibrators, but got "
+                f"{self.calibrators}",
+            )
+
+        # workflow whose branches are processed
+        self.reduce_task = self.reqs.CustomReduceEvents.req(self, n_processes=1, profile=False)
+
+    def requires(self):
+        return self.reduce_task.workflow_requires()
+
+    def output(self):
+        return self.reduce_task.output()
+
+    @contextlib.contextmanager
+    def create_client(self):
+        """
+        Context manager that yields a dask client connected to the :py:attr:`scheduler` or, when
+        not set, to a local cluster of :py:attr:`n_workers` processes.
+        """
+        from distributed import Client, LocalCluster
+
+        if self.scheduler not in (None, law.NO_STR, ""):
+            with Client(self.scheduler) as client:
+                yield client
+            return
+
+        with LocalCluster(
+            n_workers=self.n_workers if self.n_workers > 0 else os.cpu_count(),
+            threads_per_worker=self.threads_per_worker,
+            memory_limit=self.memory_limit,
+            processes=True,
+        ) as cluster, Client(cluster) as client:
+            yield client
+
+    @law.decorator.log
+    @ensure_proxy
+    def run(self):
+        import dask
+        from distributed import as_completed
+
+        # only process incomplete branches, whose tasks are created by workers with these parameters
+        branch_params = {
+            branch: task.param_kwargs
+            for branch, task in self.reduce_task.get_branch_tasks().items()
+            if not task.complete()
+        }
+        if not branch_params:
+            self.publish_message("all branches complete")
+            return
+
+        with self.create_client() as client:
+            self.publish_message(f"dask dashboard: {client.dashboard_link}")
+
+            # determine all chunk positions of all branches (only file headers are read)
+            with self.publish_step(f"determine chunks of {len(branch_params)} branches ..."):
+                futures = client.map(_get_chunk_positions_dask, list(branch_params.values()), pure=False)
+                chunks = dict(zip(branch_params, client.gather(futures)))
+
+            # one node per chunk that reduces it and one per branch that writes the results
+            writes = []
+            for branch, params in branch_params.items():
+                keys = sorted(chunks[branch])
+                chunk_results = [
+                    dask.delayed(_reduce_chunk_dask, pure=True)(params, key, chunks[branch][key])
+                    for key in keys
+                ]
+                writes.append(dask.delayed(_write_branch_dask, pure=True)(params, keys, chunk_results))
+
+            n_chunks = sum(map(len, chunks.values()))
+            msg = f"reduce {n_chunks} chunks of {len(writes)} branches ..."
+            futures = client.compute(writes)
+            for future in self.iter_progress(as_completed(futures), len(futures), msg=msg):
+                # raise errors of workers
+                future.result()
+
+
+def variant_key(variant: str | None, name: str) -> str:
+    """
+    Returns the key of the output table or histogram with *name* of the selection *variant* in the
+    sweep mode of :py:class:`CustomReduceEvents`, which is *name* itself when *variant* is *None*.
+    """
+    return name if variant is None else f"{variant}/{name}"
+
+
+# task instance used in worker processes of CustomReduceEvents.process_chunks_multiprocess
+_chunk_worker_task = None
+
+
+def _init_chunk_worker(task: CustomReduceEvents) -> None:
+    global _chunk_worker_task
+    _chunk_worker_task = task
+
+
+def _process_chunk_in_worker(*args) -> tuple:
+    return _chunk_worker_task.process_chunk_in_worker(*args)
+
+
+# lock guarding the setup of task instances in threads of dask workers of DaskReduceEvents
+_dask_worker_lock = threading.Lock()
+
+
+def _get_dask_worker_task(params: dict) -> CustomReduceEvents:
+    # task instances are cached by luigi, so the selector setup runs once per worker process
+    with _dask_worker_lock:
+        task = CustomReduceEvents(**params)
+        if getattr(task, "chunk_context", None) is None:
+            task.setup_chunk_context(task.requires(), task.input())
+            task.worker_inputs = {}
+            task.worker_files = {}
+    return task
+
+
+def _get_chunk_positions_dask(params: dict) -> dict:
+    task = _get_dask_worker_task(params)
+    return task.get_chunk_positions(list(task.iter_entry_ranges(task.requires()["lfns"])))
+
+
+def _reduce_chunk_dask(params: dict, key: tuple[int, int], pos: tuple) -> tuple:
+    task = _get_dask_worker_task(params)
+
+    # resolve the input file in this worker
+    lfn_index = key[0]
+    if lfn_index not in task.worker_inputs:
+        lfn_task = task.requires()["lfns"]
+        [(_, task.worker_inputs[lfn_index])] = lfn_task.iter_nano_files(task, lfn_indices=[lfn_index])
+
+    return task.process_chunk_in_worker(key, pos)[:4]
 
-                # optional check for finite values
-                if self.check_finite:
-                    self.raise_if_not_finite(events)
 
-                # save additional columns as parquet via a thread in the same pool
-                chunk = tmp_dir.child(f"cols_{lfn_index}_{pos.index}.parquet", type="f")
-                column_chunks[(lfn_index, pos.index)] = chunk
-                self.chunked_io.queue(sorted_ak_to_parquet, (events, chunk.path))
+def _write_branch_dask(params: dict, keys: list[tuple[int, int]], chunk_results: list[tuple]) -> None:
+    _get_dask_worker_task(params).write_chunk_results(dict(zip(keys, chunk_results)))
 
-        # merge the column files
-        if write_columns:
-            sorted_chunks = [column_chunks[key] for key in sorted(column_chunks)]
-            law.pyarrow.merge_parquet_task(self, sorted_chunks, outputs["events"], local=True)
 
-        # save stats
-        outputs["stats"].dump(stats, indent=4, formatter="json")
+# let cf tasks require CustomReduceEvents, now that it is defined
+patch_all()
@@ -15,5 +15,14 @@ base = os.path.normpath(os.path.join(os.path.abspath(__file__), "../.."))
 sys.path.append(base)
 import l1m  # noqa
 
+# import columnflow first as law does, which loads the analysis modules configured in law.cfg
+import columnflow  # noqa
+
 # import all tests
-# ...
+from .test_matching import *
+from .test_cutflow import *
+from .test_efficiency import *
+from .test_incremental import *
+from .test_benchmark import *
+from .test_file_util import *
+from .test_external import *
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+
+__all__ = ["BenchmarkTest"]
+
+import unittest
+
+import numpy as np
+
+from l1m.benchmark.reduction import run_steps, compare_to_baseline
+from l1m.benchmark.synthetic import generate_events
+
+
+def reduce_twice(events, profiler):
+    # applies the same two steps to the events and again to their result
+    for _ in range(2):
+        lap = profiler.laps()
+        events = events[events.event % 2 == 0]
+        lap("even_events", events)
+        events = events[:len(events) // 2]
+        lap("first_half", events)
+    lap("summary")
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_generate_events(self):
+        events = generate_events(500, seed=3)
+        self.assertEqual(len(events), 500)
+        self.assertEqual(events.Muon.pt.tolist(), generate_events(500, seed=3).Muon.pt.tolist())
+
+    def test_run_steps(self):
+        events = generate_events(1000, seed=0)
+        results = run_steps(events, reduce_twice, n_repetitions=2)
+
+        self.assertEqual(list(results), ["even_events", "first_half", "summary"])
+        for res in results.values():
+            self.assertGreaterEqual(res["time"], 0)
+            self.assertGreaterEqual(res["peak_memory"], 0)
+
+        # repeated steps are summed over their occurrences
+        rows = []
+        event = np.asarray(events.event)
+        for _ in range(2):
+            event = event[event % 2 == 0]
+            rows.append(len(event))
+            event = event[:len(event) // 2]
+            rows.append(len(event))
+        even, half = results["even_events"], results["first_half"]
+        self.assertEqual((even["n_calls"], half["n_calls"]), (2, 2))
+        self.assertEqual(even["n_in"], 1000 + rows[1])
+        self.assertEqual(even["n_out"], rows[0] + rows[2])
+        self.assertEqual(half["n_in"], even["n_out"])
+        self.assertEqual(half["n_out"], rows[1] + rows[3])
+
+        # steps without a result keep the number of rows
+        self.assertEqual(results["summary"]["n_in"], results["summary"]["n_out"])
+
+    def test_compare_to_baseline(self):
+        baseline = {
+            "muon_pair": {"time": 1.0, "peak_memory": 100},
+            "probe_match": {"time": 2.0, "peak_memory": 0},
+        }
+        results = {
+            "muon_pair": {"time": 1.1, "peak_memory": 150},
+            "probe_match": {"time": 2.5, "peak_memory": 50},
+            "flattening": {"time": 5.0, "peak_memory": 500},
+        }
+
+        regressions = compare_to_baseline(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("muon_pair: peak_memory increased by 50.0%"))
+        self.assertTrue(regressions[1].startswith("probe_match: time increased by 25.0%"))
+
+        self.assertEqual(compare_to_baseline(results, baseline, threshold=0.6), [])
+        self.assertEqual(len(compare_to_baseline(results, baseline, threshold=0.0, metrics=("time",))), 2)
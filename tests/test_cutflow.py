@@ -0,0 +1,113 @@
+# coding: utf-8
+
+
+__all__ = ["CutflowTest"]
+
+import io
+import unittest
+
+import numpy as np
+
+from l1m.reduction.cutflow import Cutflow, variant_step
+
+
+class CutflowTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 1000
+        self.process_id = rng.choice([1, 2, 3], n)
+        self.weight = rng.normal(1.0, 0.2, n)
+        self.run = rng.choice([367100, 367101], n)
+        self.lumi = rng.integers(1, 20, n)
+        self.masks = {"all": np.ones(n, dtype=bool), "muon_pair": rng.random(n) < 0.5}
+        self.masks["selected"] = self.masks["muon_pair"] & (rng.random(n) < 0.5)
+
+    def fill(self, cutflow, sl=slice(None), steps=None):
+        for step in steps or self.masks:
+            mask = self.masks[step][sl]
+            cutflow.fill(
+                step,
+                self.process_id[sl][mask],
+                weight=self.weight[sl][mask],
+                run=self.run[sl][mask],
+                lumi=self.lumi[sl][mask],
+            )
+        return cutflow
+
+    def assert_equal_cutflows(self, cutflow, ref):
+        self.assertEqual(cutflow.steps, ref.steps)
+        np.testing.assert_array_equal(cutflow.process_ids, ref.process_ids)
+        np.testing.assert_array_equal(cutflow.counts, ref.counts)
+        np.testing.assert_allclose(cutflow.weights, ref.weights)
+        np.testing.assert_array_equal(cutflow.lumi_keys, ref.lumi_keys)
+        np.testing.assert_array_equal(cutflow.lumi_counts, ref.lumi_counts)
+
+    def test_fill(self):
+        cutflow = self.fill(Cutflow(by_lumi=True))
+
+        self.assertEqual(cutflow.steps, ["all", "muon_pair", "selected"])
+        for step, mask in self.masks.items():
+            self.assertEqual(cutflow.n_events(step), mask.sum())
+            self.assertEqual(cutflow.n_events(step, 2), (mask & (self.process_id == 2)).sum())
+            self.assertAlmostEqual(cutflow.sum_weights(step), self.weight[mask].sum())
+
+        table = cutflow.lumi_table("selected")
+        self.assertEqual(table["n_events"].sum(), self.masks["selected"].sum())
+        mask = self.masks["selected"] & (self.run == 367101) & (self.lumi == 5)
+        row = (table["run"] == 367101) & (table["lumi"] == 5)
+        self.assertEqual(table["n_events"][row].sum(), mask.sum())
+
+    def test_merge(self):
+        ref = self.fill(Cutflow(by_lumi=True))
+
+        # chunks with different step orders and processes
+        chunks = [
+            self.fill(Cutflow(by_lumi=True), slice(0, 300)),
+            self.fill(Cutflow(by_lumi=True), slice(300, 700), steps=["muon_pair", "all", "selected"]),
+            self.fill(Cutflow(by_lumi=True), slice(700, None)),
+        ]
+        self.assert_equal_cutflows(Cutflow.merge(chunks), ref)
+
+        added = Cutflow(by_lumi=True)
+        for chunk in chunks:
+            added += chunk
+        self.assert_equal_cutflows(added, ref)
+
+    def test_to_stats(self):
+        cutflow = self.fill(Cutflow())
+        stats = cutflow.to_stats(is_mc=True)
+
+        self.assertEqual(stats["n_events"], len(self.process_id))
+        self.assertEqual(stats["n_events_muon_pair"], self.masks["muon_pair"].sum())
+        self.assertAlmostEqual(stats["sum_mc_weight_selected"], self.weight[self.masks["selected"]].sum())
+        mask = self.masks["selected"]
+        self.assertEqual(set(stats["sum_mc_weight_per_process"]), set(self.process_id[mask].tolist()))
+        self.assertAlmostEqual(
+            stats["sum_mc_weight_per_process"][1],
+            self.weight[mask & (self.process_id == 1)].sum(),
+        )
+
+        stats = cutflow.to_stats(norm_step="all")
+        self.assertNotIn("sum_mc_weight", stats)
+        self.assertNotIn("sum_mc_weight_per_process", stats)
+
+    def test_variants(self):
+        cutflow = Cutflow()
+        cutflow.fill("all", self.process_id)
+        for variant, step in [("tight", "selected"), ("loose", "selected")]:
+            cutflow.fill(variant_step(variant, step), self.process_id[self.masks[step]])
+
+        tight = cutflow.for_variant("tight")
+        self.assertEqual(tight.steps, ["all", "selected"])
+        self.assertEqual(tight.n_events("selected"), self.masks["selected"].sum())
+
+    def test_dump_load(self):
+        cutflow = self.fill(Cutflow(by_lumi=True))
+        f = io.BytesIO()
+        cutflow.dump(f)
+        f.seek(0)
+        loaded = Cutflow.load(f)
+
+        self.assertTrue(loaded.by_lumi)
+        self.assert_equal_cutflows(loaded, cutflow)
@@ -0,0 +1,152 @@
+# coding: utf-8
+
+
+__all__ = ["SparseHistTest", "LumiEfficiencyTest"]
+
+import io
+import unittest
+
+import numpy as np
+import awkward as ak
+import hist
+import order as od
+
+from l1m.efficiency.hists import create_hist, fill_hist
+from l1m.efficiency.lumi import LumiEfficiency
+from l1m.efficiency.sparse import SparseHist
+
+
+def generate_probes(n: int, seed: int = 0) -> ak.Array:
+    # flat probes with jagged, unique category ids, a process id and event-level lumi columns
+    rng = np.random.default_rng(seed)
+    in_cat = rng.random((n, 4)) < 0.6
+    cat_ids = np.broadcast_to(np.array([100, 201, 202, 203]), in_cat.shape)
+    return ak.zip({
+        "category_ids": ak.unflatten(cat_ids[in_cat], in_cat.sum(axis=1)),
+        "process_id": rng.choice([1, 2], n),
+        "run": rng.choice([367100, 367105, 367200], n),
+        "luminosityBlock": rng.integers(1, 50, n),
+        "npvs": rng.poisson(30, n),
+        "ProbeMuon": ak.zip({
+            "pt": rng.exponential(30.0, n),
+            "eta": rng.uniform(-2.6, 2.6, n),
+        }),
+    }, depth_limit=1)
+
+
+class SparseHistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.variable_insts = [
+            od.Variable("probe_pt", expression="ProbeMuon.pt", binning=[0, 10, 20, 30, 50, 100]),
+            od.Variable("probe_eta", expression="ProbeMuon.eta", binning=(10, -2.5, 2.5)),
+        ]
+        self.probes = generate_probes(2000)
+        self.weight = np.random.default_rng(1).normal(1.0, 0.1, len(self.probes))
+
+    def assert_equal_hists(self, h, ref):
+        # compare bins per category and process, whose axes can be in different orders
+        for name in ("category", "process"):
+            self.assertEqual(sorted(h.axes[name]), sorted(ref.axes[name]))
+        for cat in ref.axes["category"]:
+            for proc in ref.axes["process"]:
+                loc = {"category": hist.loc(cat), "process": hist.loc(proc)}
+                np.testing.assert_allclose(h[loc].view(flow=True).value, ref[loc].view(flow=True).value)
+                np.testing.assert_allclose(h[loc].view(flow=True).variance, ref[loc].view(flow=True).variance)
+
+    def test_fill_project(self):
+        ref = create_hist(self.variable_insts)
+        fill_hist(ref, self.probes, self.variable_insts, shift_id=0, weight=self.weight)
+        h = SparseHist.from_variables(self.variable_insts)
+        fill_hist(h, self.probes, self.variable_insts, shift_id=0, weight=self.weight)
+
+        self.assertLess(h.n_bins, np.prod(h.shape))
+        self.assert_equal_hists(h.project("probe_pt", "probe_eta"), ref)
+        self.assert_equal_hists(h.project("probe_eta"), ref.project("category", "process", "shift", "probe_eta"))
+
+    def test_add(self):
+        h = SparseHist.from_variables(self.variable_insts)
+        fill_hist(h, self.probes, self.variable_insts, shift_id=0)
+
+        # parts with categories in different orders
+        parts = []
+        for sl in [slice(0, 500), slice(500, 1200), slice(1200, None)]:
+            part = SparseHist.from_variables(self.variable_insts)
+            fill_hist(part, self.probes[sl], self.variable_insts, shift_id=0)
+            parts.append(part)
+        added = parts[2] + parts[0]
+        added += parts[1]
+
+        self.assert_equal_hists(added.project("probe_pt", "probe_eta"), h.project("probe_pt", "probe_eta"))
+
+        with self.assertRaises(ValueError):
+            added += SparseHist.from_variables(self.variable_insts[:1])
+
+
+class LumiEfficiencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.probes = generate_probes(3000)
+        self.category_ids = [100, 201, 202]
+
+    def fill(self, probes):
+        acc = LumiEfficiency(self.category_ids, denom_category=100)
+        acc.fill(probes.run, probes.luminosityBlock, probes.npvs, probes.category_ids)
+        return acc
+
+    def count(self, category_id, mask=True):
+        in_cat = ak.to_numpy(ak.any(self.probes.category_ids == category_id, axis=1))
+        return int((in_cat & mask).sum())
+
+    def test_fill(self):
+        acc = self.fill(self.probes)
+
+        self.assertEqual(acc.runs.tolist(), [367100, 367105, 367200])
+        num, denom, eff = acc.efficiency(201)
+        self.assertEqual((num, denom), (self.count(201), self.count(100)))
+        self.assertAlmostEqual(eff, num / denom)
+
+        # untracked categories are skipped
+        self.assertEqual(acc.counts.sum(), sum(self.count(c) for c in self.category_ids))
+
+    def test_ranges(self):
+        acc = self.fill(self.probes)
+        run = ak.to_numpy(self.probes.run)
+        lumi = ak.to_numpy(self.probes.luminosityBlock)
+        npvs = ak.to_numpy(self.probes.npvs)
+
+        mask = (run >= 367100) & (run <= 367105) & (lumi >= 10) & (lumi <= 20) & (npvs <= 30)
+        num, denom, _ = acc.efficiency(202, runs=(367100, 367105), lumis=(10, 20), npvs=(0, 30))
+        self.assertEqual((num, denom), (self.count(202, mask), self.count(100, mask)))
+
+        selected = acc.select(runs=(367200, 367200))
+        self.assertEqual(selected.runs.tolist(), [367200])
+        self.assertEqual(selected.efficiency(100)[0], self.count(100, run == 367200))
+
+        edges, counts = acc.binned_counts("npvs", edges=[0, 20, 30, 40, 100])
+        self.assertEqual(len(edges), 5)
+        in_bin = (npvs >= 30) & (npvs < 40)
+        self.assertEqual(counts[acc.category_index(201), 2], self.count(201, in_bin))
+
+    def test_merge(self):
+        ref = self.fill(self.probes)
+        parts = [self.fill(self.probes[sl]) for sl in [slice(0, 1000), slice(1000, 1500), slice(1500, None)]]
+
+        for acc in [LumiEfficiency.merge(parts), parts[2] + parts[0] + parts[1]]:
+            np.testing.assert_array_equal(acc.keys, ref.keys)
+            np.testing.assert_array_equal(acc.counts, ref.counts)
+
+        with self.assertRaises(ValueError):
+            ref += LumiEfficiency([100, 201], denom_category=100)
+
+    def test_dump_load(self):
+        acc = self.fill(self.probes)
+        f = io.BytesIO()
+        acc.dump(f)
+        f.seek(0)
+        loaded = LumiEfficiency.load(f)
+
+        self.assertEqual(loaded.category_ids.tolist(), self.category_ids)
+        self.assertEqual(loaded.denom_category, 100)
+        np.testing.assert_array_equal(loaded.keys, acc.keys)
+        np.testing.assert_array_equal(loaded.counts, acc.counts)
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+
+__all__ = ["PartitionTest"]
+
+import math
+import unittest
+
+from l1m.tasks.external import partition_entries, partition_merge_factor
+
+
+class PartitionTest(unittest.TestCase):
+
+    def test_partition_entries(self):
+        entries = [10, 5, 30, 0, 7]
+        partitions = partition_entries(entries, 20)
+        self.assertEqual(partitions[:3], [[(0, 0, 10), (1, 0, 5), (2, 0, 5)], [(2, 5, 25)], [(2, 25, 30), (4, 0, 7)]])
+        self.assertEqual(sum(stop - start for p in partitions for _, start, stop in p), sum(entries))
+
+    def test_partition_merge_factor(self):
+        # 100 files in 20 partitions of 100MB, merged into files of 500MB
+        merge_factor = partition_merge_factor(100.0, 500.0, 100, 20)
+        self.assertEqual(merge_factor, 25)
+        self.assertEqual(math.ceil(100 / merge_factor), 4)
+
+        # partitions larger than merged files are not split across more merged files than partitions
+        for n_files, n_partitions in [(100, 10), (7, 3), (3, 7)]:
+            merge_factor = partition_merge_factor(2000.0, 500.0, n_files, n_partitions)
+            self.assertLessEqual(math.ceil(n_files / merge_factor), n_partitions)
+            self.assertLessEqual(merge_factor, n_files)
+
+        # small partitions are merged into a single file at most
+        self.assertEqual(partition_merge_factor(1.0, 500.0, 10, 30), 10)
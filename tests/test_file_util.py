@@ -0,0 +1,55 @@
+# coding: utf-8
+
+
+__all__ = ["LFNIndexTest"]
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import uproot
+
+from l1m.file_util import LFNIndex
+
+
+class LFNIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, "nano")
+        os.makedirs(self.directory)
+        self.index_path = os.path.join(self.tmp_dir.name, "index.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, n, mtime):
+        path = os.path.join(self.directory, name)
+        with uproot.recreate(path) as f:
+            f["Events"] = {"event": np.arange(n, dtype=np.int64)}
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_load(self):
+        paths = [self.write("nano_1.root", 10, 1000), self.write("nano_2.root", 20, 1000)]
+        index = LFNIndex(self.directory, self.index_path)
+        self.assertEqual(index.lfns, paths)
+        self.assertEqual(index.entries(paths), [10, 20])
+        fingerprints = index.fingerprints(paths)
+
+        # files overwritten in place do not change the directory, but their entries
+        dir_mtime = os.stat(self.directory).st_mtime
+        self.write("nano_2.root", 30, 2000)
+        os.utime(self.directory, (dir_mtime, dir_mtime))
+        index = LFNIndex(self.directory, self.index_path)
+        with self.assertLogs("l1m.file_util", "INFO") as logs:
+            self.assertEqual(index.entries(paths), [10, 30])
+        self.assertIn("(1 opened)", logs.output[0])
+        self.assertEqual(index.fingerprints(paths)[0], fingerprints[0])
+        self.assertNotEqual(index.fingerprints(paths)[1], fingerprints[1])
+
+        # unchanged indices are read without rebuilding
+        index = LFNIndex(self.directory, self.index_path)
+        with self.assertNoLogs("l1m.file_util", "INFO"):
+            self.assertEqual(index.entries(paths), [10, 30])
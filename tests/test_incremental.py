@@ -0,0 +1,45 @@
+# coding: utf-8
+
+
+__all__ = ["ReductionLedgerTest"]
+
+import json
+import unittest
+
+from l1m.reduction.incremental import ReductionLedger
+
+
+class ReductionLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ledger = ReductionLedger()
+        self.ledger.add("/data/nano_1.root", "aaaa", source="branch")
+        self.ledger.add("/data/nano_2.root", "bbbb", source="branch")
+
+    def test_new_changed(self):
+        fingerprints = {"/data/nano_1.root": "aaaa", "/data/nano_2.root": "bbbb", "/data/nano_3.root": "cccc"}
+        self.assertEqual(self.ledger.new(fingerprints), ["/data/nano_3.root"])
+        self.assertEqual(self.ledger.changed(fingerprints), [])
+
+        # modified and removed files
+        fingerprints = {"/data/nano_1.root": "aaab", "/data/nano_3.root": "cccc"}
+        self.assertEqual(self.ledger.changed(fingerprints), ["/data/nano_1.root", "/data/nano_2.root"])
+
+    def test_lfns(self):
+        self.ledger.add("/data/nano_3.root", "cccc")
+        self.ledger.add("/data/nano_4.root", "dddd")
+        self.assertIn("/data/nano_3.root", self.ledger)
+        self.assertEqual(len(self.ledger), 4)
+
+        self.assertEqual(self.ledger.lfns()[0], "/data/nano_1.root")
+        self.assertEqual(self.ledger.lfns(source="update"), ["/data/nano_3.root", "/data/nano_4.root"])
+        self.assertEqual(self.ledger.lfns(source="branch"), ["/data/nano_1.root", "/data/nano_2.root"])
+
+    def test_to_dict(self):
+        self.ledger.add("/data/nano_3.root", "cccc")
+
+        # round trip through json keeps the order of files
+        ledger = ReductionLedger(json.loads(json.dumps(self.ledger.to_dict())))
+        self.assertEqual(list(ledger.files), list(self.ledger.files))
+        self.assertEqual(ledger.to_dict(), self.ledger.to_dict())
+        self.assertEqual(ledger.lfns(source="update"), ["/data/nano_3.root"])
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+
+__all__ = ["MatchingTest"]
+
+import unittest
+
+import numpy as np
+import awkward as ak
+
+from l1m.benchmark.synthetic import generate_events
+from l1m.reduction.matching import any_match, match_pairs, matched_objects, unique_matches
+
+
+def cartesian_pairs(coll_a: ak.Array, coll_b: ak.Array) -> tuple[ak.Array, ak.Array]:
+    # delta r and invariant mass of all pairs with the structure events * coll_a * coll_b, computed
+    # in double precision from the float32 NanoAOD columns
+    a, b = ak.unzip(ak.cartesian([coll_a, coll_b], axis=1, nested=True))
+    a, b = [
+        ak.zip({field: ak.values_astype(coll[field], np.float64) for field in ("pt", "eta", "phi", "mass")})
+        for coll in (a, b)
+    ]
+    dphi = (a.phi - b.phi + np.pi) % (2 * np.pi) - np.pi
+    dr = np.sqrt((a.eta - b.eta)**2 + dphi**2)
+
+    px = a.pt * np.cos(a.phi) + b.pt * np.cos(b.phi)
+    py = a.pt * np.sin(a.phi) + b.pt * np.sin(b.phi)
+    pz = a.pt * np.sinh(a.eta) + b.pt * np.sinh(b.eta)
+    e_a = np.sqrt((a.pt * np.cosh(a.eta))**2 + a.mass**2)
+    e_b = np.sqrt((b.pt * np.cosh(b.eta))**2 + b.mass**2)
+    m_inv = np.sqrt(np.maximum((e_a + e_b)**2 - px**2 - py**2 - pz**2, 0.0))
+
+    return dr, m_inv
+
+
+class MatchingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        events = generate_events(2000, seed=1)
+        cls.muon = events.Muon
+        cls.l1mu = events.L1Mu
+
+    def assert_pairs(self, result, coll_a, coll_b, mask, dr, m_inv):
+        # compare a MatchResult to the mask of accepted pairs of the cartesian product
+        self.assertEqual(result.counts.tolist(), ak.flatten(ak.sum(mask, axis=2)).tolist())
+
+        local_index = ak.local_index(dr, axis=2)
+        self.assertEqual(result.index.tolist(), ak.flatten(local_index[mask], axis=None).tolist())
+        np.testing.assert_allclose(result.dr, ak.to_numpy(ak.flatten(dr[mask], axis=None)), rtol=1e-6)
+        if m_inv is None:
+            self.assertTrue(np.isnan(result.m_inv).all())
+        else:
+            np.testing.assert_allclose(result.m_inv, ak.to_numpy(ak.flatten(m_inv[mask], axis=None)), rtol=1e-5)
+
+        # flat indices point to the same objects in the flat content of b
+        n_b = ak.num(coll_b, axis=1)
+        flat_b = ak.unflatten(np.arange(ak.sum(n_b)), n_b)
+        flat_index = ak.cartesian([ak.local_index(coll_a, axis=1), flat_b], axis=1, nested=True)["1"]
+        self.assertEqual(result.flat_index.tolist(), ak.flatten(flat_index[mask], axis=None).tolist())
+
+    def test_any_match(self):
+        dr, _ = cartesian_pairs(self.muon, self.l1mu)
+        for max_dr in (0.1, 0.4):
+            mask = any_match(self.muon, self.l1mu, max_dr)
+            self.assertEqual(ak.num(mask, axis=1).tolist(), ak.num(self.muon, axis=1).tolist())
+            self.assertEqual(mask.tolist(), ak.any(dr < max_dr, axis=2).tolist())
+
+    def test_match_pairs_dr(self):
+        dr, _ = cartesian_pairs(self.muon, self.l1mu)
+        result = match_pairs(self.muon, self.l1mu, dr_range=(-np.inf, 0.4))
+        self.assertEqual(result.dr.dtype, np.float32)
+        self.assert_pairs(result, self.muon, self.l1mu, dr < 0.4, dr, None)
+
+    def test_match_pairs_dr_mass(self):
+        dr, m_inv = cartesian_pairs(self.muon, self.muon)
+        result = match_pairs(self.muon, self.muon, dr_range=(0.8, np.inf), mass_range=(81, 101))
+        mask = (dr > 0.8) & (m_inv > 81) & (m_inv < 101)
+        self.assertGreater(ak.sum(mask), 0)
+        self.assert_pairs(result, self.muon, self.muon, mask, dr, m_inv)
+
+    def test_match_pairs_collinear(self):
+        # objects with identical kinematics must match each other, also with a mass window
+        result = match_pairs(self.muon, self.muon, dr_range=(-np.inf, 1e-6))
+        self.assertEqual(result.counts.tolist(), [1] * len(result.counts))
+        self.assertEqual(result.flat_index.tolist(), list(range(len(result.counts))))
+
+        mass = ak.to_numpy(ak.flatten(self.muon.mass))
+        result = match_pairs(self.muon, self.muon, dr_range=(-np.inf, 1e-6), mass_range=(0.0, 1.0))
+        self.assertEqual(result.counts.tolist(), [1] * len(result.counts))
+        np.testing.assert_allclose(result.m_inv, 2 * mass, rtol=1e-4)
+
+    def test_matched_objects(self):
+        dr, _ = cartesian_pairs(self.muon, self.l1mu)
+        result = match_pairs(self.muon, self.l1mu, dr_range=(-np.inf, 0.4))
+        matched = matched_objects(self.muon, self.l1mu, result)
+
+        pt = ak.cartesian([self.muon.pt, self.l1mu.pt], axis=1, nested=True)["1"]
+        self.assertEqual(matched.pt.tolist(), pt[dr < 0.4].tolist())
+
+    def test_unique_matches(self):
+        result = match_pairs(self.muon, self.l1mu, dr_range=(-np.inf, 0.4))
+        n_l1 = int(ak.sum(ak.num(self.l1mu, axis=1)))
+        pair = unique_matches(result, n_l1)
+
+        # each object is matched at most once and only to one of its own pairs
+        matched = pair >= 0
+        self.assertEqual(len(np.unique(result.flat_index[pair[matched]])), matched.sum())
+        owner = np.repeat(np.arange(len(result.counts)), result.counts)
+        self.assertEqual(owner[pair[matched]].tolist(), np.flatnonzero(matched).tolist())
+
+        # objects with pairs remain unmatched only when all their partners are taken
+        taken = np.zeros(n_l1, dtype=bool)
+        taken[result.flat_index[pair[matched]]] = True
+        for i in np.flatnonzero(~matched & (result.counts > 0)):
+            self.assertTrue(taken[result.flat_index[owner == i]].all())